@@ -23,3 +23,4 @@ admin.site.register(FavoriteMovie)
 admin.site.register(History)
 
 
+admin.site.register(ViewingSummary)
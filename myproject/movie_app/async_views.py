@@ -0,0 +1,165 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404
+from rest_framework.relations import ManyRelatedField
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from . import facets
+from .models import Country, Director, Actor, Genre, MovieLanguages, Moments
+from .routers import primary_reads
+from .views import (
+    movie_list_queryset, latest_ratings_queryset, FILMOGRAPHY_PREVIEW_SIZE, LATEST_RATINGS_SIZE,
+    MovieListAPIView, MovieDetailAPIView, CountryDetailAPIView, DirectorDetailAPIView, ActorDetailAPIView, GenreDetailAPIView
+)
+
+
+def in_own_connection(function):
+    def wrapper(*args):
+        try:
+            return function(*args)
+        finally:
+            # pool threads outlive the request and request_finished never reaches them
+            close_old_connections()
+    return wrapper
+
+
+def run_query(function, *args):
+    # With ASYNC_PARALLEL_QUERIES every call gets a pool thread and its own connection, so gathered
+    # queries really run side by side. Otherwise they share the request's connection one at a time.
+    if settings.ASYNC_PARALLEL_QUERIES:
+        return sync_to_async(in_own_connection(function), thread_sensitive=False)(*args)
+    return sync_to_async(function)(*args)
+
+
+async def gather_parts(**querysets):
+    results = await asyncio.gather(*(run_query(list, queryset) for queryset in querysets.values()))
+    return dict(zip(querysets, results))
+
+
+def attach(instance, name, objects):
+    # the same cache prefetch_related() fills, so serializers read the relation without a query
+    queryset = getattr(instance, name).all()
+    queryset._result_cache, queryset._prefetch_done = objects, True
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[name] = queryset
+
+
+class AsyncAPIView(APIView):
+    """APIView whose handlers are coroutines, for the ASGI deployment."""
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            # authentication loads the user from the database, permissions and throttles may too
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    def serialize(self, instance):
+        # serializers can be slow and the srcset fields look at the disk, neither belongs on the event loop
+        return self.get_serializer(instance).data
+
+
+class AsyncMovieListAPIView(AsyncAPIView, MovieListAPIView):
+    def get_page(self):
+        # filterset validation, the page query and the fast path's relation queries touch the database
+        queryset = self.filter_queryset(self.get_queryset())
+        return queryset, self.serialize_page(self.paginate_queryset(self.get_page_queryset(queryset)))
+
+    async def get(self, request, *args, **kwargs):
+        queryset, data = await run_query(self.get_page)
+        response = self.get_paginated_response(data)
+        if facets.requested(request):
+            await run_query(self.add_facets, response, queryset)
+        return response
+
+
+class AsyncMovieDetailAPIView(AsyncAPIView, MovieDetailAPIView):
+    async def get(self, request, pk, *args, **kwargs):
+        # rating aggregates are columns of the movie row, everything else is an independent query
+        relations = {
+            'country': Country.objects.filter(country_movies=pk),
+            'director': Director.objects.filter(director_movies=pk),
+            'actor': Actor.objects.filter(actor_movies=pk),
+            'genre': Genre.objects.filter(genre_movies=pk),
+            'movie_frames': Moments.objects.filter(movie_id=pk),
+            'movie_videos': MovieLanguages.objects.filter(movie_id=pk),
+            'latest_ratings': latest_ratings_queryset.filter(movie_id=pk)[:LATEST_RATINGS_SIZE],
+        }
+        # with ?fields= only the kept relations are read, the ones rendered as ids only by key
+        fields = {field.source: field for field in self.get_serializer().fields.values()}
+        parts = {'movie': self.get_queryset().prefetch_related(None).filter(pk=pk)}
+        for name, queryset in relations.items():
+            if isinstance(fields.get(name), ManyRelatedField):
+                parts[name] = queryset.select_related(None).only('pk')
+            elif name in fields:
+                parts[name] = queryset
+        parts = await gather_parts(**parts)
+        if not parts['movie']:
+            raise Http404
+        movie = parts.pop('movie')[0]
+        self.check_object_permissions(request, movie)
+        self.remember([movie])
+        movie.latest_ratings = parts.pop('latest_ratings', [])
+        for name, objects in parts.items():
+            attach(movie, name, objects)
+        return Response(await sync_to_async(self.serialize)(movie))
+
+
+class AsyncEntityDetailMixin:
+    async def get(self, request, pk, *args, **kwargs):
+        key, response = await sync_to_async(self.get_cached_response)(request)
+        if response is not None:
+            return response
+
+        parts = {'entity': self.get_queryset().prefetch_related(None).filter(pk=pk)}
+        preview = self.get_serializer().fields.get(f'{self.cache_scope}_movies')
+        if preview is not None:
+            parts['preview'] = movie_list_queryset.filter(**{self.cache_scope: pk}).order_by('-year', '-pk')[
+                :FILMOGRAPHY_PREVIEW_SIZE]
+            if isinstance(preview, ManyRelatedField):
+                parts['preview'] = parts['preview'].prefetch_related(None).only('pk')
+        with primary_reads():
+            parts = await gather_parts(**parts)
+        if not parts['entity']:
+            raise Http404
+        entity = parts['entity'][0]
+        entity.preview_movies = parts.get('preview', [])
+        return await sync_to_async(self.cache_entity)(key, entity)
+
+    def cache_entity(self, key, entity):
+        return self.cache_response(key, self.serialize(entity))
+
+
+class AsyncCountryDetailAPIView(AsyncEntityDetailMixin, AsyncAPIView, CountryDetailAPIView):
+    pass
+
+
+class AsyncDirectorDetailAPIView(AsyncEntityDetailMixin, AsyncAPIView, DirectorDetailAPIView):
+    pass
+
+
+class AsyncActorDetailAPIView(AsyncEntityDetailMixin, AsyncAPIView, ActorDetailAPIView):
+    pass
+
+
+class AsyncGenreDetailAPIView(AsyncEntityDetailMixin, AsyncAPIView, GenreDetailAPIView):
+    pass
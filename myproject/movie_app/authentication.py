@@ -0,0 +1,102 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import UserProfile
+
+# copied into both tokens at login, so permissions never load the user
+USER_CLAIMS = ('username', 'status', 'is_staff')
+# the jti of the refresh token an access token was issued with, logging out blacklists it
+SESSION_CLAIM = 'sid'
+MAX_SESSIONS = 10000
+
+
+def issue_tokens(user):
+    refresh = RefreshToken.for_user(user)
+    for claim in USER_CLAIMS:
+        refresh[claim] = getattr(user, claim)
+    access = refresh.access_token
+    access[SESSION_CLAIM] = refresh['jti']
+    return refresh, access
+
+
+class ProfileTokenUser(TokenUser):
+    @cached_property
+    def status(self):
+        return self.token['status']
+
+
+class SessionCache:
+    """
+    In-process cache of whether a login session is still valid: the user exists, is active, has
+    the status and staff flag the token claims and has not logged out. Each entry is read from the database at
+    most once per TOKEN_REVOCATION_CACHE_SECONDS, so another worker's logout or status change is
+    seen within that bound. Changes made in this process drop the affected entries right away.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def get_ttl(self):
+        return getattr(settings, 'TOKEN_REVOCATION_CACHE_SECONDS', 30)
+
+    def get(self, user_id, session):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.sessions.get(session)
+        if entry is None or entry[0] < now:
+            entry = (now + self.get_ttl(), str(user_id), *self.load(user_id, session))
+            with self.lock:
+                if len(self.sessions) >= MAX_SESSIONS:
+                    self.sessions.clear()
+                self.sessions[session] = entry
+        return entry[2:]
+
+    def load(self, user_id, session):
+        # (is_active, status, is_staff, logged_out) in one query, None when the user is gone
+        row = UserProfile.objects.filter(pk=user_id).annotate(
+            logged_out=Exists(BlacklistedToken.objects.filter(token__jti=session, token__user=OuterRef('pk')))
+        ).values_list('is_active', 'status', 'is_staff', 'logged_out').first()
+        return row or (False, None, False, True)
+
+    def forget_user(self, user_id):
+        with self.lock:
+            # token claims carry the id as a string
+            self.sessions = {key: entry for key, entry in self.sessions.items() if entry[1] != str(user_id)}
+
+    def forget_session(self, session):
+        with self.lock:
+            self.sessions.pop(session, None)
+
+    def clear(self):
+        with self.lock:
+            self.sessions.clear()
+
+
+sessions = SessionCache()
+
+
+class TokenUserAuthentication(JWTAuthentication):
+    """JWTAuthentication that trusts the claims issue_tokens() embeds instead of loading the user."""
+
+    def get_user(self, validated_token):
+        if SESSION_CLAIM not in validated_token or 'status' not in validated_token:
+            # tokens issued before the claims were embedded
+            return super().get_user(validated_token)
+        user_id = validated_token[api_settings.USER_ID_CLAIM]
+        is_active, status, is_staff, logged_out = sessions.get(user_id, validated_token[SESSION_CLAIM])
+        if not is_active or logged_out:
+            raise AuthenticationFailed('Сессия завершена', code='session_revoked')
+        if status != validated_token['status'] or is_staff != validated_token.get('is_staff', False):
+            raise AuthenticationFailed('Статус изменился, войдите снова', code='status_changed')
+        return ProfileTokenUser(validated_token)
@@ -0,0 +1,163 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.translation import get_language
+from rest_framework.response import Response
+
+from . import compression
+from .conditional import ConditionalGetMixin
+from .models import Movie
+from .routers import primary_reads
+
+# Cached responses are keyed on the generation of every scope they depend on:
+# 'country' for the country list, 'country:<pk>' for one country page and so on.
+# Invalidation replaces a scope's generation, so stale entries are never read
+# again and simply expire. This works the same on every cache backend.
+GENERATION_PREFIX = 'catalogue:gen:'
+RESPONSE_PREFIX = 'catalogue:resp:'
+ENTITY_FIELDS = ('country', 'genre', 'actor', 'director')
+
+
+def get_timeout():
+    return getattr(settings, 'CATALOGUE_CACHE_TIMEOUT', 60 * 60)
+
+
+def get_generations(scopes):
+    keys = [GENERATION_PREFIX + scope for scope in scopes]
+    generations = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in generations}
+    if missing:
+        cache.set_many(missing, None)
+        generations.update(missing)
+    return [generations[key] for key in keys]
+
+
+def bump(*scopes):
+    # after the commit, or a concurrent request could cache the old rows under the new generation
+    if scopes:
+        generations = {GENERATION_PREFIX + scope: uuid.uuid4().hex for scope in set(scopes)}
+        transaction.on_commit(lambda: cache.set_many(generations, None))
+
+
+def movie_scopes(movie_ids):
+    # detail pages of every country/genre/actor/director that lists one of these movies
+    scopes = []
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return scopes
+    for field in ENTITY_FIELDS:
+        through = getattr(Movie, field).through
+        related_ids = through.objects.filter(movie_id__in=movie_ids).values_list(f'{field}_id', flat=True)
+        scopes.extend(f'{field}:{pk}' for pk in set(related_ids))
+    return scopes
+
+
+def response_key(request, view_name, scopes):
+    language = getattr(request, 'LANGUAGE_CODE', None) or get_language()
+    # serializers build absolute media and link urls, so the host is part of the key
+    raw = '|'.join([request.get_host(), request.get_full_path(), *get_generations(scopes)])
+    return f'{RESPONSE_PREFIX}{view_name}:{language}:{hashlib.sha1(raw.encode()).hexdigest()}'
+
+
+class CachedResponseMixin(ConditionalGetMixin):
+    """
+    Cached responses keep their data and, for precompressed_formats, the rendered body in every
+    encoding clients asked for, so repeated hits skip serialization, rendering and compression.
+    """
+    cache_scope = None
+    # the response key already changes with every generation the response depends on
+    free_validators = True
+    precompressed_formats = ('json',)
+
+    def load_validators(self):
+        self.remember(extra=response_key(self.request, type(self).__name__, self.get_cache_scopes()))
+        return True
+
+    def get_cache_scopes(self):
+        lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if lookup is not None:
+            return [f'{self.cache_scope}:{lookup}']
+        return [self.cache_scope]
+
+    def get(self, request, *args, **kwargs):
+        key, response = self.get_cached_response(request)
+        if response is not None:
+            return response
+        with primary_reads():
+            response = super().get(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        return self.cache_response(key, response.data)
+
+    def get_cached_response(self, request):
+        # (key, response), the response is None on a miss, then cache_response(key, data) fills it in
+        key = response_key(request, type(self).__name__, self.get_cache_scopes())
+        response = self.get_stored_body(key)
+        if response is None:
+            data = cache.get(key)
+            if data is not None:
+                response = self.store_body(key, data) or Response(data)
+        return key, response
+
+    def cache_response(self, key, data):
+        cache.set(key, data, get_timeout())
+        return self.store_body(key, data) or Response(data)
+
+    def stores_bodies(self):
+        return self.request.accepted_renderer.format in self.precompressed_formats
+
+    def body_key(self, key, encoding):
+        return f'{key}:{self.request.accepted_media_type}:{encoding or "identity"}'
+
+    def get_stored_body(self, key):
+        if not self.stores_bodies():
+            return None
+        encoding = compression.accepted_encoding(self.request)
+        keys = [self.body_key(key, encoding), self.body_key(key, None)]
+        bodies = cache.get_many(keys)
+        if keys[0] in bodies:
+            return self.body_response(*bodies[keys[0]])
+        if keys[1] in bodies:
+            # rendered for another client, only this encoding is missing
+            return self.encode_body(key, bodies[keys[1]][0], encoding)
+        return None
+
+    def store_body(self, key, data):
+        if not self.stores_bodies():
+            return None
+        renderer = self.request.accepted_renderer
+        content = renderer.render(data, self.request.accepted_media_type, self.get_renderer_context())
+        return self.encode_body(key, content, compression.accepted_encoding(self.request))
+
+    def encode_body(self, key, content, encoding):
+        bodies = {self.body_key(key, None): (content, None)}
+        if encoding is not None:
+            compressed = compression.compress(content, encoding, compression.STORED_LEVELS)
+            # (content, None) under the encoding's key: not worth compressing for anyone
+            worth = len(content) >= compression.MIN_LENGTH and len(compressed) < len(content)
+            bodies[self.body_key(key, encoding)] = (compressed, encoding) if worth else (content, None)
+        cache.set_many(bodies, get_timeout())
+        return self.body_response(*bodies[self.body_key(key, encoding)])
+
+    def body_response(self, content, encoding):
+        renderer = self.request.accepted_renderer
+        content_type = self.request.accepted_media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        response = HttpResponse(content, content_type=content_type)
+        response.precompressed = True
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if response.has_header('Content-Encoding'):
+            compression.weaken_etag(response)
+        return response
@@ -0,0 +1,91 @@
+import gzip
+
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# in order of preference when the client accepts several with the same q
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+# responses built per request are compressed fast, cached ones once and as small as possible
+DYNAMIC_LEVELS = {'br': 5, 'gzip': 6}
+STORED_LEVELS = {'br': 11, 'gzip': 9}
+MIN_LENGTH = 200
+# not HTML: the browsable API pages carry the CSRF token next to what the client sent (BREACH)
+COMPRESSIBLE_TYPES = ('application/json', 'application/javascript', 'text/css', 'text/plain')
+# nor the answers to writes, login returns the tokens next to the username it was given
+SAFE_METHODS = ('GET', 'HEAD')
+
+accept_encoding_re = _lazy_re_compile(r'^\s*([^\s;]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*$')
+
+
+def accepted_encoding(request):
+    """The best of ENCODINGS by the request's Accept-Encoding q-values, None for an identity body."""
+    weights = {}
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        match = accept_encoding_re.match(part)
+        if not match:
+            continue
+        try:
+            weights[match[1].lower()] = float(match[2]) if match[2] is not None else 1.0
+        except ValueError:
+            continue
+    best, best_weight = None, 0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get('*', 0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress(content, encoding, levels=DYNAMIC_LEVELS):
+    if encoding == 'br':
+        return brotli.compress(content, quality=levels['br'])
+    # mtime=0 keeps the bytes, and so the cached variants, the same for the same content
+    return gzip.compress(content, compresslevel=levels['gzip'], mtime=0)
+
+
+def is_compressible(response):
+    return response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES)
+
+
+def weaken_etag(response):
+    # the compressed body is another representation, same as django's GZipMiddleware
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response.headers['ETag'] = 'W/' + etag
+    return response
+
+
+def mark_encoded(response, encoding):
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Content-Length'] = str(len(response.content))
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return weaken_etag(response)
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Brotli or gzip, whichever the client prefers, for the bodies of GET and HEAD responses.
+    Responses that arrive with a Content-Encoding or already negotiated it, like the cached
+    catalogue pages, pass through.
+    """
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS or response.streaming or not is_compressible(response):
+            return response
+        if response.has_header('Content-Encoding') or getattr(response, 'precompressed', False):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = accepted_encoding(request)
+        if encoding is None or response.status_code != 200 or len(response.content) < MIN_LENGTH:
+            return response
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        return mark_encoded(response, encoding)
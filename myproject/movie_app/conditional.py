@@ -0,0 +1,131 @@
+import hashlib
+from calendar import timegm
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.translation import get_language
+
+CONDITIONAL_HEADERS = ('HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE', 'HTTP_IF_MATCH', 'HTTP_IF_UNMODIFIED_SINCE')
+
+
+class NotModified(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+class ConditionalGetMixin:
+    """
+    ETag and Last-Modified for GET. The validators come from the (pk, version, updated_at) of the
+    objects a response shows, plus the user's favorites among them and whatever else the view adds.
+    Views record them with remember() while they load, so a plain GET costs nothing extra. A request
+    carrying a precondition runs the view's cheaper load_validators() inside initial(), after
+    authentication and permission checks and before any serializer work, and a match is answered
+    with 304 right there. Last-Modified is only sent where the newest updated_at changes with
+    everything in the body, elsewhere clients sending only If-Modified-Since would get stale 304s.
+    """
+    # views whose load_validators() runs no query compute the validators on every request
+    free_validators = False
+    # a list loses or gains rows without its newest updated_at moving
+    last_modified_covers_body = False
+    etag = last_modified = None
+
+    def load_validators(self):
+        """Call remember() from a query cheaper than the response, return False if there is nothing to show."""
+        return False
+
+    def remember(self, objects=(), extra=''):
+        objects = list(objects)
+        ids = [obj.pk for obj in objects]
+        favorite_ids = getattr(self, 'favorite_ids', None)
+        state = [
+            get_language(),
+            self.request.accepted_renderer.format,
+            [(obj.pk, obj.version, obj.updated_at.isoformat()) for obj in objects],
+            None if favorite_ids is None else [pk for pk in ids if pk in favorite_ids],
+            extra,
+        ]
+        self.etag = f'"{hashlib.sha1(repr(state).encode()).hexdigest()}"'
+        # is_favorite changes without touching the movie
+        covered = self.last_modified_covers_body and favorite_ids is None
+        self.last_modified = max((obj.updated_at for obj in objects), default=None) if covered else None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method not in ('GET', 'HEAD'):
+            return
+        if not self.free_validators and not any(header in request.META for header in CONDITIONAL_HEADERS):
+            return
+        if not self.load_validators():
+            return
+        response = self.add_validators(HttpResponse())
+        last_modified = timegm(self.last_modified.utctimetuple()) if self.last_modified else None
+        conditional = get_conditional_response(request, etag=self.etag, last_modified=last_modified,
+                                               response=response)
+        if conditional is not response:
+            raise NotModified(conditional)
+
+    def add_validators(self, response):
+        if self.etag:
+            response['ETag'] = self.etag
+        if self.last_modified:
+            response['Last-Modified'] = http_date(timegm(self.last_modified.utctimetuple()))
+        return response
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method in ('GET', 'HEAD') and response.status_code == 200:
+            self.add_validators(response)
+        return response
+
+
+class VersionedDetailMixin(ConditionalGetMixin):
+    """For RetrieveAPIViews of a versioned model, the precondition check reads one row."""
+    last_modified_covers_body = True
+
+    def load_validators(self):
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        obj = self.get_queryset().model.objects.filter(**{self.lookup_field: self.kwargs[lookup]}).only(
+            *self.validator_fields()).first()
+        if obj is None:
+            return False
+        self.check_object_permissions(self.request, obj)
+        self.remember([obj])
+        return True
+
+    def validator_fields(self):
+        return ['pk', 'version', 'updated_at']
+
+    def get_object(self):
+        obj = super().get_object()
+        self.remember([obj])
+        return obj
+
+
+class VersionedListMixin(ConditionalGetMixin):
+    """For paginated ListAPIViews of a versioned model, the precondition check pages the bare rows."""
+
+    def load_validators(self):
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        page = self.paginate_queryset(queryset.only(*self.validator_fields()))
+        return page is not None
+
+    def validator_fields(self):
+        return ['pk', 'version', 'updated_at']
+
+    def get_validator_extra(self):
+        # count, next and previous links are part of the body
+        links = dict(self.paginator.get_paginated_response([]).data)
+        links.pop('results')
+        return repr(sorted(links.items()))
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            self.remember(page, self.get_validator_extra())
+        return page
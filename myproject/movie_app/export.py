@@ -0,0 +1,64 @@
+import json
+
+from django.conf import settings
+from django.db.models import Prefetch
+
+from .models import Country, Director, Actor, Genre, Movie
+
+EXPORT_CHUNK_SIZE = 500
+LANGUAGES = settings.MODELTRANSLATION_LANGUAGES
+RELATIONS = {
+    # output key: (m2m field, model, translated name field)
+    'countries': ('country', Country, 'country_name'),
+    'genres': ('genre', Genre, 'genre_name'),
+    'actors': ('actor', Actor, 'actor_name'),
+    'directors': ('director', Director, 'director_name'),
+}
+
+
+def translations(obj, field):
+    return {language: getattr(obj, f'{field}_{language}') for language in LANGUAGES}
+
+
+def export_queryset(queryset=None):
+    # only the columns that end up in the export, related rows are prefetched per chunk by iterator()
+    queryset = Movie.objects.all() if queryset is None else queryset
+    prefetches = [
+        Prefetch(field, queryset=model.objects.only('pk', *(f'{name}_{language}' for language in LANGUAGES)))
+        for field, model, name in RELATIONS.values()
+    ]
+    return queryset.only(
+        'pk', 'external_id', 'year', 'types', 'movie_time', 'movie_trailer', 'movie_image', 'status_movie',
+        'rating_count', 'rating_avg', 'rating_histogram',
+        *(f'{field}_{language}' for field in ('movie_name', 'description') for language in LANGUAGES),
+    ).prefetch_related(*prefetches).order_by('pk')
+
+
+def movie_record(movie, media_url):
+    record = {
+        'id': movie.pk,
+        'external_id': movie.external_id,
+        'movie_name': translations(movie, 'movie_name'),
+        'description': translations(movie, 'description'),
+        'year': movie.year.isoformat(),
+        'types': movie.types,
+        'movie_time': movie.movie_time,
+        'movie_trailer': movie.movie_trailer,
+        'movie_image': media_url + movie.movie_image.name if movie.movie_image else None,
+        'status_movie': movie.status_movie,
+        'rating': {
+            'avg': movie.get_avg_rating(),
+            'count': movie.get_count_people(),
+            'histogram': movie.rating_histogram,
+        },
+    }
+    for key, (field, model, name) in RELATIONS.items():
+        record[key] = [{'id': obj.pk, 'name': translations(obj, name)} for obj in getattr(movie, field).all()]
+    return record
+
+
+def export_lines(queryset=None, chunk_size=EXPORT_CHUNK_SIZE, media_url=None):
+    """Yield one NDJSON line per movie, holding at most chunk_size movies (and their relations) in memory."""
+    media_url = settings.MEDIA_URL if media_url is None else media_url
+    for movie in export_queryset(queryset).iterator(chunk_size=chunk_size):
+        yield json.dumps(movie_record(movie, media_url), ensure_ascii=False) + '\n'
@@ -0,0 +1,74 @@
+import hashlib
+
+from django.core.cache import cache as django_cache
+from django.db.models import Count, IntegerField
+from django.db.models.functions import Cast, ExtractYear
+
+from .cache import get_generations, get_timeout
+from .fieldsets import EXPAND_PARAM, FIELDS_PARAM
+from .models import Movie
+from .routers import primary_reads
+
+FACETS_PARAM = 'facets'
+# the generation every cached facet count depends on, bumped by signals when movies change
+FACETS_SCOPE = 'movie-facets'
+FACETS_PREFIX = 'catalogue:facets:'
+RELATION_FACETS = ('genre', 'country', 'director')
+FACETS = (*RELATION_FACETS, 'status_movie', 'year')
+YEAR_BUCKET = 10
+# query parameters that page, order or shape the list without changing which movies match
+IGNORED_PARAMS = {FACETS_PARAM, FIELDS_PARAM, EXPAND_PARAM, 'page', 'page_size', 'cursor', 'ordering', 'count'}
+
+
+def requested(request):
+    value = request.query_params.get(FACETS_PARAM, '')
+    if value.lower() in ('1', 'true', 'all'):
+        return list(FACETS)
+    return [name for name in FACETS if name in value.split(',')]
+
+
+def facet_counts(queryset, names):
+    """
+    Counts of every requested facet over the movies the filtered queryset matches: one grouped
+    query per relation facet and one for status_movie and year together.
+    """
+    movies = queryset.order_by().values('pk')
+    counts = {name: [] for name in names}
+    for name in RELATION_FACETS:
+        if name not in counts:
+            continue
+        through = getattr(Movie, name).through
+        rows = through.objects.filter(movie_id__in=movies).values_list(f'{name}_id').annotate(n=Count('pk'))
+        counts[name] = sorted(({'id': pk, 'count': n} for pk, n in rows.order_by()),
+                              key=lambda item: (-item['count'], item['id']))
+
+    if 'status_movie' in counts or 'year' in counts:
+        statuses, decades = {}, {}
+        rows = Movie.objects.filter(pk__in=movies).annotate(
+            # EXTRACT is numeric on PostgreSQL, the division only truncates on integers
+            decade=Cast(ExtractYear('year'), IntegerField()) / YEAR_BUCKET * YEAR_BUCKET,
+        ).values_list('status_movie', 'decade').annotate(n=Count('pk'))
+        for status, decade, n in rows.order_by():
+            statuses[status] = statuses.get(status, 0) + n
+            decades[decade] = decades.get(decade, 0) + n
+        if 'status_movie' in counts:
+            counts['status_movie'] = [{'value': status, 'count': n} for status, n in
+                                      sorted(statuses.items(), key=lambda item: (-item[1], item[0]))]
+        if 'year' in counts:
+            counts['year'] = [{'from': decade, 'to': decade + YEAR_BUCKET - 1, 'count': n}
+                              for decade, n in sorted(decades.items())]
+    return counts
+
+
+def get_facet_counts(request, queryset, names):
+    params = sorted((key, value) for key, values in request.query_params.lists() if key not in IGNORED_PARAMS
+                    for value in values)
+    # filmography views narrow the list by the path, the rest comes from the filters
+    raw = '|'.join([request.path, repr(params), ','.join(names), *get_generations([FACETS_SCOPE])])
+    key = f'{FACETS_PREFIX}{queryset.model._meta.model_name}:{hashlib.sha1(raw.encode()).hexdigest()}'
+    counts = django_cache.get(key)
+    if counts is None:
+        with primary_reads():
+            counts = facet_counts(queryset, names)
+        django_cache.set(key, counts, get_timeout())
+    return counts
@@ -0,0 +1,62 @@
+from contextvars import ContextVar
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Favorite, FavoriteMovie, Movie
+from .routers import primary_reads
+
+# per-user set of favorited movie ids, dropped by signals whenever a FavoriteMovie changes
+FAVORITES_TIMEOUT = 60 * 60
+MAX_BULK = 500
+
+# set while remove() deletes, the per-row post_delete receiver would load every row's cart
+bulk_removal = ContextVar('favorites_bulk_removal', default=False)
+
+
+def cache_key(user_id):
+    # token users carry the id as a string
+    return f'favorites:{user_id}'
+
+
+def favorite_ids(user):
+    """frozenset of the movie ids the user favorited, None for anonymous users."""
+    if not user or not user.is_authenticated:
+        return None
+    key = cache_key(user.pk)
+    ids = cache.get(key)
+    if ids is None:
+        with primary_reads():
+            ids = load_ids(user.pk)
+        cache.set(key, ids, FAVORITES_TIMEOUT)
+    return ids
+
+
+def load_ids(user_id):
+    return frozenset(FavoriteMovie.objects.filter(cart__user_id=user_id).values_list('movie_id', flat=True))
+
+
+def forget(user_id):
+    # after the commit, or a concurrent request could cache the old set again
+    key = cache_key(user_id)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+@transaction.atomic
+def add(user, movie_ids):
+    cart, created = Favorite.objects.get_or_create(user_id=user.pk)
+    existing = Movie.objects.filter(pk__in=movie_ids).values_list('pk', flat=True)
+    FavoriteMovie.objects.bulk_create([FavoriteMovie(cart=cart, movie_id=pk) for pk in existing],
+                                      ignore_conflicts=True)
+    # bulk_create sends no signals
+    forget(user.pk)
+
+
+@transaction.atomic
+def remove(user, movie_ids):
+    token = bulk_removal.set(True)
+    try:
+        FavoriteMovie.objects.filter(cart__user_id=user.pk, movie_id__in=movie_ids).delete()
+    finally:
+        bulk_removal.reset(token)
+    forget(user.pk)
@@ -0,0 +1,81 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from modeltranslation.utils import get_translation_fields
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def requested(request, param):
+    """The names listed in ?fields= / ?expand=, None when the parameter is missing or empty."""
+    names = {name.strip() for value in request.query_params.getlist(param) for name in value.split(',')}
+    names.discard('')
+    return names or None
+
+
+def model_columns(model, source):
+    # a translated field reads the column of the active language, so every translation is loaded
+    try:
+        field = model._meta.get_field(source)
+    except FieldDoesNotExist:
+        return []
+    if not field.concrete or field.many_to_many:
+        return []
+    names = {field.name for field in model._meta.concrete_fields}
+    return [source, *(name for name in get_translation_fields(source) if name in names)]
+
+
+def id_prefetch(model, lookup):
+    """The same prefetch loading only the primary keys, for relations rendered as lists of ids."""
+    if not isinstance(lookup, Prefetch):
+        lookup = Prefetch(lookup)
+    relation = model._meta.get_field(lookup.prefetch_through)
+    queryset = lookup.queryset if lookup.queryset is not None else relation.related_model._default_manager.all()
+    # a reverse foreign key is matched back to its rows by the key column
+    columns = ['pk', relation.field.name] if relation.one_to_many else ['pk']
+    return Prefetch(lookup.prefetch_through, queryset=queryset.select_related(None).prefetch_related(None)
+                    .only(*columns), to_attr=lookup.to_attr)
+
+
+class SparseFieldsetMixin:
+    """
+    ?fields=a,b keeps only those fields of the objects a view returns, relation fields among them
+    render as lists of ids. ?expand=c adds the relation c rendered in full. The queryset follows the
+    serializer: only() the columns of the kept fields, and of the view's prefetches and annotations
+    only the ones a kept field reads, ids-only for collapsed relations. Without ?fields= nothing changes.
+    """
+    # serializer field -> columns it reads, for fields whose source is not a model column
+    field_columns = {}
+    # serializer source -> annotation, added only when a kept field reads it
+    field_annotations = {}
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'] = requested(self.request, FIELDS_PARAM)
+        context['expand'] = requested(self.request, EXPAND_PARAM)
+        return context
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if requested(self.request, FIELDS_PARAM) is None:
+            return queryset.annotate(**self.field_annotations) if self.field_annotations else queryset
+        return self.sparse_queryset(queryset, self.get_serializer().fields)
+
+    def sparse_queryset(self, queryset, fields):
+        model = queryset.model
+        lookups = {getattr(lookup, 'prefetch_to', lookup): lookup for lookup in queryset._prefetch_related_lookups}
+        # the conditional GET validators and the cursor are read from every row
+        columns = {'pk', *(self.validator_fields() if hasattr(self, 'validator_fields') else [])}
+        prefetches, annotations = [], {}
+        for name, field in fields.items():
+            if isinstance(field, serializers.ListSerializer) and field.source in lookups:
+                prefetches.append(lookups[field.source])
+            elif isinstance(field, ManyRelatedField) and field.source in lookups:
+                prefetches.append(id_prefetch(model, lookups[field.source]))
+            elif field.source in self.field_annotations:
+                annotations[field.source] = self.field_annotations[field.source]
+            else:
+                columns.update(model_columns(model, field.source) or self.field_columns.get(name, []))
+        return queryset.prefetch_related(None).prefetch_related(*prefetches).annotate(**annotations).only(*columns)
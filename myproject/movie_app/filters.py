@@ -1,5 +1,8 @@
 from django_filters import FilterSet
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.filters import BaseFilterBackend
 from .models import Movie
+from . import search
 
 
 class MovieFilter(FilterSet):
@@ -16,3 +19,32 @@ class MovieFilter(FilterSet):
 
 
         }
+
+
+class FullTextSearchFilter(BaseFilterBackend):
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        return search.filter_matching(queryset, query)
+
+    def get_schema_fields(self, view):
+        return [
+            coreapi.Field(
+                name=self.search_param,
+                required=False,
+                location='query',
+                schema=coreschema.String(title='Search', description='Full-text search in both languages'),
+            )
+        ]
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            'name': self.search_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Full-text search in both languages',
+            'schema': {'type': 'string'},
+        }]
@@ -0,0 +1,147 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+
+# Derivatives live next to the originals under MEDIA_ROOT/derivatives/ and are
+# named after the original file: movies_images/poster.jpg -> derivatives/movies_images/poster.card.webp
+# Until they have been written the srcset links to the original, see derivatives_ready().
+DERIVATIVES_DIR = 'derivatives'
+DERIVATIVE_SIZES = {
+    'thumbnail': 160,
+    'card': 480,
+    'full': 1280,
+}
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+MAX_RENDERED = 100000
+MISSING_TTL = 60
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+# original name -> True once its derivatives are on disk (they are only ever replaced in place),
+# or the monotonic time until which they count as missing without looking again
+_rendered = {}
+
+
+def derivative_name(name, size, image_format):
+    root, ext = os.path.splitext(name)
+    return f'{DERIVATIVES_DIR}/{root}.{size}.{EXTENSIONS[image_format]}'
+
+
+def derivative_names(name):
+    return {
+        size: {image_format: derivative_name(name, size, image_format) for image_format in DERIVATIVE_FORMATS}
+        for size in DERIVATIVE_SIZES
+    }
+
+
+def derivatives_ready(storage, name):
+    # render_derivatives() writes the full size JPEG last, so its presence stands for all six.
+    # Renders scheduled by this process clear a cached miss when they finish, the ones of other
+    # workers are noticed after MISSING_TTL.
+    known = _rendered.get(name)
+    if known is True or (known is not None and known > time.monotonic()):
+        return known is True
+    ready = storage.exists(derivative_name(name, 'full', 'jpeg'))
+    if len(_rendered) >= MAX_RENDERED:
+        _rendered.clear()
+    _rendered[name] = True if ready else time.monotonic() + MISSING_TTL
+    return ready
+
+
+def available_derivatives(storage, name):
+    # derivatives the pool has not written yet link to the original instead of a 404
+    names = derivative_names(name)
+    if derivatives_ready(storage, name):
+        return names
+    return {size: {image_format: name for image_format in formats} for size, formats in names.items()}
+
+
+def render_derivatives(media_root, name, force=False):
+    # runs in a worker process: plain paths in, Pillow only, no Django state
+    from PIL import Image, ImageOps
+
+    source = os.path.join(media_root, name)
+    try:
+        source_mtime = os.stat(source).st_mtime
+    except FileNotFoundError:
+        return []
+    targets = []
+    for size, formats in derivative_names(name).items():
+        for image_format, target_name in formats.items():
+            target = os.path.join(media_root, target_name)
+            if force or not os.path.exists(target) or os.stat(target).st_mtime < source_mtime:
+                targets.append((size, image_format, target))
+    if not targets:
+        return []
+
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original)
+        written = []
+        for size, image_format, target in targets:
+            image = original.copy()
+            image.thumbnail((DERIVATIVE_SIZES[size], DERIVATIVE_SIZES[size] * 4), Image.LANCZOS)
+            pil_format, options = DERIVATIVE_FORMATS[image_format]
+            if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            elif image.mode not in ('RGB', 'RGBA', 'L'):
+                image = image.convert('RGBA')
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temporary = f'{target}.{os.getpid()}.tmp'
+            image.save(temporary, pil_format, **options)
+            os.replace(temporary, target)
+            written.append(target)
+    return written
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        # spawn, not fork: the pool is started from inside threaded server workers
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _executor
+
+
+def rendered(name):
+    def done(future):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error('Rendering the derivatives of %s failed', name, exc_info=future.exception())
+        elif _rendered.get(name) is not True:
+            # look again on the next read instead of waiting for the cached miss to expire
+            _rendered.pop(name, None)
+    return done
+
+
+def submit(media_root, name):
+    future = get_executor().submit(render_derivatives, media_root, name)
+    future.add_done_callback(rendered(name))
+    return future
+
+
+def render(media_root, name):
+    render_derivatives(media_root, name)
+    _rendered.pop(name, None)
+
+
+def schedule_derivatives(field_file):
+    if not field_file:
+        return
+    media_root, name = str(settings.MEDIA_ROOT), field_file.name
+    if settings.IMAGE_DERIVATIVE_WORKERS:
+        transaction.on_commit(lambda: submit(media_root, name))
+    else:
+        transaction.on_commit(lambda: render(media_root, name))
@@ -0,0 +1,171 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import LeaderboardEntry, Movie, MovieTrend, Rating, ViewingEvent
+
+# every board also has a variant per genre and per country
+SCOPE_FIELDS = ('genre', 'country')
+# trending activity: a review counts five plays
+RATING_WEIGHT = 1.0
+VIEW_WEIGHT = 0.2
+# stored scores are rounded, so a refresh rewrites only the rows whose score visibly moved
+SCORE_DIGITS = 4
+MIN_TREND = 1e-4
+
+
+def get_scope(field=None, pk=None):
+    return f'{field}:{pk}' if field else ''
+
+
+def top_rated_scores():
+    """Bayesian average: every movie starts with LEADERBOARD_PRIOR_VOTES votes of the catalogue mean."""
+    rows = list(Movie.objects.filter(rating_count__gt=0).values_list('pk', 'rating_sum', 'rating_count'))
+    if not rows:
+        return {}
+    mean = sum(total for pk, total, count in rows) / sum(count for pk, total, count in rows)
+    prior = settings.LEADERBOARD_PRIOR_VOTES
+    return {pk: (prior * mean + total) / (prior + count) for pk, total, count in rows}
+
+
+def decay(seconds):
+    return 0.5 ** (seconds / (settings.LEADERBOARD_HALF_LIFE_HOURS * 3600))
+
+
+def settled(moment):
+    # plays are written by the event buffers after they happened, activity younger than this may
+    # still be on its way and is counted afresh on every refresh instead of stored
+    return moment - timedelta(seconds=settings.LEADERBOARD_SETTLE_SECONDS)
+
+
+def hour_of(moment):
+    # what TruncHour groups by in the current time zone
+    return timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+
+
+def activity(since, until, as_of):
+    """{movie_id: weight of the reviews and plays in (since, until], decayed to as_of}, read per hour."""
+    scores = {}
+    sources = (
+        (Rating.objects.filter(parent__isnull=True), 'created_date', RATING_WEIGHT),
+        (ViewingEvent.objects.all(), 'created_at', VIEW_WEIGHT),
+    )
+    for queryset, field, weight in sources:
+        rows = queryset.filter(**{f'{field}__gt': since, f'{field}__lte': until}).order_by().values(
+            'movie_id', hour=TruncHour(field)).annotate(n=Count('pk')).values_list('movie_id', 'hour', 'n')
+        for movie_id, hour, n in rows.iterator(chunk_size=5000):
+            scores[movie_id] = scores.get(movie_id, 0) + n * weight * decay((as_of - hour).total_seconds())
+    return scores
+
+
+@transaction.atomic
+def refresh_trends(now=None, full=False):
+    """
+    Bring MovieTrend up to now: decay the stored scores, add the activity that settled since the
+    last refresh and take out what left the LEADERBOARD_TRENDING_DAYS window. MovieTrend holds the
+    activity up to settled(refreshed_at), the rest is read again every time. Returns
+    {movie_id: score} over the whole window.
+    """
+    now = now or timezone.now()
+    window = timedelta(days=settings.LEADERBOARD_TRENDING_DAYS)
+    last = None if full else MovieTrend.objects.aggregate(last=Max('refreshed_at'))['last']
+    if last is None or last <= now - window or last > now:
+        MovieTrend.objects.all().delete()
+        changes = activity(now - window, settled(now), now)
+    else:
+        MovieTrend.objects.update(score=F('score') * decay((now - last).total_seconds()), refreshed_at=now)
+        changes = activity(settled(last), settled(now), now)
+        for movie_id, expired in activity(last - window, now - window, now).items():
+            changes[movie_id] = changes.get(movie_id, 0) - expired
+
+    trends = MovieTrend.objects.in_bulk(list(changes))
+    created, updated, removed = [], [], []
+    for movie_id, change in changes.items():
+        trend = trends.get(movie_id)
+        score = (trend.score if trend else 0) + change
+        if score < MIN_TREND:
+            if trend:
+                removed.append(movie_id)
+        elif trend:
+            trend.score = score
+            updated.append(trend)
+        else:
+            created.append(MovieTrend(movie_id=movie_id, score=score, refreshed_at=now))
+    MovieTrend.objects.filter(pk__in=removed).delete()
+    MovieTrend.objects.bulk_update(updated, ['score'], batch_size=1000)
+    # a movie deleted since its activity was read is skipped
+    existing = set(Movie.objects.filter(pk__in=[trend.movie_id for trend in created]).values_list('pk', flat=True))
+    MovieTrend.objects.bulk_create([trend for trend in created if trend.movie_id in existing], batch_size=1000)
+    scores = dict(MovieTrend.objects.values_list('movie_id', 'score'))
+    for movie_id, recent in activity(settled(now), now, now).items():
+        scores[movie_id] = scores.get(movie_id, 0) + recent
+    return scores
+
+
+def remove_rating(rating):
+    """Take a deleted review out of the stored score it was counted in, expiry would never see it."""
+    trend = MovieTrend.objects.select_for_update().filter(movie_id=rating.movie_id).first()
+    if trend is None:
+        return
+    window = timedelta(days=settings.LEADERBOARD_TRENDING_DAYS)
+    if not trend.refreshed_at - window < rating.created_date <= settled(trend.refreshed_at):
+        return
+    trend.score -= RATING_WEIGHT * decay((trend.refreshed_at - hour_of(rating.created_date)).total_seconds())
+    if trend.score < MIN_TREND:
+        trend.delete()
+    else:
+        trend.save(update_fields=['score'])
+
+
+def rank(scores, size):
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:size]
+
+
+def board_rankings(scores, size):
+    """{scope: [(movie_id, score)]} for the catalogue and every genre and country with a scored movie."""
+    rankings = {get_scope(): rank(scores, size)}
+    for field in SCOPE_FIELDS:
+        members = {}
+        through = getattr(Movie, field).through
+        for movie_id, pk in through.objects.values_list('movie_id', f'{field}_id').iterator(chunk_size=10000):
+            if movie_id in scores:
+                members.setdefault(pk, {})[movie_id] = scores[movie_id]
+        for pk, scoped in members.items():
+            rankings[get_scope(field, pk)] = rank(scoped, size)
+    return rankings
+
+
+@transaction.atomic
+def write_board(board, scores, size=None):
+    """Diff the rankings against the stored entries and write only what changed, returns the rows written."""
+    rankings = board_rankings(scores, size or settings.LEADERBOARD_SIZE)
+    existing = {(entry.scope, entry.rank): entry for entry in LeaderboardEntry.objects.filter(board=board)}
+    created, updated = [], []
+    for scope, ranking in rankings.items():
+        for position, (movie_id, score) in enumerate(ranking, start=1):
+            score = round(score, SCORE_DIGITS)
+            entry = existing.pop((scope, position), None)
+            if entry is None:
+                created.append(LeaderboardEntry(board=board, scope=scope, rank=position, movie_id=movie_id,
+                                                score=score))
+            elif (entry.movie_id, entry.score) != (movie_id, score):
+                entry.movie_id, entry.score = movie_id, score
+                updated.append(entry)
+    LeaderboardEntry.objects.filter(pk__in=[entry.pk for entry in existing.values()]).delete()
+    LeaderboardEntry.objects.bulk_update(updated, ['movie', 'score'], batch_size=1000)
+    LeaderboardEntry.objects.bulk_create(created, batch_size=1000)
+    return len(created) + len(updated) + len(existing)
+
+
+def refresh(boards=None, full=False, now=None):
+    boards = boards or [board for board, label in LeaderboardEntry.BOARD_CHOICES]
+    written = {}
+    if LeaderboardEntry.TOP_RATED in boards:
+        written[LeaderboardEntry.TOP_RATED] = write_board(LeaderboardEntry.TOP_RATED, top_rated_scores())
+    if LeaderboardEntry.TRENDING in boards:
+        written[LeaderboardEntry.TRENDING] = write_board(LeaderboardEntry.TRENDING, refresh_trends(now, full))
+    return written
@@ -0,0 +1,187 @@
+import json
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, reverse
+from django.utils import translation
+from rest_framework.test import APIClient
+
+from movie_app import urls as movie_urls
+from movie_app.models import (
+    Country, Director, Actor, Genre, Movie, MovieLanguages, Moments, Rating,
+    UserProfile, Favorite, FavoriteMovie, History
+)
+
+# model whose primary key fills <pk> for routes starting with this path segment
+SAMPLE_MODELS = {
+    'movie': Movie,
+    'country': Country,
+    'director': Director,
+    'actor': Actor,
+    'genre': Genre,
+    'users': UserProfile,
+    'movie-languages': MovieLanguages,
+    'moments': Moments,
+    'rating': Rating,
+    'favorites': Favorite,
+    'favorite-movies': FavoriteMovie,
+    'history': History,
+}
+
+# routes that need a query string to do meaningful work
+ROUTE_QUERIES = {
+    'search': 'q=night',
+}
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    index = min(int(round(share * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def iter_patterns(patterns, prefix=''):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from iter_patterns(pattern.url_patterns, prefix + str(pattern.pattern))
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield prefix + str(pattern.pattern), pattern
+
+
+def allows_get(callback):
+    actions = getattr(callback, 'actions', None)
+    if actions is not None:
+        return 'get' in actions
+    view_class = getattr(callback, 'view_class', None) or getattr(callback, 'cls', None)
+    return view_class is not None and hasattr(view_class, 'get')
+
+
+class Command(BaseCommand):
+    help = 'Request every GET route of movie_app in-process and report latency, query count and size as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--language', default='en')
+        parser.add_argument('--user', help='Username to authenticate as, defaults to the first pro user')
+        parser.add_argument('--anonymous', action='store_true')
+        parser.add_argument('--cold', action='store_true', help='Clear the cache before every request')
+        parser.add_argument('--route', action='append', help='Only benchmark the named route, can be repeated')
+        parser.add_argument('--query', default='', help='Query string appended to list routes')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+        parser.add_argument('--compare', help='Previous JSON report to print relative changes against')
+
+    def handle(self, *args, **options):
+        client = APIClient(raise_request_exception=False)
+        if not options['anonymous']:
+            users = UserProfile.objects.order_by('pk')
+            user = users.filter(username=options['user']).first() if options['user'] else \
+                users.filter(status='pro').first()
+            if user is None:
+                raise CommandError('No user to authenticate as, run seed_catalogue first or pass --anonymous')
+            client.force_authenticate(user)
+
+        results = []
+        with translation.override(options['language']):
+            for route, pattern in iter_patterns(movie_urls.urlpatterns):
+                if options['route'] and pattern.name not in options['route']:
+                    continue
+                if not allows_get(pattern.callback):
+                    continue
+                url = self.build_url(route, pattern)
+                if url is None:
+                    self.stderr.write(f'skipping {pattern.name}: no sample object')
+                    continue
+                results.append(self.measure(client, pattern.name, url, options))
+
+        report = {
+            'meta': {
+                'vendor': connection.vendor,
+                'movies': Movie.objects.count(),
+                'iterations': options['iterations'],
+                'cold': options['cold'],
+                'anonymous': options['anonymous'],
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'routes': results,
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            self.compare(report, options['compare'])
+
+    def build_url(self, route, pattern):
+        kwargs = {}
+        segment = route.lstrip('^').split('/')[0]
+        if 'pk' in pattern.pattern.regex.groupindex:
+            model = SAMPLE_MODELS.get(segment)
+            pk = model.objects.order_by('pk').values_list('pk', flat=True).first() if model else None
+            if pk is None:
+                return None
+            kwargs['pk'] = pk
+        if 'video_pk' in pattern.pattern.regex.groupindex:
+            video_pk = MovieLanguages.objects.filter(movie_id=kwargs['pk']).values_list('pk', flat=True).first()
+            if video_pk is None:
+                return None
+            kwargs['video_pk'] = video_pk
+        return reverse(pattern.name, kwargs=kwargs)
+
+    def measure(self, client, name, url, options):
+        query = options['query'] if name.endswith(('_list', '_movies', 'ratings')) else ROUTE_QUERIES.get(name)
+        if query:
+            url = f'{url}?{query}'
+        for _ in range(options['warmup']):
+            self.fetch(client, url)
+        timings, queries, query_time = [], [], []
+        status, size = None, 0
+        for _ in range(options['iterations']):
+            if options['cold']:
+                cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                status, size = self.fetch(client, url)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured.captured_queries))
+            query_time.append(sum(float(query['time']) for query in captured.captured_queries) * 1000)
+        return {
+            'name': name,
+            'url': url,
+            'status': status,
+            'bytes': size,
+            'queries': max(queries),
+            'query_ms': round(sum(query_time) / len(query_time), 3),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'p50_ms': round(percentile(timings, 0.5), 3),
+            'p90_ms': round(percentile(timings, 0.9), 3),
+            'p99_ms': round(percentile(timings, 0.99), 3),
+            'max_ms': round(max(timings), 3),
+        }
+
+    def fetch(self, client, url):
+        response = client.get(url)
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        return response.status_code, size
+
+    def compare(self, report, path):
+        with open(path) as file:
+            previous = {route['name']: route for route in json.load(file)['routes']}
+        # stdout stays pure JSON, the comparison goes to stderr
+        for route in report['routes']:
+            before = previous.get(route['name'])
+            if not before:
+                continue
+            change = (route['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+            self.stderr.write(
+                f"{route['name']:<24} p50 {before['p50_ms']:>9.2f} -> {route['p50_ms']:>9.2f} ms ({change:+.1f}%)  "
+                f"queries {before['queries']} -> {route['queries']}  bytes {before['bytes']} -> {route['bytes']}"
+            )
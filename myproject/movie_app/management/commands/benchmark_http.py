@@ -0,0 +1,143 @@
+import http.client
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import translation
+
+from movie_app.authentication import issue_tokens
+from movie_app.models import Country, Director, Actor, Genre, Movie, UserProfile
+from .benchmark_api import percentile
+
+# the routes that have an async variant in movie_app/async_views.py
+ROUTES = {
+    'movie_list': None,
+    'movie_detail': Movie,
+    'country_detail': Country,
+    'genre_detail': Genre,
+    'director_detail': Director,
+    'actor_detail': Actor,
+}
+
+
+class Command(BaseCommand):
+    help = ('Load a running server over HTTP with concurrent keep-alive clients, to compare the WSGI and '
+            'ASGI deployments at the same worker count')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=500, help='Requests per route')
+        parser.add_argument('--language', default='en')
+        parser.add_argument('--user', help='Username to send a JWT for, defaults to the first pro user')
+        parser.add_argument('--anonymous', action='store_true')
+        parser.add_argument('--route', action='append', choices=tuple(ROUTES))
+        parser.add_argument('--label', default='', help='Stored in the report, e.g. "wsgi -w 4"')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+        parser.add_argument('--compare', help='Previous JSON report to print relative changes against')
+
+    def handle(self, *args, **options):
+        base = urlsplit(options['base_url'])
+        self.connection_class = http.client.HTTPSConnection if base.scheme == 'https' else http.client.HTTPConnection
+        self.netloc = base.netloc
+        self.local = threading.local()
+        self.headers = {'Accept': 'application/json'}
+        if not options['anonymous']:
+            users = UserProfile.objects.order_by('pk')
+            user = users.filter(username=options['user']).first() if options['user'] else \
+                users.filter(status='pro').first()
+            if user is None:
+                raise CommandError('No user to authenticate as, run seed_catalogue first or pass --anonymous')
+            self.headers['Authorization'] = f'Bearer {issue_tokens(user)[1]}'
+
+        results = []
+        with translation.override(options['language']):
+            for name, model in ROUTES.items():
+                if options['route'] and name not in options['route']:
+                    continue
+                pk = model.objects.order_by('pk').values_list('pk', flat=True).first() if model else None
+                if model and pk is None:
+                    self.stderr.write(f'skipping {name}: no sample object')
+                    continue
+                path = base.path.rstrip('/') + reverse(name, args=[pk] if model else [])
+                results.append(self.load(name, path, options))
+
+        report = {
+            'meta': {
+                'label': options['label'],
+                'base_url': options['base_url'],
+                'server': self.server,
+                'concurrency': options['concurrency'],
+                'requests': options['requests'],
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            },
+            'routes': results,
+        }
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        if options['compare']:
+            self.compare(report, options['compare'])
+
+    def fetch(self, path):
+        # one keep-alive connection per client thread
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = self.connection_class(self.netloc, timeout=30)
+        started = time.perf_counter()
+        try:
+            connection.request('GET', path, headers=self.headers)
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            return None, 0, (time.perf_counter() - started) * 1000
+        self.server = response.getheader('Server', '')
+        return response.status, len(body), (time.perf_counter() - started) * 1000
+
+    def load(self, name, path, options):
+        self.server = ''
+        self.fetch(path)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            samples = list(executor.map(self.fetch, [path] * options['requests']))
+        elapsed = time.perf_counter() - started
+        timings = [timing for status, size, timing in samples]
+        errors = sum(1 for status, size, timing in samples if status is None or status >= 500)
+        return {
+            'name': name,
+            'url': path,
+            'status': samples[-1][0],
+            'bytes': samples[-1][1],
+            'errors': errors,
+            'rps': round(len(samples) / elapsed, 1),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'p50_ms': round(percentile(timings, 0.5), 3),
+            'p90_ms': round(percentile(timings, 0.9), 3),
+            'p99_ms': round(percentile(timings, 0.99), 3),
+            'max_ms': round(max(timings), 3),
+        }
+
+    def compare(self, report, path):
+        with open(path) as file:
+            previous = json.load(file)
+        before_routes = {route['name']: route for route in previous['routes']}
+        self.stderr.write(f"{previous['meta']['label'] or path} -> {report['meta']['label'] or 'current'}")
+        for route in report['routes']:
+            before = before_routes.get(route['name'])
+            if not before:
+                continue
+            change = (route['rps'] - before['rps']) / before['rps'] * 100 if before['rps'] else 0
+            self.stderr.write(
+                f"{route['name']:<16} rps {before['rps']:>8.1f} -> {route['rps']:>8.1f} ({change:+.1f}%)  "
+                f"p99 {before['p99_ms']:>8.2f} -> {route['p99_ms']:>8.2f} ms  "
+                f"errors {before['errors']} -> {route['errors']}"
+            )
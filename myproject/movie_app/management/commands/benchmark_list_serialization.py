@@ -0,0 +1,101 @@
+import json
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.utils import translation
+from rest_framework.request import Request
+
+from movie_app import fastlist
+from movie_app.models import Movie
+from movie_app.serializers import MovieListSerializer
+from movie_app.views import movie_list_queryset
+from .benchmark_api import percentile
+
+
+def drf_page(movie_ids, request):
+    movies = list(movie_list_queryset.filter(pk__in=movie_ids).order_by('-year', '-pk'))
+    return MovieListSerializer(movies, many=True, context={'request': request, 'favorite_ids': frozenset()}).data
+
+
+def fast_page(movie_ids, request):
+    rows = fastlist.movie_rows(Movie.objects.filter(pk__in=movie_ids).order_by('-year', '-pk'))
+    return fastlist.serialize_movies(rows, request, frozenset())
+
+
+def serialize_drf(movies, request):
+    return MovieListSerializer(movies, many=True, context={'request': request, 'favorite_ids': frozenset()}).data
+
+
+def measure(function, args, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    # allocations of one more run, traced separately so tracing does not slow the timed runs
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = function(*args)
+    after = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+    del result
+    p50 = percentile(timings, 0.5)
+    return {
+        'p50_ms': round(p50, 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'pages_per_s': round(1000 / p50, 1) if p50 else None,
+        'peak_kb': round(peak / 1024, 1),
+        'allocated_blocks': blocks,
+    }
+
+
+class Command(BaseCommand):
+    help = ('Compare MovieListSerializer with the values_list() fast path on pages of the newest movies: '
+            'serialization alone and end to end with the queries, time and allocations')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='20,100,1000', help='Comma separated page sizes')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--language', default='en')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        movie_ids = list(Movie.objects.order_by('-year', '-pk').values_list('pk', flat=True)[:max(sizes)])
+        if len(movie_ids) < max(sizes):
+            raise CommandError(f'{len(movie_ids)} movies, run seed_catalogue --movies {max(sizes)} first')
+        request = Request(RequestFactory().get('/'))
+
+        report = {'language': options['language'], 'repeat': options['repeat'], 'sizes': {}}
+        with translation.override(options['language']):
+            fastlist.name_maps()
+            for size in sizes:
+                ids = movie_ids[:size]
+                movies = list(movie_list_queryset.filter(pk__in=ids).order_by('-year', '-pk'))
+                rows = list(fastlist.movie_rows(Movie.objects.filter(pk__in=ids).order_by('-year', '-pk')))
+                linked, names = fastlist.relation_ids(ids), fastlist.name_maps()
+                if json.dumps(drf_page(ids, request)) != json.dumps(fast_page(ids, request)):
+                    raise CommandError(f'The fast path differs from the serializer at {size} movies')
+                results = {
+                    # rows and relations already loaded, what is left is the serializer against the loop
+                    'serialize_drf': measure(serialize_drf, (movies, request), options['repeat']),
+                    'serialize_fast': measure(fastlist.render_movies, (rows, linked, names, request, frozenset()),
+                                              options['repeat']),
+                    'page_drf': measure(drf_page, (ids, request), options['repeat']),
+                    'page_fast': measure(fast_page, (ids, request), options['repeat']),
+                }
+                for stage in ('serialize', 'page'):
+                    drf, fast = results[f'{stage}_drf'], results[f'{stage}_fast']
+                    results[f'{stage}_speedup'] = round(drf['p50_ms'] / fast['p50_ms'], 2) if fast['p50_ms'] else None
+                report['sizes'][size] = results
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,99 @@
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from movie_app import similar
+from .benchmark_api import percentile
+
+# (entities, links per movie) of the synthetic catalogue, popularity is zipf-like
+SYNTHETIC = {
+    'country': (60, 2),
+    'genre': (25, 3),
+    'actor': (40000, 8),
+    'director': (8000, 1),
+    'rating': (100000, 12),
+}
+
+
+def synthetic_pairs(titles, seed):
+    random = np.random.default_rng(seed)
+    pairs = {}
+    for kind, (entities, per_movie) in SYNTHETIC.items():
+        counts = random.integers(1, per_movie * 2, size=titles) if per_movie > 1 else np.ones(titles, dtype=np.int64)
+        movies = np.repeat(np.arange(1, titles + 1), counts)
+        popularity = 1 / np.arange(1, entities + 1) ** 0.8
+        linked = random.choice(entities, size=len(movies), p=popularity / popularity.sum()) + 1
+        pairs[kind] = (movies.astype(np.int64), linked.astype(np.int64))
+    return pairs
+
+
+class Command(BaseCommand):
+    help = ('Time building the similar movies index for a synthetic catalogue and querying it through '
+            'the memory-mapped loader, without touching the database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--titles', type=int, default=100000)
+        parser.add_argument('--k', type=int, default=50)
+        parser.add_argument('--block-size', type=int, default=256)
+        parser.add_argument('--queries', type=int, default=10000)
+        parser.add_argument('--refreshes', type=int, default=200, help='Incremental single-movie rescorings')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        titles, k = options['titles'], options['k']
+        pairs = synthetic_pairs(titles, options['seed'])
+        movie_ids = np.arange(1, titles + 1, dtype=np.int64)
+
+        started = time.perf_counter()
+        matrix, keys, weights = similar.build_matrix(movie_ids, pairs)
+        matrix_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        neighbours, scores = similar.nearest_neighbours(movie_ids, matrix, k, options['block_size'])
+        neighbours_seconds = time.perf_counter() - started
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = similar.write_index(directory, {
+                'ids': movie_ids, 'neighbours': neighbours, 'scores': scores, 'keys': keys, 'weights': weights,
+                'data': matrix.data, 'indices': matrix.indices, 'indptr': matrix.indptr,
+            })
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            index = similar.SimilarIndex(path)
+            random = np.random.default_rng(options['seed'] + 1)
+
+            timings = []
+            for movie_id in random.integers(1, titles + 1, size=options['queries']):
+                started = time.perf_counter()
+                index.lookup(int(movie_id), 10)
+                timings.append((time.perf_counter() - started) * 1000)
+
+            refresh_timings = []
+            for movie_id in random.integers(1, titles + 1, size=options['refreshes']):
+                features = {kind: entities[movies == movie_id].tolist() for kind, (movies, entities) in pairs.items()}
+                started = time.perf_counter()
+                index.score(int(movie_id), features, k)
+                refresh_timings.append((time.perf_counter() - started) * 1000)
+
+        report = {
+            'titles': titles,
+            'k': k,
+            'columns': len(keys),
+            'nonzeros': int(matrix.nnz),
+            'build_matrix_s': round(matrix_seconds, 2),
+            'build_neighbours_s': round(neighbours_seconds, 2),
+            'index_mb': round(size / 2 ** 20, 1),
+            'query_p50_ms': round(percentile(timings, 0.5), 4),
+            'query_p99_ms': round(percentile(timings, 0.99), 4),
+            'refresh_p50_ms': round(percentile(refresh_timings, 0.5), 2),
+            'refresh_p99_ms': round(percentile(refresh_timings, 0.99), 2),
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,38 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from movie_app.images import render_derivatives
+from movie_app.signals import IMAGE_FIELDS
+
+
+class Command(BaseCommand):
+    help = 'Generate missing or outdated image derivatives for every uploaded image'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', choices=sorted(m.__name__ for m in IMAGE_FIELDS),
+                            help='Only process the given model, can be repeated')
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+        parser.add_argument('--force', action='store_true', help='Re-render derivatives that are up to date')
+
+    def handle(self, *args, **options):
+        names = set()
+        for model, field in IMAGE_FIELDS.items():
+            if options['model'] and model.__name__ not in options['model']:
+                continue
+            names.update(model.objects.exclude(**{field: ''}).values_list(field, flat=True).iterator())
+        names.discard(None)
+
+        media_root = str(settings.MEDIA_ROOT)
+        written = 0
+        with ProcessPoolExecutor(max_workers=max(options['workers'], 1),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(render_derivatives, media_root, name, options['force']) for name in sorted(names)]
+            for name, future in zip(sorted(names), futures):
+                try:
+                    written += len(future.result())
+                except Exception as exc:
+                    self.stderr.write(f'{name}: {exc}')
+        self.stdout.write(self.style.SUCCESS(f'{len(names)} images checked, {written} derivatives written'))
@@ -0,0 +1,20 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from movie_app import similar
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the memory-mapped similar movies index, running workers pick it up on their next request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=settings.SIMILAR_MOVIES_K, help='Neighbours kept per movie')
+        parser.add_argument('--block-size', type=int, default=256, help='Movies scored per sparse product')
+        parser.add_argument('--directory', help=f'Defaults to SIMILAR_MOVIES_DIR ({settings.SIMILAR_MOVIES_DIR})')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        path = similar.build(k=options['k'], block_size=options['block_size'], directory=options['directory'])
+        self.stdout.write(self.style.SUCCESS(f'Built {path} in {time.perf_counter() - started:.1f}s'))
@@ -0,0 +1,70 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from movie_app.models import ViewingEvent, ViewingSummary
+
+# players report the position every few seconds, a longer silence ends a view
+VIEW_GAP = timedelta(minutes=30)
+
+
+class Command(BaseCommand):
+    help = 'Fold viewing events older than --days into per-user, per-movie summaries and delete them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users compacted per transaction')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        old = ViewingEvent.objects.filter(created_at__lt=cutoff)
+        user_ids = list(old.order_by('user_id').values_list('user_id', flat=True).distinct())
+        events = summaries = 0
+        for start in range(0, len(user_ids), options['batch_size']):
+            batch = user_ids[start:start + options['batch_size']]
+            with transaction.atomic():
+                compacted, written = self.compact(old.filter(user_id__in=batch), batch)
+            events += compacted
+            summaries += written
+        self.stdout.write(self.style.SUCCESS(f'Compacted {events} events into {summaries} summaries'))
+
+    def compact(self, events, user_ids):
+        # newest first, so the first event of a pair carries its latest position;
+        # [position, last report, views, earliest report so far]
+        folded = {}
+        for user_id, movie_id, position, created_at in events.order_by('-created_at', '-pk').values_list(
+                'user_id', 'movie_id', 'position', 'created_at').iterator(chunk_size=5000):
+            key = (user_id, movie_id)
+            if key not in folded:
+                folded[key] = [position, created_at, 1, created_at]
+                continue
+            if folded[key][3] - created_at > VIEW_GAP:
+                folded[key][2] += 1
+            folded[key][3] = created_at
+        if not folded:
+            return 0, 0
+
+        existing = {
+            (summary.user_id, summary.movie_id): summary
+            for summary in ViewingSummary.objects.select_for_update().filter(user_id__in=user_ids)
+        }
+        created, updated = [], []
+        for (user_id, movie_id), (position, viewed_at, count, first_viewed_at) in folded.items():
+            summary = existing.get((user_id, movie_id))
+            if summary is None:
+                created.append(ViewingSummary(user_id=user_id, movie_id=movie_id, position=position,
+                                              views_count=count, last_viewed_at=viewed_at))
+                continue
+            if abs(first_viewed_at - summary.last_viewed_at) <= VIEW_GAP:
+                # a view the cutoff split between two runs is counted once
+                count -= 1
+            summary.views_count += count
+            if viewed_at > summary.last_viewed_at:
+                summary.position, summary.last_viewed_at = position, viewed_at
+            updated.append(summary)
+        ViewingSummary.objects.bulk_create(created, batch_size=1000)
+        ViewingSummary.objects.bulk_update(updated, ['position', 'views_count', 'last_viewed_at'], batch_size=1000)
+        deleted, _ = events.delete()
+        return deleted, len(folded)
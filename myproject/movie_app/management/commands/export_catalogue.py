@@ -0,0 +1,27 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from movie_app.export import EXPORT_CHUNK_SIZE, export_lines
+
+
+class Command(BaseCommand):
+    help = 'Write the whole movie catalogue as NDJSON, one movie with its relations per line'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='File to write, defaults to stdout')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+        parser.add_argument('--media-url', help='Prefix for image paths, defaults to MEDIA_URL')
+
+    def handle(self, *args, **options):
+        lines = export_lines(chunk_size=options['chunk_size'], media_url=options['media_url'])
+        if not options['output']:
+            # write straight to the stream, BaseCommand's stdout wrapper would add its own line endings
+            sys.stdout.writelines(lines)
+            return
+        count = 0
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            for line in lines:
+                file.write(line)
+                count += 1
+        self.stderr.write(self.style.SUCCESS(f'Exported {count} movies to {options["output"]}'))
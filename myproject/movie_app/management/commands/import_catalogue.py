@@ -0,0 +1,281 @@
+import csv
+import json
+import os
+from datetime import date
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from movie_app import cache, facets, search
+from movie_app.models import Country, Director, Actor, Genre, Movie
+
+MOVIE_FIELDS = ('movie_name_en', 'movie_name_ru', 'description_en', 'description_ru', 'year', 'types',
+                'movie_time', 'movie_trailer', 'movie_image', 'status_movie')
+RELATIONS = {
+    # row key: (m2m field, model, name field)
+    'countries': ('country', Country, 'country_name'),
+    'genres': ('genre', Genre, 'genre_name'),
+    'actors': ('actor', Actor, 'actor_name'),
+    'directors': ('director', Director, 'director_name'),
+}
+ENTITIES = {
+    'country': (Country, 'country_name', ()),
+    'genre': (Genre, 'genre_name', ()),
+    'actor': (Actor, 'actor_name', ('bio', 'age', 'actor_image')),
+    'director': (Director, 'director_name', ('bio', 'age', 'director_image')),
+}
+# only countries and genres can be created from a bare name, people need bio, age and image
+CREATABLE = {'countries', 'genres'}
+LIST_SEPARATOR = '|'
+
+
+class RowError(Exception):
+    pass
+
+
+def parse_date(value):
+    value = str(value).strip()
+    if len(value) == 4:
+        return date(int(value), 1, 1)
+    return date.fromisoformat(value)
+
+
+def translated(row, field):
+    en = row.get(f'{field}_en') or row.get(field) or ''
+    return en, row.get(f'{field}_ru') or en
+
+
+def name_list(value):
+    # JSONL: ["USA", {"en": "France", "ru": "Франция"}], CSV: "USA|France"
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(LIST_SEPARATOR)
+    names = []
+    for item in value:
+        if isinstance(item, dict):
+            names.append((item['en'].strip(), (item.get('ru') or item['en']).strip()))
+        elif item.strip():
+            names.append((item.strip(), item.strip()))
+    return names
+
+
+class Command(BaseCommand):
+    help = 'Stream movies (or countries, genres, actors, directors) from CSV or JSONL into the catalogue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='Defaults to the file extension')
+        parser.add_argument('--model', choices=('movie',) + tuple(ENTITIES), default='movie')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip the rows a previous run of the same file already committed')
+        parser.add_argument('--checkpoint', help='Checkpoint file, defaults to <path>.checkpoint')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        self.checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+        self.batch_size = options['batch_size']
+        self.errors = 0
+        self.lookups = {}
+        start = self.read_checkpoint(path) if options['resume'] else 0
+
+        handler = self.import_movies if options['model'] == 'movie' else self.import_entities
+        done = start
+        with open(path, newline='', encoding='utf-8') as file:
+            rows = self.read_rows(file, file_format)
+            rows = islice(rows, start, None)
+            while True:
+                batch = list(islice(rows, self.batch_size))
+                if not batch:
+                    break
+                with transaction.atomic():
+                    handler(batch, options['model'])
+                done += len(batch)
+                self.write_checkpoint(path, done)
+                self.stdout.write(f'{done} rows imported')
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self.stdout.write(self.style.SUCCESS(f'Imported {done - start} rows, {self.errors} skipped'))
+
+    def read_rows(self, file, file_format):
+        if file_format == 'csv':
+            for line, row in enumerate(csv.DictReader(file), start=2):
+                yield line, row
+            return
+        for line, text in enumerate(file, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError as exc:
+                self.skip(line, exc)
+                continue
+            if not isinstance(row, dict):
+                self.skip(line, 'not a JSON object')
+                continue
+            yield line, row
+
+    def read_checkpoint(self, path):
+        try:
+            with open(self.checkpoint_path) as file:
+                checkpoint = json.load(file)
+        except FileNotFoundError:
+            return 0
+        if checkpoint['size'] != os.path.getsize(path) or checkpoint['mtime'] != os.path.getmtime(path):
+            raise CommandError(f'{path} changed since the checkpoint was written, drop --resume to start over')
+        return checkpoint['rows']
+
+    def write_checkpoint(self, path, rows):
+        checkpoint = {'rows': rows, 'size': os.path.getsize(path), 'mtime': os.path.getmtime(path)}
+        temporary = f'{self.checkpoint_path}.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(checkpoint, file)
+        os.replace(temporary, self.checkpoint_path)
+
+    def skip(self, line, error):
+        self.errors += 1
+        self.stderr.write(f'line {line}: {error}')
+
+    def lookup(self, model, field):
+        # name -> id of every existing row, loaded once and kept up to date as rows are created
+        if model not in self.lookups:
+            self.lookups[model] = dict(model.objects.values_list(f'{field}_en', 'pk').iterator())
+        return self.lookups[model]
+
+    def resolve(self, batch_names):
+        created = set()
+        for key, names in batch_names.items():
+            field, model, name_field = RELATIONS[key]
+            lookup = self.lookup(model, name_field)
+            missing = {en: ru for en, ru in names if en not in lookup}
+            if not missing or key not in CREATABLE:
+                continue
+            new = model.objects.bulk_create([
+                model(**{name_field: en, f'{name_field}_en': en, f'{name_field}_ru': ru})
+                for en, ru in missing.items()
+            ])
+            lookup.update((getattr(obj, f'{name_field}_en'), obj.pk) for obj in new)
+            created.add(model._meta.model_name)
+        cache.bump(*created)
+
+    def import_movies(self, batch, model_name):
+        movies, links = {}, {}
+        batch_names = {key: set() for key in RELATIONS}
+        for line, row in batch:
+            try:
+                movie = self.build_movie(row)
+            except (RowError, KeyError, ValueError, TypeError) as exc:
+                self.skip(line, exc)
+                continue
+            movies[movie.external_id] = movie
+            links[movie.external_id] = {key: name_list(row.get(key)) for key in RELATIONS}
+            for key in RELATIONS:
+                batch_names[key].update(links[movie.external_id][key])
+        if not movies:
+            return
+        self.resolve(batch_names)
+
+        Movie.objects.bulk_create(
+            list(movies.values()), update_conflicts=True, unique_fields=['external_id'],
+            update_fields=['movie_name', 'description', *MOVIE_FIELDS],
+        )
+        ids = dict(Movie.objects.filter(external_id__in=movies).values_list('external_id', 'pk'))
+        for external_id, movie in movies.items():
+            movie.pk = ids[external_id]
+
+        # replace the m2m links of every movie in the batch, so re-importing a row is idempotent
+        movie_ids = list(ids.values())
+        scopes = cache.movie_scopes(movie_ids)
+        for key, (field, model, name_field) in RELATIONS.items():
+            through = getattr(Movie, field).through
+            through.objects.filter(movie_id__in=movie_ids).delete()
+            lookup = self.lookup(model, name_field)
+            rows = {}
+            for external_id, names in links.items():
+                for en, ru in names[key]:
+                    if en in lookup:
+                        rows[(ids[external_id], lookup[en])] = through(movie_id=ids[external_id],
+                                                                       **{f'{field}_id': lookup[en]})
+                    else:
+                        self.stderr.write(f'{external_id}: unknown {field} {en!r}, link skipped')
+            through.objects.bulk_create(rows.values())
+        scopes.extend(cache.movie_scopes(movie_ids))
+        cache.bump(*scopes, facets.FACETS_SCOPE)
+        # bulk writes send no signals, bump the versions conditional GETs compare
+        Movie.touch(movie_ids)
+        search.index_instances('movie', movies.values())
+
+    def build_movie(self, row):
+        external_id = str(row.get('external_id') or '').strip()
+        if not external_id:
+            raise RowError('external_id is required')
+        name_en, name_ru = translated(row, 'movie_name')
+        description_en, description_ru = translated(row, 'description')
+        if not name_en:
+            raise RowError('movie_name_en is required')
+        status_movie = row.get('status_movie') or 'simple'
+        if status_movie not in ('simple', 'pro'):
+            raise RowError(f'unknown status_movie {status_movie!r}')
+        return Movie(
+            external_id=external_id,
+            movie_name=name_en, movie_name_en=name_en, movie_name_ru=name_ru,
+            description=description_en, description_en=description_en, description_ru=description_ru,
+            year=parse_date(row['year']),
+            types=str(row.get('types') or '720'),
+            movie_time=int(row.get('movie_time') or 0),
+            movie_trailer=row.get('movie_trailer') or '',
+            movie_image=row.get('movie_image') or '',
+            status_movie=status_movie,
+        )
+
+    def import_entities(self, batch, model_name):
+        model, name_field, extra_fields = ENTITIES[model_name]
+        lookup = self.lookup(model, name_field)
+        new, existing = {}, []
+        for line, row in batch:
+            try:
+                name_en, name_ru = translated(row, name_field if f'{name_field}_en' in row else 'name')
+                if not name_en:
+                    raise RowError('name_en is required')
+                values = {name_field: name_en, f'{name_field}_en': name_en, f'{name_field}_ru': name_ru}
+                if 'bio' in extra_fields:
+                    bio_en, bio_ru = translated(row, 'bio')
+                    values.update(bio=bio_en, bio_en=bio_en, bio_ru=bio_ru, age=parse_date(row['age']))
+                image_field = next((field for field in extra_fields if field.endswith('_image')), None)
+                if image_field:
+                    values[image_field] = row.get(image_field) or row.get('image') or ''
+            except (RowError, KeyError, ValueError, TypeError) as exc:
+                self.skip(line, exc)
+                continue
+            if name_en in lookup:
+                existing.append(model(pk=lookup[name_en], **values))
+            else:
+                new[name_en] = model(**values)
+
+        fields = [name_field, f'{name_field}_en', f'{name_field}_ru']
+        if 'bio' in extra_fields:
+            fields += ['bio', 'bio_en', 'bio_ru', 'age']
+        fields += [field for field in extra_fields if field.endswith('_image')]
+        if existing:
+            model.objects.bulk_update(existing, fields)
+            model.touch([obj.pk for obj in existing])
+            through = getattr(Movie, model_name).through
+            Movie.touch(through.objects.filter(**{f'{model_name}_id__in': [obj.pk for obj in existing]})
+                        .values('movie_id'))
+        created = model.objects.bulk_create(new.values())
+        lookup.update((getattr(obj, f'{name_field}_en'), obj.pk) for obj in created)
+
+        scopes = [model_name] + [f'{model_name}:{obj.pk}' for obj in existing]
+        if model_name in ('country', 'genre') and existing:
+            through = getattr(Movie, model_name).through
+            movie_ids = through.objects.filter(**{f'{model_name}_id__in': [obj.pk for obj in existing]}) \
+                .values_list('movie_id', flat=True)
+            scopes.extend(cache.movie_scopes(set(movie_ids)))
+        # bulk writes send no signals, the facet counts are invalidated here too
+        cache.bump(*scopes, facets.FACETS_SCOPE)
+        if model_name in search.INDEXED:
+            search.index_instances(model_name, existing + created)
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from movie_app.models import Movie, Rating, empty_rating_histogram
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the stored rating aggregates of every movie from the Rating table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        histograms = {}
+        rows = Rating.objects.order_by().values_list('movie_id', 'stars').annotate(n=Count('id'))
+        for movie_id, stars, n in rows:
+            histograms.setdefault(movie_id, empty_rating_histogram())[stars - 1] = n
+
+        fields = ['rating_sum', 'rating_count', 'rating_avg', 'rating_histogram']
+        changed = []
+        with transaction.atomic():
+            for movie in Movie.objects.select_for_update().only(*fields, 'version').iterator(chunk_size=options['batch_size']):
+                before = [getattr(movie, field) for field in fields]
+                movie.set_rating_aggregates(histograms.get(movie.pk, empty_rating_histogram()))
+                if [getattr(movie, field) for field in fields] != before:
+                    movie.version += 1
+                    movie.updated_at = timezone.now()
+                    changed.append(movie)
+            Movie.objects.bulk_update(changed, [*fields, 'version', 'updated_at'], batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates, {len(changed)} movies changed'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from movie_app import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for movies, actors and directors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=sorted(search.INDEXED), action='append',
+                            help='Only rebuild the given kind, can be repeated')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if search.get_backend() is None:
+            raise CommandError('Full-text search is not supported on this database')
+        for kind in options['kind'] or sorted(search.INDEXED):
+            with transaction.atomic():
+                total = search.rebuild(kind, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Indexed {total} {kind} rows'))
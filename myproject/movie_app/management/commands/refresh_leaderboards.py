@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from movie_app import leaderboards
+from movie_app.models import LeaderboardEntry
+
+
+class Command(BaseCommand):
+    help = ('Refresh the top rated and trending leaderboards. Meant to run every few minutes from cron, '
+            'each run reads only the activity since the previous one')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--board', action='append', choices=[board for board, label in LeaderboardEntry.BOARD_CHOICES])
+        parser.add_argument('--full', action='store_true', help='Recompute trending from the whole window')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = leaderboards.refresh(options['board'], full=options['full'])
+        summary = ', '.join(f'{board}: {rows} rows written' for board, rows in written.items())
+        self.stdout.write(self.style.SUCCESS(f'{summary} in {time.perf_counter() - started:.1f}s'))
@@ -0,0 +1,172 @@
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from movie_app.models import (
+    Country, Director, Actor, Genre, Movie, MovieLanguages, Moments, Rating,
+    UserProfile, Favorite, FavoriteMovie, History
+)
+
+WORDS_EN = ('night', 'river', 'storm', 'silent', 'road', 'last', 'city', 'winter', 'fire', 'dream',
+            'shadow', 'golden', 'lost', 'iron', 'summer', 'wild', 'broken', 'star', 'house', 'heart')
+WORDS_RU = ('ночь', 'река', 'буря', 'тихий', 'дорога', 'последний', 'город', 'зима', 'огонь', 'сон',
+            'тень', 'золотой', 'потерянный', 'железный', 'лето', 'дикий', 'сломанный', 'звезда', 'дом', 'сердце')
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with a synthetic bilingual catalogue for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=1000)
+        parser.add_argument('--countries', type=int, default=40)
+        parser.add_argument('--genres', type=int, default=20)
+        parser.add_argument('--actors', type=int, default=2000)
+        parser.add_argument('--directors', type=int, default=300)
+        parser.add_argument('--users', type=int, default=500)
+        parser.add_argument('--ratings-per-movie', type=int, default=20)
+        parser.add_argument('--reply-ratio', type=float, default=0.3,
+                            help='Share of ratings that are replies to another rating of the same movie')
+        parser.add_argument('--favorites-per-user', type=int, default=10)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = f'seed{self.random.randrange(10 ** 6)}'
+        with transaction.atomic():
+            countries = self.create_named(Country, 'country_name', options['countries'])
+            genres = self.create_named(Genre, 'genre_name', options['genres'])
+            actors = self.create_people(Actor, 'actor', options['actors'])
+            directors = self.create_people(Director, 'director', options['directors'])
+            users = self.create_users(options['users'])
+            movies = self.create_movies(options['movies'])
+            self.link(movies, 'country', countries, 1, 3)
+            self.link(movies, 'genre', genres, 1, 4)
+            self.link(movies, 'actor', actors, 3, 12)
+            self.link(movies, 'director', directors, 1, 2)
+            self.create_media(movies)
+            self.create_ratings(movies, users, options['ratings_per_movie'], options['reply_ratio'])
+            self.create_favorites(movies, users, options['favorites_per_user'])
+
+        call_command('rebuild_rating_aggregates', stdout=self.stdout)
+        call_command('rebuild_search_index', stdout=self.stdout)
+        cache.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(movies)} movies, {len(actors)} actors, {len(directors)} directors, {len(users)} users'
+        ))
+
+    def title(self, words=2):
+        indexes = self.random.sample(range(len(WORDS_EN)), words)
+        return (' '.join(WORDS_EN[i] for i in indexes).title(),
+                ' '.join(WORDS_RU[i] for i in indexes).capitalize())
+
+    def text(self, words=40):
+        indexes = [self.random.randrange(len(WORDS_EN)) for _ in range(words)]
+        return ' '.join(WORDS_EN[i] for i in indexes), ' '.join(WORDS_RU[i] for i in indexes)
+
+    def bulk(self, model, objects):
+        return model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def create_named(self, model, field, count):
+        objects = []
+        for i in range(count):
+            en, ru = self.title(1)
+            objects.append(model(**{field: f'{en} {self.prefix}-{i}', f'{field}_en': f'{en} {self.prefix}-{i}',
+                                    f'{field}_ru': f'{ru} {self.prefix}-{i}'}))
+        return self.bulk(model, objects)
+
+    def create_people(self, model, kind, count):
+        objects = []
+        for i in range(count):
+            name_en, name_ru = self.title(2)
+            bio_en, bio_ru = self.text()
+            objects.append(model(**{
+                f'{kind}_name': name_en, f'{kind}_name_en': name_en, f'{kind}_name_ru': name_ru,
+                'bio': bio_en, 'bio_en': bio_en, 'bio_ru': bio_ru,
+                'age': date(1940, 1, 1) + timedelta(days=self.random.randrange(60 * 365)),
+                f'{kind}_image': f'{kind}s/seed.jpg',
+            }))
+        return self.bulk(model, objects)
+
+    def create_users(self, count):
+        password = make_password('password')
+        users = [
+            UserProfile(username=f'{self.prefix}-user{i}', password=password, first_name=f'User {i}',
+                        status=self.random.choice(('pro', 'simple')))
+            for i in range(count)
+        ]
+        return self.bulk(UserProfile, users)
+
+    def create_movies(self, count):
+        movies = []
+        for i in range(count):
+            name_en, name_ru = self.title(self.random.randint(1, 3))
+            description_en, description_ru = self.text(80)
+            movies.append(Movie(
+                movie_name=name_en, movie_name_en=name_en, movie_name_ru=name_ru,
+                description=description_en, description_en=description_en, description_ru=description_ru,
+                year=date(1950, 1, 1) + timedelta(days=self.random.randrange(75 * 365)),
+                types=self.random.choice(Movie.TYPES_CHOICES)[0],
+                movie_time=self.random.randint(70, 200),
+                movie_trailer=f'https://example.com/trailers/{self.prefix}-{i}',
+                movie_image='movies_images/seed.jpg',
+                status_movie=self.random.choice(('simple', 'pro')),
+            ))
+        return self.bulk(Movie, movies)
+
+    def link(self, movies, field, targets, low, high):
+        through = getattr(Movie, field).through
+        rows = []
+        for movie in movies:
+            for target in self.random.sample(targets, min(self.random.randint(low, high), len(targets))):
+                rows.append(through(movie_id=movie.pk, **{f'{field}_id': target.pk}))
+        self.bulk(through, rows)
+
+    def create_media(self, movies):
+        self.bulk(MovieLanguages, [
+            MovieLanguages(movie=movie, language=language, language_en=language, language_ru=language,
+                           video='movies_videos/seed.mp4')
+            for movie in movies for language in ('en', 'ru')
+        ])
+        self.bulk(Moments, [
+            Moments(movie=movie, movie_moments='moments/seed.jpg')
+            for movie in movies for _ in range(self.random.randint(2, 6))
+        ])
+
+    def create_ratings(self, movies, users, per_movie, reply_ratio):
+        if not users:
+            return
+        reviews = []
+        for movie in movies:
+            for user in self.random.sample(users, min(per_movie, len(users))):
+                en, ru = self.text(20)
+                reviews.append(Rating(movie=movie, user=user, stars=self.random.randint(1, 10), text=en))
+        reviews = self.bulk(Rating, reviews)
+
+        # replies are created level by level so their parents already have ids,
+        # each level takes half of the remaining replies to get threads of varying depth
+        level = reviews
+        total_replies = int(len(reviews) * reply_ratio)
+        while total_replies > 0 and level:
+            replies = []
+            count = min(max((total_replies + 1) // 2, 1), len(level))
+            for parent in self.random.sample(level, count):
+                replies.append(Rating(movie_id=parent.movie_id, user=self.random.choice(users), parent=parent,
+                                      root_id=parent.root_id or parent.pk, stars=self.random.randint(1, 10),
+                                      text=self.text(10)[0]))
+            level = self.bulk(Rating, replies)
+            total_replies -= len(level)
+
+    def create_favorites(self, movies, users, per_user):
+        carts = self.bulk(Favorite, [Favorite(user=user) for user in users])
+        self.bulk(FavoriteMovie, [
+            FavoriteMovie(cart=cart, movie=movie)
+            for cart in carts for movie in self.random.sample(movies, min(per_user, len(movies)))
+        ])
+        self.bulk(History, [History(user=user, movie=self.random.choice(movies)) for user in users if movies])
@@ -0,0 +1,27 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Copy the SQLite primary into the SQLITE_REPLICAS files, standing in for replication locally'
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        if primary['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError('Only SQLite replicas are copied, Postgres replicas use streaming replication')
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('No replicas configured, set SQLITE_REPLICAS')
+        source = sqlite3.connect(primary['NAME'])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                target = sqlite3.connect(settings.DATABASES[alias]['NAME'])
+                try:
+                    # the online backup API gives a consistent snapshot even while the primary is written to
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(f'{alias}: {settings.DATABASES[alias]["NAME"]}')
+        finally:
+            source.close()
@@ -0,0 +1,187 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+)
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+# With PROMETHEUS_MULTIPROC_DIR set before the first import of prometheus_client every worker writes
+# its samples to memory-mapped files in that directory and the metrics view adds them up, so any
+# worker answers for all of them. Without it the samples stay in the process, fine for runserver.
+UNRESOLVED = 'unresolved'
+QUERY_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 25, 50, 100, float('inf'))
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, float('inf'))
+
+request_seconds = Histogram('movie_app_request_seconds', 'Time from the first middleware to the response',
+                            ['view', 'method', 'status'])
+request_queries = Histogram('movie_app_request_queries', 'Database queries per request', ['view'],
+                            buckets=QUERY_BUCKETS)
+request_db_seconds = Histogram('movie_app_request_db_seconds', 'Time spent in database queries per request',
+                               ['view'])
+serializer_seconds = Histogram('movie_app_serializer_seconds', 'Time spent producing serializer data',
+                               ['view', 'serializer'])
+response_bytes = Histogram('movie_app_response_bytes', 'Response body size as sent, after compression',
+                           ['view'], buckets=SIZE_BUCKETS)
+slow_queries = Counter('movie_app_slow_queries', 'Queries slower than SLOW_QUERY_MS', ['view', 'serializer'])
+
+slow_query_log = logging.getLogger('movie_app.slow_queries')
+
+_stats = ContextVar('movie_app_request_stats', default=None)
+_serializer = ContextVar('movie_app_serializer', default=None)
+
+
+class RequestStats:
+    # shared with the threads sync_to_async runs the queries of async views in, hence the lock
+    def __init__(self, request):
+        self.request = request
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.db_seconds = 0.0
+
+    @property
+    def view(self):
+        match = getattr(self.request, 'resolver_match', None)
+        return match.view_name if match is not None else UNRESOLVED
+
+    def add_query(self, seconds):
+        with self.lock:
+            self.queries += 1
+            self.db_seconds += seconds
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - started
+        stats.add_query(seconds)
+        if seconds * 1000 >= settings.SLOW_QUERY_MS:
+            serializer = _serializer.get() or ''
+            slow_queries.labels(stats.view, serializer).inc()
+            # the statement without its parameters, they can hold what users typed
+            slow_query_log.warning('%.1f ms view=%s serializer=%s %s', seconds * 1000, stats.view,
+                                   serializer or '-', sql, extra={
+                                       'duration_ms': seconds * 1000, 'view': stats.view,
+                                       'serializer': serializer, 'sql': sql})
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    # runs on every new connection, whichever thread opened it
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def serializing(name):
+    """Times the block as serializer `name`, nested serializers count as part of the outermost one."""
+    stats = _stats.get()
+    if stats is None or _serializer.get() is not None:
+        yield
+        return
+    token = _serializer.set(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        serializer_seconds.labels(stats.view, name).observe(time.perf_counter() - started)
+        _serializer.reset(token)
+
+
+def serializer_name(serializer):
+    if isinstance(serializer, ListSerializer):
+        serializer = serializer.child
+    return type(serializer).__name__
+
+
+def install_serializer_timing():
+    data = BaseSerializer.data
+    if getattr(data.fget, 'timed', False):
+        return
+
+    def timed_data(self):
+        with serializing(serializer_name(self)):
+            return data.fget(self)
+    timed_data.timed = True
+    BaseSerializer.data = property(timed_data)
+
+
+def install():
+    connection_created.connect(install_query_wrapper, dispatch_uid='movie_app_metrics')
+    install_serializer_timing()
+
+
+class MetricsMiddleware:
+    """
+    Latency, query count and time, and body size of every request, labelled with the name of the
+    view it resolved to. Goes first so the time and size cover the other middleware too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats, started = RequestStats(request), time.perf_counter()
+        token = _stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _stats.reset(token)
+        return self.observe(stats, started, request, response)
+
+    async def __acall__(self, request):
+        stats, started = RequestStats(request), time.perf_counter()
+        token = _stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _stats.reset(token)
+        return self.observe(stats, started, request, response)
+
+    def observe(self, stats, started, request, response):
+        view = stats.view
+        request_seconds.labels(view, request.method, str(response.status_code)).observe(time.perf_counter() - started)
+        request_queries.labels(view).observe(stats.queries)
+        request_db_seconds.labels(view).observe(stats.db_seconds)
+        if not response.streaming:
+            response_bytes.labels(view).observe(len(response.content))
+        elif response.has_header('Content-Length'):
+            response_bytes.labels(view).observe(int(response['Content-Length']))
+        return response
+
+
+def get_registry():
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if not path:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=path)
+    return registry
+
+
+def metrics_view(request):
+    # scraped with Authorization: Bearer METRICS_TOKEN, or opened by staff from a session
+    token = settings.METRICS_TOKEN
+    authorized = bool(token) and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}')
+    if not authorized and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
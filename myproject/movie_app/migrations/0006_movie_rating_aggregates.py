@@ -0,0 +1,57 @@
+# Generated by Django 5.2.8 on 2026-10-18 20:26
+
+import movie_app.models
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    Movie = apps.get_model('movie_app', 'Movie')
+    Rating = apps.get_model('movie_app', 'Rating')
+    histograms = {}
+    for movie_id, stars, n in Rating.objects.order_by().values_list('movie_id', 'stars').annotate(n=Count('id')):
+        histograms.setdefault(movie_id, [0] * 10)[stars - 1] = n
+    movies = Movie.objects.filter(pk__in=histograms)
+    for movie in movies:
+        histogram = histograms[movie.pk]
+        movie.rating_histogram = histogram
+        movie.rating_count = sum(histogram)
+        movie.rating_sum = sum(stars * n for stars, n in enumerate(histogram, start=1))
+        movie.rating_avg = movie.rating_sum / movie.rating_count
+    Movie.objects.bulk_update(movies, ['rating_sum', 'rating_count', 'rating_avg', 'rating_histogram'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0005_alter_moments_movie_alter_movie_actor_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='rating_avg',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_histogram',
+            field=models.JSONField(default=movie_app.models.empty_rating_histogram, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='movie',
+            name='status_movie',
+            field=models.CharField(choices=[('host', 'host'), ('guest', 'guest')]),
+        ),
+        migrations.RunPython(fill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+from django.db import migrations
+
+
+CREATE_SQL = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE movie_app_search USING fts5(name, body, tokenize = 'unicode61 remove_diacritics 2')",
+    ],
+    'postgresql': [
+        "CREATE TABLE movie_app_search ("
+        "id bigint PRIMARY KEY, "
+        "name text NOT NULL DEFAULT '', "
+        "body text NOT NULL DEFAULT '', "
+        "document tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('simple', name), 'A') || setweight(to_tsvector('simple', body), 'B')"
+        ") STORED)",
+        "CREATE INDEX movie_app_search_document ON movie_app_search USING GIN (document)",
+    ],
+}
+
+
+def join_columns(values):
+    parts = []
+    for value in values:
+        if value and value not in parts:
+            parts.append(value)
+    return ' '.join(parts)
+
+
+def create_search_index(apps, schema_editor):
+    statements = CREATE_SQL.get(schema_editor.connection.vendor)
+    if not statements:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+    indexed = [
+        ('Movie', 1, ('movie_name_en', 'movie_name_ru'), ('description_en', 'description_ru')),
+        ('Actor', 2, ('actor_name_en', 'actor_name_ru'), ('bio_en', 'bio_ru')),
+        ('Director', 3, ('director_name_en', 'director_name_ru'), ('bio_en', 'bio_ru')),
+    ]
+    rows = []
+    for model_name, code, name_fields, body_fields in indexed:
+        model = apps.get_model('movie_app', model_name)
+        for values in model.objects.values_list('pk', *name_fields, *body_fields):
+            names, bodies = values[1:1 + len(name_fields)], values[1 + len(name_fields):]
+            rows.append((values[0] * 8 + code, join_columns(names), join_columns(bodies)))
+    with schema_editor.connection.cursor() as cursor:
+        column = 'rowid' if schema_editor.connection.vendor == 'sqlite' else 'id'
+        cursor.executemany(f'INSERT INTO movie_app_search ({column}, name, body) VALUES (%s, %s, %s)', rows)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        schema_editor.execute('DROP TABLE IF EXISTS movie_app_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0006_movie_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-18 20:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_thread_roots(apps, schema_editor):
+    Rating = apps.get_model('movie_app', 'Rating')
+    parents = dict(Rating.objects.values_list('pk', 'parent_id'))
+    replies = []
+    for pk, parent_id in parents.items():
+        if parent_id is None:
+            continue
+        root_id = parent_id
+        while parents.get(root_id) is not None:
+            root_id = parents[root_id]
+        replies.append(Rating(pk=pk, root_id=root_id))
+    Rating.objects.bulk_update(replies, ['root'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0007_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rating',
+            name='root',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread_replies', to='movie_app.rating'),
+        ),
+        migrations.RunPython(fill_thread_roots, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['movie', 'parent', '-created_date'], name='rating_movie_top_level'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0008_rating_thread_root'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.8 on 2026-10-18 20:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0009_movie_external_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewingEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='viewing_events', to='movie_app.movie')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='viewing_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-created_at'], name='viewing_event_user_recent'), models.Index(fields=['created_at'], name='viewing_event_created')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ViewingSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(default=0)),
+                ('views_count', models.PositiveIntegerField(default=0)),
+                ('last_viewed_at', models.DateTimeField()),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='viewing_summaries', to='movie_app.movie')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='viewing_summaries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-last_viewed_at'], name='viewing_summary_user_recent')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'movie'), name='viewing_summary_user_movie')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-18 21:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0010_viewing_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(choices=[('top-rated', 'top rated'), ('trending', 'trending')], max_length=16)),
+                ('scope', models.CharField(blank=True, default='', max_length=32)),
+                ('rank', models.PositiveIntegerField()),
+                ('score', models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MovieTrend',
+            fields=[
+                ('movie', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trend', serialize=False, to='movie_app.movie')),
+                ('score', models.FloatField(default=0)),
+                ('refreshed_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['created_date'], name='rating_created'),
+        ),
+        migrations.AddField(
+            model_name='leaderboardentry',
+            name='movie',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='movie_app.movie'),
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardentry',
+            constraint=models.UniqueConstraint(fields=('board', 'scope', 'rank'), name='leaderboard_rank'),
+        ),
+    ]
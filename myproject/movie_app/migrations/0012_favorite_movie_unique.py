@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-18 21:17
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def remove_duplicate_favorites(apps, schema_editor):
+    FavoriteMovie = apps.get_model('movie_app', 'FavoriteMovie')
+    keep = FavoriteMovie.objects.order_by().values('cart_id', 'movie_id').annotate(keep=Min('pk')).values('keep')
+    FavoriteMovie.objects.exclude(pk__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movie_app', '0011_leaderboards'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_favorites, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='favoritemovie',
+            constraint=models.UniqueConstraint(fields=('cart', 'movie'), name='favorite_movie_cart_movie'),
+        ),
+    ]
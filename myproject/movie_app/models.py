@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from phonenumber_field.modelfields import PhoneNumberField
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db import transaction
+from django.utils import timezone
 
 STATUS_CHOICES = (
     ('host', 'host'),
@@ -27,12 +29,36 @@ class UserProfile(AbstractUser):
 
 
 
-class Country(models.Model):
+class VersionedModel(models.Model):
+    # bumped by every save and by touch() when related or child rows change, conditional GETs
+    # build their ETag and Last-Modified from these, see movie_app/conditional.py
+    updated_at = models.DateTimeField(default=timezone.now, editable=False)
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+        self.updated_at = timezone.now()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def touch(cls, pks):
+        # pks may be a list or a values('pk') subquery
+        return cls.objects.filter(pk__in=pks).update(version=models.F('version') + 1, updated_at=timezone.now())
+
+
+class Country(VersionedModel):
    country_name = models.CharField(max_length=60, unique=True)
    def __str__(self):
         return self.country_name
 
-class Director(models.Model):
+class Director(VersionedModel):
     director_name = models.CharField(max_length=100)
     bio = models.TextField()
     age = models.DateField()
@@ -41,7 +67,7 @@ class Director(models.Model):
     def __str__(self):
         return self.director_name
 
-class Actor(models.Model):
+class Actor(VersionedModel):
     actor_name = models.CharField(max_length=100)
     bio = models.TextField()
     age = models.DateField()
@@ -50,15 +76,20 @@ class Actor(models.Model):
     def __str__(self):
         return self.actor_name
 
-class Genre(models.Model):
+class Genre(VersionedModel):
     genre_name = models.CharField(max_length=50, unique=True)
     def __str__(self):
         return self.genre_name
 
-class Movie(models.Model):
+def empty_rating_histogram():
+    return [0] * 10
+
+
+class Movie(VersionedModel):
     TYPES_CHOICES = (('144','144'), ('360','360'), ('480','480'), ('720','720'), ('1080','1080'))
 
 
+    external_id = models.CharField(max_length=64, unique=True, null=True, blank=True)
     movie_name = models.CharField(max_length=200)
     year = models.DateField()
     country = models.ManyToManyField(Country, related_name='country_movies')
@@ -71,15 +102,45 @@ class Movie(models.Model):
     movie_trailer = models.URLField()
     movie_image = models.ImageField(upload_to='movies_images/')
     status_movie = models.CharField(choices=STATUS_CHOICES)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.FloatField(default=0, editable=False)
+    rating_histogram = models.JSONField(default=empty_rating_histogram, editable=False)
 
     def get_avg_rating(self):
-        ratings = self.movie_ratings.all()
-        if ratings.exists():
-            return round(sum([i.stars for i in ratings]) / ratings.count(), 2)
-        return 0
+        return round(self.rating_avg, 2)
 
     def get_count_people(self):
-        return self.movie_ratings.count()
+        return self.rating_count
+
+    def set_rating_aggregates(self, histogram):
+        self.rating_histogram = list(histogram)
+        self.rating_count = sum(self.rating_histogram)
+        self.rating_sum = sum(stars * n for stars, n in enumerate(self.rating_histogram, start=1))
+        self.rating_avg = self.rating_sum / self.rating_count if self.rating_count else 0
+
+    @classmethod
+    def apply_rating_change(cls, removed=(), added=()):
+        # removed / added are (movie_id, stars) pairs of ratings that left or joined the aggregates
+        changes = [(pair, -1) for pair in removed] + [(pair, 1) for pair in added]
+        if not changes:
+            return
+        with transaction.atomic():
+            movie_ids = sorted({movie_id for (movie_id, stars), delta in changes})
+            # with the versioned fields, save() bumps them without reading them back
+            movies = cls.objects.select_for_update().only(
+                'rating_sum', 'rating_count', 'rating_avg', 'rating_histogram', 'version', 'updated_at'
+            ).in_bulk(movie_ids)
+            for (movie_id, stars), delta in changes:
+                movie = movies.get(movie_id)
+                if movie is None:
+                    # already deleted, nothing left to keep up to date
+                    continue
+                histogram = list(movie.rating_histogram)
+                histogram[stars - 1] = max(histogram[stars - 1] + delta, 0)
+                movie.set_rating_aggregates(histogram)
+            for movie in movies.values():
+                movie.save(update_fields=['rating_sum', 'rating_count', 'rating_avg', 'rating_histogram'])
 
     def __str__(self):
         return self.movie_name
@@ -102,14 +163,51 @@ class Moments(models.Model):
         return f'{self.movie}'
 
 
-class Rating(models.Model):
+class Rating(VersionedModel):
     user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE,related_name='movie_ratings')
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True)
+    root = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, editable=False,
+                             related_name='thread_replies')
     stars = models.PositiveIntegerField(choices=[(i, str(i))for i in range(1, 11)])
     text = models.TextField()
     created_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['movie', 'parent', '-created_date'], name='rating_movie_top_level'),
+            models.Index(fields=['created_date'], name='rating_created'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # replies point at the top-level review of their thread, so a whole thread loads in one query
+        if self.parent_id is None:
+            self.root = None
+        else:
+            self.root_id = self.parent.root_id or self.parent_id
+        with transaction.atomic():
+            stored = None
+            if not self._state.adding:
+                # the row as stored, locked, a concurrent update must not take it out of the aggregates twice
+                stored = Rating.objects.select_for_update().filter(pk=self.pk).values_list(
+                    'root_id', 'movie_id', 'stars').first()
+            super().save(*args, **kwargs)
+            # deletes, cascades included, leave the aggregates in the post_delete signal
+            removed = [stored[1:]] if stored is not None else []
+            if removed != [(self.movie_id, self.stars)]:
+                Movie.apply_rating_change(removed=removed, added=[(self.movie_id, self.stars)])
+            if stored is not None and stored[0] != self.root_id:
+                # moved to another thread or made a review itself: the replies below it follow
+                Rating.objects.filter(pk__in=self.get_reply_ids()).update(root_id=self.root_id or self.pk)
+
+    def get_reply_ids(self):
+        reply_ids = []
+        parents = [self.pk]
+        while parents:
+            parents = list(Rating.objects.filter(parent__in=parents).values_list('pk', flat=True))
+            reply_ids.extend(parents)
+        return reply_ids
+
     def __str__(self):
         return f'{self.user}, {self.movie}'
 
@@ -121,7 +219,73 @@ class FavoriteMovie(models.Model):
     cart = models.ForeignKey(Favorite, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'movie'], name='favorite_movie_cart_movie'),
+        ]
+
 class History(models.Model):
     user = models.OneToOneField(UserProfile, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
-    viewed_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    viewed_at = models.DateTimeField(auto_now_add=True)
+
+
+class ViewingEvent(models.Model):
+    # append-only play log, written in batches by viewing.EventBuffer and folded into
+    # ViewingSummary by the compact_viewing_events command
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='viewing_events', db_index=False)
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='viewing_events')
+    position = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='viewing_event_user_recent'),
+            models.Index(fields=['created_at'], name='viewing_event_created'),
+        ]
+
+
+class ViewingSummary(models.Model):
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='viewing_summaries',
+                             db_index=False)
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='viewing_summaries')
+    position = models.PositiveIntegerField(default=0)
+    # runs of position reports, see compact_viewing_events.VIEW_GAP
+    views_count = models.PositiveIntegerField(default=0)
+    last_viewed_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'movie'], name='viewing_summary_user_movie'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-last_viewed_at'], name='viewing_summary_user_recent'),
+        ]
+
+
+class MovieTrend(models.Model):
+    # time-decayed activity of a movie as of refreshed_at, kept only while it has activity
+    # inside the trending window, see movie_app/leaderboards.py
+    movie = models.OneToOneField(Movie, on_delete=models.CASCADE, primary_key=True, related_name='trend')
+    score = models.FloatField(default=0)
+    refreshed_at = models.DateTimeField()
+
+
+class LeaderboardEntry(models.Model):
+    TOP_RATED = 'top-rated'
+    TRENDING = 'trending'
+    BOARD_CHOICES = (
+        (TOP_RATED, 'top rated'),
+        (TRENDING, 'trending'),
+    )
+    board = models.CharField(max_length=16, choices=BOARD_CHOICES)
+    # '' for the whole catalogue, 'genre:<pk>' or 'country:<pk>'
+    scope = models.CharField(max_length=32, blank=True, default='')
+    rank = models.PositiveIntegerField()
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['board', 'scope', 'rank'], name='leaderboard_rank'),
+        ]
@@ -1,6 +1,185 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import date
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 
 class MoviePagination(PageNumberPagination):
     page_size = 1
+
+
+class RatingPagination(PageNumberPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+
+
+class LeaderboardPagination(BasePagination):
+    """
+    Pages of a precomputed leaderboard are rank ranges, so the last page costs what the first does.
+    Stale ranks of deleted movies may leave a page short until the next refresh.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    page_query_param = 'page'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        try:
+            self.page_number = max(int(request.query_params.get(self.page_query_param, 1)), 1)
+        except ValueError:
+            raise NotFound('Неверная страница')
+        start = (self.page_number - 1) * self.page_size
+        results = list(queryset.filter(rank__gt=start, rank__lte=start + self.page_size + 1).order_by('rank'))
+        self.has_next = bool(results) and results[-1].rank > start + self.page_size
+        return [entry for entry in results if entry.rank <= start + self.page_size]
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.base_url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.page_number == 1:
+            return None
+        if self.page_number == 2:
+            return remove_query_param(self.base_url, self.page_query_param)
+        return replace_query_param(self.base_url, self.page_query_param, self.page_number - 1)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+
+class MovieCursorPagination(BasePagination):
+    """
+    Keyset pagination over (year, id): every page is a single indexed range scan,
+    no OFFSET and, unless the client asks for it with ?count=1, no COUNT(*).
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering_query_param = 'ordering'
+    ordering_field = 'year'
+    default_ordering = '-year'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.descending = self.get_ordering(request).startswith('-')
+        self.cursor = self.decode_cursor(request)
+        self.count = queryset.count() if self.include_count(request) else None
+
+        reverse = bool(self.cursor and self.cursor['r'])
+        if self.cursor:
+            queryset = queryset.filter(self.position_filter(self.cursor, before=reverse))
+        descending = self.descending != reverse
+        prefix = '-' if descending else ''
+        queryset = queryset.order_by(f'{prefix}{self.ordering_field}', f'{prefix}pk')
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering(self, request):
+        ordering = request.query_params.get(self.ordering_query_param, '')
+        if ordering.lstrip('-') == self.ordering_field:
+            return ordering
+        return self.default_ordering
+
+    def include_count(self, request):
+        return request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes')
+
+    def position_filter(self, cursor, before):
+        # rows strictly after (or before) the (year, id) position in the current ordering
+        lookup = 'lt' if self.descending != before else 'gt'
+        year = cursor['y']
+        return (Q(**{f'{self.ordering_field}__{lookup}': year}) |
+                Q(**{self.ordering_field: year, f'pk__{lookup}': cursor['i']}))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            return {'y': date.fromisoformat(data['y']), 'i': int(data['i']), 'r': bool(data['r'])}
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, movie, reverse):
+        data = {'y': getattr(movie, self.ordering_field).isoformat(), 'i': movie.pk, 'r': int(reverse)}
+        encoded = urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'example': 123},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,33 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# datetimes go through DRF's encoder for its 'Z' suffix, dataclasses are not JSON in DRF either
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+                  if orjson else 0)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer output from orjson: compact, unescaped UTF-8, with \\u2028 and \\u2029 escaped
+    and everything orjson does not know (dates, decimals, lazy strings, querysets) converted by
+    DRF's encoder. Indented output, ensure_ascii / non-compact settings, integers beyond 64 bits
+    and a missing orjson go through JSONRenderer. Unlike STRICT_JSON, NaN and infinity render as null.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (orjson is None or self.ensure_ascii or not self.compact or
+                self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
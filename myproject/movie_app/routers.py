@@ -0,0 +1,100 @@
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Per-request routing state, shared with the threads sync_to_async runs queries in.
+# Outside a request (management commands, the shell, tests without a client) it is
+# None and every query goes to the primary.
+_state = ContextVar('replica_routing', default=None)
+# set while loading what gets cached, see primary_reads()
+_primary = ContextVar('replica_primary_reads', default=False)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'primary_pin'
+PIN_PREFIX = 'replica:pin:'
+
+
+def get_replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def get_sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+
+@contextmanager
+def primary_reads():
+    """
+    Reads inside the block go to the primary. For results that are cached: a replica that has
+    not caught up with a write yet would be cached under the generation the write bumped.
+    """
+    token = _primary.set(True)
+    try:
+        yield
+    finally:
+        _primary.reset(token)
+
+
+def pin_key(request):
+    # JWT clients often drop cookies, their token identifies them across requests instead
+    authorization = request.META.get('HTTP_AUTHORIZATION')
+    if not authorization:
+        return None
+    return PIN_PREFIX + hashlib.sha1(authorization.encode()).hexdigest()
+
+
+class ReplicaRouter:
+    """
+    Reads of safe requests go to a random DATABASE_REPLICAS alias, everything else to 'default'.
+    A request is pinned to the primary once it writes, and so are the client's requests for the
+    next REPLICA_STICKY_SECONDS, so it reads its own writes despite replication lag.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        replicas = get_replicas()
+        if state is None or state['pinned'] or not replicas or _primary.get():
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state['pinned'] = state['wrote'] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get their schema from the primary
+        if db in get_replicas():
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        key = pin_key(request)
+        pinned = (request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES or
+                  (key is not None and cache.get(key) is not None))
+        state = {'pinned': pinned, 'wrote': False}
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        if state['wrote']:
+            seconds = get_sticky_seconds()
+            response.set_cookie(PIN_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
+            if key is not None:
+                cache.set(key, True, seconds)
+        return response
@@ -0,0 +1,180 @@
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Movie, Actor, Director
+
+# One row per indexed object. The row id packs the object id and its kind
+# (object_id * 8 + kind code), so upserts and deletes are primary key lookups
+# on both backends.
+SEARCH_TABLE = 'movie_app_search'
+
+INDEXED = {
+    'movie': (1, Movie, ('movie_name_en', 'movie_name_ru'), ('description_en', 'description_ru')),
+    'actor': (2, Actor, ('actor_name_en', 'actor_name_ru'), ('bio_en', 'bio_ru')),
+    'director': (3, Director, ('director_name_en', 'director_name_ru'), ('bio_en', 'bio_ru')),
+}
+KIND_BY_MODEL = {model: kind for kind, (code, model, name_fields, body_fields) in INDEXED.items()}
+
+
+def indexed_fields(kind):
+    code, model, name_fields, body_fields = INDEXED[kind]
+    columns = name_fields + body_fields
+    return set(columns) | {column.rsplit('_', 1)[0] for column in columns}
+
+
+def row_id(kind, object_id):
+    return object_id * 8 + INDEXED[kind][0]
+
+
+def join_columns(values):
+    parts = []
+    for value in values:
+        if value and value not in parts:
+            parts.append(value)
+    return ' '.join(parts)
+
+
+def document_for(kind, instance):
+    code, model, name_fields, body_fields = INDEXED[kind]
+    return (
+        row_id(kind, instance.pk),
+        join_columns(getattr(instance, field) for field in name_fields),
+        join_columns(getattr(instance, field) for field in body_fields),
+    )
+
+
+def query_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+class SQLiteSearchBackend:
+    def match_query(self, terms):
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def upsert(self, cursor, rows):
+        cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(f'INSERT INTO {SEARCH_TABLE} (rowid, name, body) VALUES (%s, %s, %s)', rows)
+
+    def delete(self, cursor, ids):
+        cursor.executemany(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [(pk,) for pk in ids])
+
+    def clear(self, cursor, code):
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid %% 8 = %s', [code])
+
+    def ranked(self, cursor, code, terms, limit):
+        # bm25 is lower-is-better; names weigh ten times more than descriptions and bios
+        cursor.execute(
+            f'SELECT rowid / 8, bm25({SEARCH_TABLE}, 10.0, 1.0) AS rank FROM {SEARCH_TABLE} '
+            f'WHERE {SEARCH_TABLE} MATCH %s AND rowid %% 8 = %s ORDER BY rank LIMIT %s',
+            [self.match_query(terms), code, limit],
+        )
+        return cursor.fetchall()
+
+    def matching_ids_sql(self, code, terms):
+        return (f'SELECT rowid / 8 FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s AND rowid %% 8 = %s',
+                [self.match_query(terms), code])
+
+
+class PostgresSearchBackend:
+    def match_query(self, terms):
+        return ' & '.join(f'{term}:*' for term in terms)
+
+    def upsert(self, cursor, rows):
+        cursor.executemany(
+            f'INSERT INTO {SEARCH_TABLE} (id, name, body) VALUES (%s, %s, %s) '
+            f'ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, body = EXCLUDED.body',
+            rows,
+        )
+
+    def delete(self, cursor, ids):
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE id = ANY(%s)', [list(ids)])
+
+    def clear(self, cursor, code):
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE id %% 8 = %s', [code])
+
+    def ranked(self, cursor, code, terms, limit):
+        cursor.execute(
+            f"SELECT id / 8, ts_rank(document, to_tsquery('simple', %s)) AS rank FROM {SEARCH_TABLE} "
+            f"WHERE document @@ to_tsquery('simple', %s) AND id %% 8 = %s ORDER BY rank DESC LIMIT %s",
+            [self.match_query(terms), self.match_query(terms), code, limit],
+        )
+        return cursor.fetchall()
+
+    def matching_ids_sql(self, code, terms):
+        return (f"SELECT id / 8 FROM {SEARCH_TABLE} WHERE document @@ to_tsquery('simple', %s) AND id %% 8 = %s",
+                [self.match_query(terms), code])
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend():
+    backend_class = BACKENDS.get(connection.vendor)
+    return backend_class() if backend_class else None
+
+
+def index_instances(kind, instances):
+    backend = get_backend()
+    rows = [document_for(kind, instance) for instance in instances]
+    if backend and rows:
+        with connection.cursor() as cursor:
+            backend.upsert(cursor, rows)
+
+
+def remove_instances(kind, object_ids):
+    backend = get_backend()
+    ids = [row_id(kind, object_id) for object_id in object_ids]
+    if backend and ids:
+        with connection.cursor() as cursor:
+            backend.delete(cursor, ids)
+
+
+def rebuild(kind, batch_size=500):
+    backend = get_backend()
+    if backend is None:
+        return 0
+    code, model, name_fields, body_fields = INDEXED[kind]
+    with connection.cursor() as cursor:
+        backend.clear(cursor, code)
+    batch = []
+    total = 0
+    for instance in model.objects.only(*name_fields, *body_fields).order_by('pk').iterator(chunk_size=batch_size):
+        batch.append(instance)
+        if len(batch) >= batch_size:
+            index_instances(kind, batch)
+            total += len(batch)
+            batch = []
+    index_instances(kind, batch)
+    return total + len(batch)
+
+
+def search(kind, query, limit=20):
+    """Return [(object_id, rank)] best match first."""
+    backend = get_backend()
+    terms = query_terms(query)
+    if not backend or not terms:
+        return []
+    with connection.cursor() as cursor:
+        return backend.ranked(cursor, INDEXED[kind][0], terms, limit)
+
+
+def filter_matching(queryset, query):
+    kind = KIND_BY_MODEL[queryset.model]
+    backend = get_backend()
+    terms = query_terms(query)
+    if not terms:
+        return queryset
+    if backend is None:
+        code, model, name_fields, body_fields = INDEXED[kind]
+        condition = Q()
+        for field in name_fields:
+            condition |= Q(**{f'{field}__icontains': query})
+        return queryset.filter(condition)
+    sql, params = backend.matching_ids_sql(INDEXED[kind][0], terms)
+    return queryset.filter(pk__in=RawSQL(sql, params))
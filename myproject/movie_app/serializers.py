@@ -3,9 +3,30 @@ from rest_framework import serializers
 from rest_framework.fields import DateField
 from .models import (
     Country, Director, Actor, Genre, Movie,
-    MovieLanguages, Moments, Rating, UserProfile, Favorite, History
+    MovieLanguages, Moments, Rating, UserProfile, Favorite, FavoriteMovie, History, LeaderboardEntry
 )
-from rest_framework_simplejwt.tokens import RefreshToken
+from .favorites import MAX_BULK
+from .authentication import issue_tokens
+from .images import available_derivatives
+
+
+class ImageSrcsetField(serializers.Field):
+    # {'thumbnail': {'webp': url, 'jpeg': url}, 'card': {...}, 'full': {...}}
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        request = self.context.get('request')
+        srcset = {}
+        for size, formats in available_derivatives(value.storage, value.name).items():
+            srcset[size] = {}
+            for image_format, name in formats.items():
+                url = value.storage.url(name)
+                srcset[size][image_format] = request.build_absolute_uri(url) if request is not None else url
+        return srcset
 
 class UserProfileRegisterSerializer(serializers.ModelSerializer):
     class Meta:
@@ -30,17 +51,19 @@ class LoginSerializer(serializers.Serializer):
         raise serializers.ValidationError("Неверные учетные данные")
 
     def to_representation(self, instance):
-        refresh = RefreshToken.for_user(instance)
+        refresh, access = issue_tokens(instance)
         return {
             'user': {
                 'username': instance.username,
                 'email': instance.email,
             },
-            'access': str(refresh.access_token),
+            'access': str(access),
             'refresh': str(refresh),
         }
 
 class UserProfileSerializer(serializers.ModelSerializer):
+    avatar_srcset = ImageSrcsetField(source='avatar')
+
     class Meta:
         model = UserProfile
         fields = '__all__'
@@ -70,10 +93,15 @@ class FavoriteSerializer(serializers.ModelSerializer):
 
 class FavoriteMovieSerializer(serializers.ModelSerializer):
     class Meta:
-        model = Favorite
+        model = FavoriteMovie
         fields = ('__all__')
 
 
+class FavoriteMoviesUpdateSerializer(serializers.Serializer):
+    movies = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False,
+                                   max_length=MAX_BULK)
+
+
 class HistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = History
@@ -87,6 +115,22 @@ class ActorSerializer(serializers.ModelSerializer):
 
 
 
+class ActorSearchSerializer(serializers.ModelSerializer):
+    actor_image_srcset = ImageSrcsetField(source='actor_image')
+
+    class Meta:
+        model = Actor
+        fields = ['id', 'actor_name', 'actor_image', 'actor_image_srcset']
+
+
+class DirectorSearchSerializer(serializers.ModelSerializer):
+    director_image_srcset = ImageSrcsetField(source='director_image')
+
+    class Meta:
+        model = Director
+        fields = ['id', 'director_name', 'director_image', 'director_image_srcset']
+
+
 class GenreSerializer(serializers.ModelSerializer):
     class Meta:
         model = Genre
@@ -95,9 +139,11 @@ class GenreSerializer(serializers.ModelSerializer):
 
 
 class MomentsSerializer(serializers.ModelSerializer):
+    movie_moments_srcset = ImageSrcsetField(source='movie_moments')
+
     class Meta:
         model = Moments
-        fields = ['movie_moments']
+        fields = ['movie_moments', 'movie_moments_srcset']
 
 
 class MovieLanguagesSerializer(serializers.ModelSerializer):
@@ -113,17 +159,77 @@ class RatingSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'parent', 'stars', 'text', 'created_date']
 
 
-class MovieListSerializer(serializers.ModelSerializer):
+class RatingThreadSerializer(RatingSerializer):
+    replies = serializers.SerializerMethodField()
+
+    class Meta(RatingSerializer.Meta):
+        fields = RatingSerializer.Meta.fields + ['replies']
+
+    def get_replies(self, obj):
+        replies = self.context['replies'].get(obj.pk, [])
+        return RatingThreadSerializer(replies, many=True, context=self.context).data
+
+
+class FavoriteFlagMixin:
+    # is_favorite is only rendered for views that put the user's favorite ids in the context,
+    # so per-user data never ends up in cached entity pages that embed movie cards
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.context.get('favorite_ids') is None:
+            fields.pop('is_favorite', None)
+        return fields
+
+    def get_is_favorite(self, obj):
+        return obj.pk in self.context['favorite_ids']
+
+
+class SparseFieldsMixin:
+    # ?fields= / ?expand= of SparseFieldsetMixin views, applied to the objects the view returns
+    # and not to the ones nested in them
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.context.get('fields')
+        parent = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+        if requested is None or parent is not None:
+            return fields
+        expand = self.context.get('expand') or set()
+        kept = {}
+        for name, field in fields.items():
+            nested = isinstance(field, serializers.BaseSerializer)
+            if nested and name in expand:
+                kept[name] = field
+            elif name in requested:
+                kept[name] = self.collapse(field) if nested else field
+        return kept
+
+    def collapse(self, field):
+        kwargs = {'source': field.source} if field.source else {}
+        return serializers.PrimaryKeyRelatedField(many=isinstance(field, serializers.ListSerializer),
+                                                  read_only=True, **kwargs)
+
+
+class MovieListSerializer(SparseFieldsMixin, FavoriteFlagMixin, serializers.ModelSerializer):
     year = DateField(format='%Y')
     country = CountrySerializer(many=True )
     genre = GenreSerializer(many=True)
+    movie_image_srcset = ImageSrcsetField(source='movie_image')
+    is_favorite = serializers.SerializerMethodField()
 
 
     class Meta:
         model = Movie
-        fields = ['id','movie_image','movie_name', 'year', 'country', 'genre','status_movie']
+        fields = ['id','movie_image','movie_image_srcset','movie_name', 'year', 'country', 'genre','status_movie',
+                  'is_favorite']
+
+class LeaderboardEntrySerializer(serializers.ModelSerializer):
+    movie = MovieListSerializer()
+
+    class Meta:
+        model = LeaderboardEntry
+        fields = ['rank', 'score', 'movie']
 
-class MovieDetailSerializer(serializers.ModelSerializer):
+
+class MovieDetailSerializer(SparseFieldsMixin, FavoriteFlagMixin, serializers.ModelSerializer):
     country = CountrySerializer(many=True)
     director = DirectorSerializer(many=True)
     actor = ActorSerializer(many=True)
@@ -131,42 +237,68 @@ class MovieDetailSerializer(serializers.ModelSerializer):
     year = serializers.DateField(format='%d-%m-%Y')
     movie_frames = MomentsSerializer(many=True, read_only=True)
     movie_videos = MovieLanguagesSerializer(many=True, read_only=True)
-    movie_ratings = RatingSerializer(many=True, read_only=True)
+    movie_ratings = RatingSerializer(many=True, read_only=True, source='latest_ratings')
+    movie_ratings_url = serializers.HyperlinkedIdentityField(view_name='movie_ratings')
+    movie_image_srcset = ImageSrcsetField(source='movie_image')
     get_avg_rating = serializers.SerializerMethodField()
     get_count_people = serializers.SerializerMethodField()
+    is_favorite = serializers.SerializerMethodField()
     class Meta:
         model = Movie
         fields = ['movie_name','year', 'country', 'director', 'actor', 'genre', 'types',
-                  'movie_time', 'movie_trailer', 'description', 'movie_image', 'status_movie','movie_frames', 'movie_videos','get_avg_rating','get_count_people','movie_ratings']
+                  'movie_time', 'movie_trailer', 'description', 'movie_image', 'movie_image_srcset', 'status_movie','movie_frames', 'movie_videos','get_avg_rating','get_count_people','rating_histogram','movie_ratings','movie_ratings_url',
+                  'is_favorite']
     def get_avg_rating(self, obj):
         return obj.get_avg_rating()
 
     def get_count_people(self,obj):
         return obj.get_count_people()
 
-class CountryDetailSerializer(serializers.ModelSerializer):
-    country_movies = MovieListSerializer(many=True, read_only=True)
+class CountryDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    country_movies = MovieListSerializer(many=True, read_only=True, source='preview_movies')
+    country_movies_count = serializers.IntegerField(read_only=True, source='movies_count')
+    country_movies_url = serializers.HyperlinkedIdentityField(view_name='country_movies')
     class Meta:
         model = Country
-        fields = ['country_name', 'country_movies']
+        fields = ['country_name', 'country_movies', 'country_movies_count', 'country_movies_url']
 
-class DirectorDetailSerializer(serializers.ModelSerializer):
+class DirectorDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     age = DateField(format='%d-%m-%Y')
-    director_movies = MovieListSerializer(many=True, read_only=True)
+    director_movies = MovieListSerializer(many=True, read_only=True, source='preview_movies')
+    director_movies_count = serializers.IntegerField(read_only=True, source='movies_count')
+    director_movies_url = serializers.HyperlinkedIdentityField(view_name='director_movies')
+    director_image_srcset = ImageSrcsetField(source='director_image')
     class Meta:
         model = Director
-        fields = ['director_name','director_image', 'bio', 'age', 'director_movies']
+        fields = ['director_name','director_image', 'director_image_srcset', 'bio', 'age', 'director_movies',
+                  'director_movies_count', 'director_movies_url']
 
 
-class ActorDetailSerializer(serializers.ModelSerializer):
-    actor_movies = MovieListSerializer(many=True, read_only=True)
+class ActorDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    actor_movies = MovieListSerializer(many=True, read_only=True, source='preview_movies')
+    actor_movies_count = serializers.IntegerField(read_only=True, source='movies_count')
+    actor_movies_url = serializers.HyperlinkedIdentityField(view_name='actor_movies')
+    actor_image_srcset = ImageSrcsetField(source='actor_image')
     class Meta:
         model = Actor
-        fields = ['actor_name','actor_image','age','bio','actor_movies']
+        fields = ['actor_name','actor_image','actor_image_srcset','age','bio','actor_movies', 'actor_movies_count', 'actor_movies_url']
 
 
-class GenreDetailSerializer(serializers.ModelSerializer):
-    genre_movies = MovieListSerializer(many=True, read_only=True)
+class GenreDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    genre_movies = MovieListSerializer(many=True, read_only=True, source='preview_movies')
+    genre_movies_count = serializers.IntegerField(read_only=True, source='movies_count')
+    genre_movies_url = serializers.HyperlinkedIdentityField(view_name='genre_movies')
     class Meta:
         model = Genre
-        fields = ['id','genre_name', 'genre_movies' ]
+        fields = ['id','genre_name', 'genre_movies', 'genre_movies_count', 'genre_movies_url']
+
+
+class ViewingEventSerializer(serializers.Serializer):
+    # playback position in seconds
+    position = serializers.IntegerField(min_value=0)
+
+
+class WatchedMovieSerializer(serializers.Serializer):
+    movie = MovieListSerializer(read_only=True)
+    position = serializers.IntegerField(read_only=True)
+    viewed_at = serializers.DateTimeField(read_only=True)
@@ -0,0 +1,214 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from . import search
+from . import cache
+from . import images
+from . import similar
+from . import favorites
+from . import leaderboards
+from .facets import FACETS_SCOPE
+from .authentication import sessions
+from .models import (
+    Country, Genre, Movie, Actor, Director, Moments, MovieLanguages, Rating, UserProfile, Favorite, FavoriteMovie
+)
+
+IMAGE_FIELDS = {
+    Movie: 'movie_image',
+    Actor: 'actor_image',
+    Director: 'director_image',
+    Moments: 'movie_moments',
+    UserProfile: 'avatar',
+}
+
+MOVIE_LISTED_FIELDS = {'movie_image', 'movie_name', 'movie_name_en', 'movie_name_ru', 'year', 'status_movie'}
+# fields facet counts group by or ?search= matches on
+MOVIE_FACETED_FIELDS = {'year', 'status_movie', 'movie_name', 'movie_name_en', 'movie_name_ru',
+                        'description', 'description_en', 'description_ru'}
+
+
+def touches(update_fields, fields):
+    return not update_fields or bool(fields & set(update_fields))
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_save, sender=Actor)
+@receiver(post_save, sender=Director)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    kind = search.KIND_BY_MODEL[sender]
+    if update_fields and not search.indexed_fields(kind) & set(update_fields):
+        return
+    search.index_instances(kind, [instance])
+
+
+@receiver(post_delete, sender=Movie)
+@receiver(post_delete, sender=Actor)
+@receiver(post_delete, sender=Director)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_instances(search.KIND_BY_MODEL[sender], [instance.pk])
+
+
+def build_image_derivatives(sender, instance, update_fields=None, **kwargs):
+    field = IMAGE_FIELDS[sender]
+    if touches(update_fields, {field}):
+        images.schedule_derivatives(getattr(instance, field))
+
+
+for model in IMAGE_FIELDS:
+    post_save.connect(build_image_derivatives, sender=model, dispatch_uid=f'{model.__name__}_image_derivatives')
+
+
+@receiver(post_save, sender=Country)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Actor)
+@receiver(post_save, sender=Director)
+@receiver(post_delete, sender=Country)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Actor)
+@receiver(post_delete, sender=Director)
+def invalidate_entity_cache(sender, instance, **kwargs):
+    scope = sender._meta.model_name
+    scopes = [scope, f'{scope}:{instance.pk}']
+    if kwargs.get('signal') is post_delete:
+        # the links went with it, without m2m_changed
+        scopes.append(FACETS_SCOPE)
+    if sender in (Country, Genre) and kwargs.get('signal') is post_save:
+        # movie cards on other entity pages show country and genre names
+        movie_ids = getattr(instance, f'{scope}_movies').values_list('pk', flat=True)
+        scopes.extend(cache.movie_scopes(movie_ids))
+    cache.bump(*scopes)
+
+
+@receiver(pre_delete, sender=Country)
+@receiver(pre_delete, sender=Genre)
+@receiver(pre_delete, sender=Movie)
+def collect_cache_scopes(sender, instance, **kwargs):
+    if sender is Movie:
+        instance._cache_scopes = cache.movie_scopes([instance.pk])
+    else:
+        movie_ids = getattr(instance, f'{sender._meta.model_name}_movies').values_list('pk', flat=True)
+        instance._cache_scopes = cache.movie_scopes(movie_ids)
+
+
+@receiver(post_delete, sender=Country)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Movie)
+def invalidate_collected_cache_scopes(sender, instance, **kwargs):
+    scopes = list(getattr(instance, '_cache_scopes', ()))
+    if sender is Movie:
+        scopes.append(FACETS_SCOPE)
+    cache.bump(*scopes)
+
+
+@receiver(post_save, sender=Movie)
+def invalidate_movie_cache(sender, instance, created, update_fields=None, **kwargs):
+    if not created and touches(update_fields, MOVIE_LISTED_FIELDS):
+        cache.bump(*cache.movie_scopes([instance.pk]))
+    if created or touches(update_fields, MOVIE_FACETED_FIELDS):
+        cache.bump(FACETS_SCOPE)
+
+
+def invalidate_movie_relation_cache(sender, instance, action, reverse, model, pk_set, **kwargs):
+    # forward: instance is a Movie and pk_set holds entity ids; reverse: the other way round
+    if reverse:
+        scope, entity_ids, movie_ids = instance._meta.model_name, [instance.pk], pk_set
+    else:
+        scope, entity_ids, movie_ids = model._meta.model_name, pk_set, [instance.pk]
+    if action == 'pre_clear':
+        # clear() sends no pk_set, remember what is about to be unlinked
+        lookup = f'{scope}_id' if reverse else 'movie_id'
+        instance._cleared_links = list(
+            sender.objects.filter(**{lookup: instance.pk}).values_list('movie_id', f'{scope}_id')
+        )
+        return
+    if action == 'post_clear':
+        links = getattr(instance, '_cleared_links', [])
+        movie_ids = {movie_id for movie_id, entity_id in links}
+        entity_ids = {entity_id for movie_id, entity_id in links}
+    elif action not in ('post_add', 'post_remove'):
+        return
+    Movie.touch(movie_ids)
+    (type(instance) if reverse else model).touch(entity_ids)
+    scopes = [f'{scope}:{pk}' for pk in entity_ids]
+    scopes.append(FACETS_SCOPE)
+    if scope in ('country', 'genre'):
+        # movie cards on other entity pages list the movie's countries and genres
+        scopes.extend(cache.movie_scopes(movie_ids))
+    cache.bump(*scopes)
+    # the edited movies get fresh neighbours in the background, the lists they appear in at the next build
+    similar.schedule_refresh(movie_ids)
+
+
+for field in cache.ENTITY_FIELDS:
+    m2m_changed.connect(invalidate_movie_relation_cache, sender=getattr(Movie, field).through,
+                        dispatch_uid=f'invalidate_movie_{field}_cache')
+
+
+@receiver(post_save, sender=Country)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Actor)
+@receiver(post_save, sender=Director)
+@receiver(pre_delete, sender=Country)
+@receiver(pre_delete, sender=Genre)
+@receiver(pre_delete, sender=Actor)
+@receiver(pre_delete, sender=Director)
+def touch_entity_movies(sender, instance, created=False, **kwargs):
+    # movie pages show the names of their countries, genres, actors and directors
+    if not created:
+        field = sender._meta.model_name
+        Movie.touch(getattr(Movie, field).through.objects.filter(**{f'{field}_id': instance.pk}).values('movie_id'))
+
+
+@receiver(post_save, sender=Moments)
+@receiver(post_save, sender=MovieLanguages)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Moments)
+@receiver(post_delete, sender=MovieLanguages)
+@receiver(post_delete, sender=Rating)
+def touch_parent_rows(sender, instance, **kwargs):
+    Movie.touch([instance.movie_id])
+    if sender is Rating and instance.root_id:
+        Rating.touch([instance.root_id])
+
+
+@receiver(post_delete, sender=Rating)
+def remove_from_aggregates(sender, instance, **kwargs):
+    # one per rating, so replies removed with their review and ratings of deleted users count too
+    Movie.apply_rating_change(removed=[(instance.movie_id, instance.stars)])
+
+
+@receiver(post_delete, sender=Rating)
+def remove_from_trends(sender, instance, **kwargs):
+    if instance.parent_id is None:
+        leaderboards.remove_rating(instance)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def forget_user_sessions(sender, instance, **kwargs):
+    # status or is_active may have changed, other workers notice within the session cache ttl
+    sessions.forget_user(instance.pk)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def forget_logged_out_session(sender, instance, **kwargs):
+    sessions.forget_session(instance.token.jti)
+
+
+@receiver(post_save, sender=FavoriteMovie)
+@receiver(post_delete, sender=FavoriteMovie)
+def forget_favorite_ids(sender, instance, **kwargs):
+    if favorites.bulk_removal.get():
+        # favorites.remove() forgets the set once for all of its rows
+        return
+    try:
+        favorites.forget(instance.cart.user_id)
+    except Favorite.DoesNotExist:
+        # the whole cart is being deleted, see forget_cart_favorite_ids
+        pass
+
+
+@receiver(post_delete, sender=Favorite)
+def forget_cart_favorite_ids(sender, instance, **kwargs):
+    favorites.forget(instance.user_id)
@@ -0,0 +1,280 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from scipy import sparse
+
+from .models import Movie, Rating
+
+# Every movie is a sparse row of weighted, idf-scaled indicator columns: its countries,
+# genres, actors and directors, and the users who rated it LIKED_STARS or more (rating
+# co-occurrence). Rows are L2-normalised, so neighbours are ranked by cosine similarity.
+FEATURES = {
+    # kind: (code, weight)
+    'country': (1, 0.5),
+    'genre': (2, 1.0),
+    'actor': (3, 1.0),
+    'director': (4, 1.5),
+    'rating': (5, 0.75),
+}
+LIKED_STARS = 7
+# column key = code * KEY_BASE + entity id, sorted keys map an entity to its column
+KEY_BASE = 10 ** 12
+CURRENT = 'current'
+OVERRIDE_PREFIX = 'similar:override:'
+MAX_REFRESH = 100
+INDEX_FILES = ('ids', 'neighbours', 'scores', 'keys', 'weights', 'data', 'indices', 'indptr')
+
+logger = logging.getLogger(__name__)
+
+
+def get_directory():
+    return str(settings.SIMILAR_MOVIES_DIR)
+
+
+def collect_pairs():
+    """{kind: (movie ids, entity ids)} read straight from the through tables and ratings."""
+    pairs = {}
+    for kind in ('country', 'genre', 'actor', 'director'):
+        through = getattr(Movie, kind).through
+        rows = np.array(list(through.objects.values_list('movie_id', f'{kind}_id').iterator(chunk_size=10000)),
+                        dtype=np.int64).reshape(-1, 2)
+        pairs[kind] = (rows[:, 0], rows[:, 1])
+    rows = np.array(list(Rating.objects.filter(stars__gte=LIKED_STARS).values_list('movie_id', 'user_id')
+                         .distinct().iterator(chunk_size=10000)), dtype=np.int64).reshape(-1, 2)
+    pairs['rating'] = (rows[:, 0], rows[:, 1])
+    return pairs
+
+
+def build_matrix(movie_ids, pairs):
+    """(normalised csr matrix with a row per movie id, sorted column keys, column weights)"""
+    movie_ids = np.asarray(movie_ids, dtype=np.int64)
+    all_keys, all_rows = [], []
+    for kind, (movies, entities) in pairs.items():
+        code, weight = FEATURES[kind]
+        known = np.isin(movies, movie_ids)
+        all_rows.append(np.searchsorted(movie_ids, movies[known]))
+        all_keys.append(code * KEY_BASE + entities[known])
+    rows, keys = np.concatenate(all_rows), np.concatenate(all_keys)
+    columns, cols = np.unique(keys, return_inverse=True)
+
+    # idf: a genre shared by half the catalogue says less than a director
+    frequency = np.bincount(cols, minlength=len(columns))
+    weights = np.log((1 + len(movie_ids)) / (1 + frequency)) + 1
+    for kind, (code, weight) in FEATURES.items():
+        weights[(columns // KEY_BASE) == code] *= weight
+    weights = weights.astype(np.float32)
+
+    matrix = sparse.csr_matrix((weights[cols], (rows, cols)), shape=(len(movie_ids), len(columns)),
+                               dtype=np.float32)
+    matrix.sum_duplicates()
+    return normalise(matrix), columns, weights
+
+
+def normalise(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms).dot(matrix), dtype=np.float32)
+
+
+def top_k(row_scores, row_ids, k, exclude):
+    # row_scores / row_ids are the non-zero similarities of one movie
+    keep = row_ids != exclude
+    row_scores, row_ids = row_scores[keep], row_ids[keep]
+    if len(row_scores) > k:
+        best = np.argpartition(-row_scores, k - 1)[:k]
+        row_scores, row_ids = row_scores[best], row_ids[best]
+    order = np.lexsort((row_ids, -row_scores))
+    return row_ids[order], row_scores[order]
+
+
+def nearest_neighbours(movie_ids, matrix, k, block_size=256):
+    """
+    Top-k (movie id, score) per row, -1 / 0 padded. Shared genres and countries make the
+    products nearly dense, so each block of rows is scored into a dense block_size x movies array.
+    """
+    movie_ids = np.asarray(movie_ids, dtype=np.int64)
+    k = min(k, len(movie_ids) - 1) if len(movie_ids) > 1 else 0
+    neighbours = np.full((len(movie_ids), k), -1, dtype=np.int64)
+    scores = np.zeros((len(movie_ids), k), dtype=np.float32)
+    if not k:
+        return neighbours, scores
+    transposed = matrix.T.tocsc()
+    for start in range(0, len(movie_ids), block_size):
+        block = (matrix[start:start + block_size] @ transposed).toarray()
+        rows = np.arange(block.shape[0])
+        block[rows, rows + start] = -1
+        best = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(block, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best, best_scores = np.take_along_axis(best, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+        found = best_scores > 0
+        neighbours[start:start + block_size] = np.where(found, movie_ids[best], -1)
+        scores[start:start + block_size] = np.where(found, best_scores, 0)
+    return neighbours, scores
+
+
+def write_index(directory, arrays):
+    """Write a new build next to the old ones and switch the 'current' symlink to it atomically."""
+    os.makedirs(directory, exist_ok=True)
+    name = f'build-{time.strftime("%Y%m%d%H%M%S")}-{os.getpid()}'
+    build = os.path.join(directory, name)
+    os.makedirs(build)
+    for key in INDEX_FILES:
+        np.save(os.path.join(build, f'{key}.npy'), arrays[key])
+    link = os.path.join(directory, f'{CURRENT}.{os.getpid()}.tmp')
+    os.symlink(name, link)
+    os.replace(link, os.path.join(directory, CURRENT))
+    # keep the previous build, a worker may still have it mapped
+    builds = sorted(entry for entry in os.listdir(directory) if entry.startswith('build-'))
+    for old in builds[:-2]:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    return build
+
+
+def build(k=None, block_size=256, directory=None):
+    k = k or settings.SIMILAR_MOVIES_K
+    movie_ids = np.array(sorted(Movie.objects.values_list('pk', flat=True)), dtype=np.int64)
+    matrix, keys, weights = build_matrix(movie_ids, collect_pairs())
+    neighbours, scores = nearest_neighbours(movie_ids, matrix, k, block_size)
+    return write_index(directory or get_directory(), {
+        'ids': movie_ids, 'neighbours': neighbours, 'scores': scores, 'keys': keys, 'weights': weights,
+        'data': matrix.data, 'indices': matrix.indices, 'indptr': matrix.indptr,
+    })
+
+
+class SimilarIndex:
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        arrays = {key: np.load(os.path.join(path, f'{key}.npy'), mmap_mode='r') for key in INDEX_FILES}
+        self.ids, self.neighbours, self.scores = arrays['ids'], arrays['neighbours'], arrays['scores']
+        self.keys, self.weights = arrays['keys'], arrays['weights']
+        self.arrays = arrays
+        self._matrix = None
+
+    @property
+    def matrix(self):
+        # only incremental refreshes need the feature matrix
+        if self._matrix is None:
+            self._matrix = sparse.csr_matrix(
+                (self.arrays['data'], self.arrays['indices'], self.arrays['indptr']),
+                shape=(len(self.ids), len(self.keys)),
+            )
+        return self._matrix
+
+    def lookup(self, movie_id, limit):
+        override = cache.get(f'{OVERRIDE_PREFIX}{self.name}:{movie_id}')
+        if override is not None:
+            return override[:limit]
+        row = np.searchsorted(self.ids, movie_id)
+        if row >= len(self.ids) or self.ids[row] != movie_id:
+            return []
+        ids, scores = self.neighbours[row, :limit], self.scores[row, :limit]
+        return [(int(i), float(s)) for i, s in zip(ids, scores) if i >= 0]
+
+    def vectorize(self, features):
+        keys = np.array([FEATURES[kind][0] * KEY_BASE + entity_id
+                         for kind, entity_ids in features.items() for entity_id in entity_ids], dtype=np.int64)
+        columns = np.searchsorted(self.keys, keys)
+        known = columns < len(self.keys)
+        columns = columns[known][self.keys[columns[known]] == keys[known]]
+        vector = sparse.csr_matrix((self.weights[columns], (np.zeros(len(columns), dtype=np.int64), columns)),
+                                   shape=(1, len(self.keys)), dtype=np.float32)
+        return normalise(vector)
+
+    def score(self, movie_id, features, k):
+        similarities = (self.matrix @ self.vectorize(features).T).tocoo()
+        ids, scores = top_k(similarities.data, self.ids[similarities.row], k, movie_id)
+        return [(int(i), float(s)) for i, s in zip(ids, scores)]
+
+    def refresh(self, movie_id, k):
+        """Recompute one movie's neighbours against the built matrix and keep them as an override."""
+        neighbours = self.score(movie_id, movie_features(movie_id), k)
+        cache.set(f'{OVERRIDE_PREFIX}{self.name}:{movie_id}', neighbours, None)
+        return neighbours
+
+
+def movie_features(movie_id):
+    features = {}
+    for kind in ('country', 'genre', 'actor', 'director'):
+        through = getattr(Movie, kind).through
+        features[kind] = list(through.objects.filter(movie_id=movie_id).values_list(f'{kind}_id', flat=True))
+    features['rating'] = list(Rating.objects.filter(movie_id=movie_id, stars__gte=LIKED_STARS)
+                              .values_list('user_id', flat=True).distinct())
+    return features
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """The current build, memory-mapped once per process and swapped when a new build lands."""
+    global _index
+    try:
+        path = os.path.realpath(os.path.join(get_directory(), CURRENT), strict=True)
+    except OSError:
+        return None
+    if _index is None or _index.path != path:
+        with _index_lock:
+            if _index is None or _index.path != path:
+                _index = SimilarIndex(path)
+    return _index
+
+
+def similar_movies(movie_id, limit):
+    index = get_index()
+    return index.lookup(movie_id, limit) if index is not None else []
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.SIMILAR_REFRESH_WORKERS,
+                                               thread_name_prefix='similar-refresh')
+    return _executor
+
+
+def refresh_movies(movie_ids):
+    index = get_index()
+    if index is None:
+        return
+    for movie_id in movie_ids:
+        index.refresh(movie_id, settings.SIMILAR_MOVIES_K)
+
+
+def refresh_in_background(movie_ids):
+    try:
+        refresh_movies(movie_ids)
+    except Exception:
+        logger.exception('Refreshing the neighbours of %d movies failed', len(movie_ids))
+    finally:
+        close_old_connections()
+
+
+def schedule_refresh(movie_ids):
+    movie_ids = list(movie_ids)
+    if not movie_ids or get_index() is None:
+        return
+    if len(movie_ids) > MAX_REFRESH:
+        logger.warning('Refreshing the neighbours of %d of %d edited movies, the rest wait for the next build',
+                       MAX_REFRESH, len(movie_ids))
+        movie_ids = movie_ids[:MAX_REFRESH]
+    if settings.SIMILAR_REFRESH_WORKERS:
+        transaction.on_commit(lambda: get_executor().submit(refresh_in_background, movie_ids))
+    else:
+        transaction.on_commit(lambda: refresh_movies(movie_ids))
@@ -0,0 +1,113 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """Return (start, end) inclusive for a single byte range, None to send the whole file."""
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        # multipart ranges and malformed headers fall back to a full response
+        return None
+    start, end = match.groups()
+    if start == '':
+        length = int(end)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(size - length, 0), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        # invalid rather than unsatisfiable, RFC 9110 says to ignore the header
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    return start, min(int(end), size - 1) if end else size - 1
+
+
+def is_asgi(request):
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+async def async_chunks(chunks):
+    # one chunk per thread hop, on the request's thread so cursors keep their connection
+    chunks = iter(chunks)
+    read = sync_to_async(next)
+    try:
+        while (chunk := await read(chunks, None)) is not None:
+            yield chunk
+    finally:
+        if hasattr(chunks, 'close'):
+            await sync_to_async(chunks.close)()
+
+
+def streaming_content(request, chunks):
+    """
+    The ASGI handler reads a sync iterator to the end into a list before sending any of it,
+    so under ASGI the chunks are handed over one at a time from an async iterator instead.
+    """
+    return async_chunks(chunks) if is_asgi(request) else chunks
+
+
+def file_range(path, start, length):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def stream_file(request, field_file):
+    path = field_file.path
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = http_date(stat.st_mtime)
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    accel_url = getattr(settings, 'MEDIA_ACCEL_REDIRECT_URL', None)
+    if accel_url:
+        # nginx serves the bytes (and the Range/If-Range handling) from its internal location
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = accel_url + quote(field_file.name)
+        return response
+
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range not in (etag, last_modified):
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, stat.st_size)
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    if byte_range is None and not is_asgi(request):
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range or (0, stat.st_size - 1)
+        response = StreamingHttpResponse(streaming_content(request, file_range(path, start, end - start + 1)),
+                                         status=200 if byte_range is None else 206, content_type=content_type)
+        if byte_range is not None:
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    return response
@@ -1,3 +1,1407 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import os
+import subprocess
+import sys
+import time
+import tempfile
+import json
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import brotli
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.http import HttpResponse
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone, translation
+from django.utils.http import http_date
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, force_authenticate
+from prometheus_client import REGISTRY
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .async_views import (
+    AsyncAPIView, AsyncMovieListAPIView, AsyncMovieDetailAPIView, AsyncCountryDetailAPIView,
+    AsyncGenreDetailAPIView, AsyncDirectorDetailAPIView, AsyncActorDetailAPIView
+)
+from .authentication import issue_tokens, sessions
+from . import compression, favorites, fastlist, leaderboards, metrics, similar, viewing
+from .export import export_lines
+from .renderers import ORJSONRenderer
+from .routers import PIN_COOKIE, ReplicaPinningMiddleware, ReplicaRouter, primary_reads
+from .views import MovieListAPIView
+from .models import (
+    Country, Director, Actor, Genre, Movie,
+    MovieLanguages, Moments, Rating, UserProfile, ViewingEvent, ViewingSummary, LeaderboardEntry, MovieTrend,
+    FavoriteMovie
+)
+
+
+def seed_catalogue(movies=3, related=3, prefix=''):
+    countries = [Country.objects.create(country_name=f'{prefix}Country {i}') for i in range(related)]
+    genres = [Genre.objects.create(genre_name=f'{prefix}Genre {i}') for i in range(related)]
+    directors = [Director.objects.create(director_name=f'Director {i}', bio='bio', age=date(1970, 1, 1),
+                                         director_image='directors/d.jpg') for i in range(related)]
+    actors = [Actor.objects.create(actor_name=f'Actor {i}', bio='bio', age=date(1980, 1, 1),
+                                   actor_image='actors/a.jpg') for i in range(related)]
+    users = [UserProfile.objects.create_user(username=f'{prefix}user{i}', password='password', first_name=f'User {i}')
+             for i in range(related)]
+    for i in range(movies):
+        movie = Movie.objects.create(
+            movie_name=f'Movie {i}', year=date(2000 + i, 1, 1), types='720', movie_time=120,
+            description='description', movie_trailer='https://example.com/trailer',
+            movie_image='movies_images/m.jpg', status_movie='simple',
+        )
+        movie.country.set(countries)
+        movie.genre.set(genres)
+        movie.director.set(directors)
+        movie.actor.set(actors)
+        for user in users:
+            MovieLanguages.objects.create(movie=movie, language='en', video='movies_videos/v.mp4')
+            Moments.objects.create(movie=movie, movie_moments='moments/m.jpg')
+            Rating.objects.create(movie=movie, user=user, stars=7, text='text')
+    return countries[0]
+
+
+class CatalogueTestCase(TestCase):
+    def setUp(self):
+        translation.activate('en')
+        self.addCleanup(translation.deactivate)
+        cache.clear()
+        self.client = APIClient()
+
+
+class RatingAggregateTests(CatalogueTestCase):
+    fields = ('rating_sum', 'rating_count', 'rating_avg', 'rating_histogram')
+
+    def setUp(self):
+        super().setUp()
+        seed_catalogue(movies=2, related=2)
+        self.movie = Movie.objects.order_by('pk').first()
+        self.user = UserProfile.objects.create_user(username='critic', password='password', status='pro')
+        self.client.force_authenticate(self.user)
+
+    def aggregates(self):
+        return list(Movie.objects.order_by('pk').values_list(*self.fields))
+
+    def assertMatchesRebuild(self):
+        stored = self.aggregates()
+        call_command('rebuild_rating_aggregates', stdout=StringIO())
+        self.assertEqual(stored, self.aggregates())
+
+    def test_create_update_and_delete_keep_the_aggregates(self):
+        # the serializer takes neither movie nor user, ratings are created like the admin does
+        Rating.objects.create(movie=self.movie, user=self.user, stars=10, text='text')
+        self.movie.refresh_from_db()
+        self.assertEqual((self.movie.rating_count, self.movie.rating_histogram[9]), (3, 1))
+        self.assertMatchesRebuild()
+
+        rating = Rating.objects.get(user=self.user)
+        response = self.client.patch(reverse('rating-detail', args=[rating.pk]), {'stars': 3}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.movie.refresh_from_db()
+        self.assertEqual((self.movie.rating_histogram[9], self.movie.rating_histogram[2]), (0, 1))
+        self.assertMatchesRebuild()
+
+        # a review goes with its replies
+        reply = Rating.objects.create(movie=self.movie, user=self.user, parent=rating, stars=5, text='reply')
+        Rating.objects.create(movie=self.movie, user=self.user, parent=reply, stars=6, text='reply')
+        self.assertEqual(self.client.delete(reverse('rating-detail', args=[rating.pk])).status_code, 204)
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.rating_count, 2)
+        self.assertMatchesRebuild()
+
+    def test_locked_movies_are_saved_without_reading_them_back(self):
+        # savepoint, SELECT ... FOR UPDATE, UPDATE, release
+        with self.assertNumQueries(4):
+            Movie.apply_rating_change(added=[(self.movie.pk, 5)], removed=[(self.movie.pk, 7)])
+        self.movie.refresh_from_db()
+        self.assertEqual((self.movie.rating_histogram[4], self.movie.rating_histogram[6]), (1, 1))
+
+    def test_cascades_keep_the_aggregates(self):
+        Rating.objects.create(movie=self.movie, user=self.user, stars=10, text='text')
+        # the user's ratings and the replies to them go in the cascade
+        Rating.objects.create(movie=self.movie, user=UserProfile.objects.first(), stars=4, text='reply',
+                              parent=Rating.objects.get(user=self.user))
+        self.user.delete()
+        self.assertEqual(Movie.objects.get(pk=self.movie.pk).rating_count, 2)
+        self.assertMatchesRebuild()
+        Movie.objects.filter(pk=self.movie.pk).delete()
+        self.assertEqual(Movie.objects.get().rating_count, 2)
+        self.assertMatchesRebuild()
+
+
+class QueryBudgetTests(CatalogueTestCase):
+    # Budgets are per request and must not depend on how many rows are on the page or linked to them.
+    budgets = {
+        'movie_list': 3,
+        'movie_detail': 8,
+        'country_detail': 4,
+        'genre_detail': 4,
+        'director_detail': 4,
+        'actor_detail': 4,
+        'country_list': 1,
+        'genre_list': 1,
+        'director_list': 1,
+        'actor_list': 1,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalogue()
+        cls.user = UserProfile.objects.create_user(username='pro', password='password', status='pro')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        # the favorite ids are cached per user, only a user's first request loads them
+        favorites.favorite_ids(self.user)
+        # so are the country and genre names of movie lists, until one of them changes
+        fastlist.name_maps()
+
+    def url(self, name):
+        if name.endswith('_detail'):
+            model = {'movie': Movie, 'country': Country, 'genre': Genre,
+                     'director': Director, 'actor': Actor}[name[:-len('_detail')]]
+            return reverse(name, args=[model.objects.order_by('pk').first().pk])
+        if name == 'movie_list':
+            # the keyset pages, page numbers add a COUNT(*)
+            return reverse(name) + '?page_size=20'
+        return reverse(name)
+
+    def assertBudget(self, name):
+        url = self.url(name)
+        with self.assertNumQueries(self.budgets[name]):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_budgets(self):
+        for name in self.budgets:
+            with self.subTest(endpoint=name):
+                self.assertBudget(name)
+
+    def test_budgets_do_not_grow_with_related_rows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            seed_catalogue(movies=5, related=5, prefix='more ')
+        fastlist.name_maps()
+        for name in self.budgets:
+            with self.subTest(endpoint=name):
+                self.assertBudget(name)
+
+
+class MovieCursorPaginationTests(CatalogueTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalogue(movies=7, related=1)
+        # two movies sharing a year exercise the id tie-break
+        Movie.objects.filter(movie_name='Movie 4').update(year=date(2003, 1, 1))
+
+    def walk(self, url, link):
+        names = []
+        while url:
+            data = self.client.get(url).json()
+            names.append([movie['movie_name'] for movie in data['results']])
+            url = data[link]
+        return names
+
+    def test_forward_and_backward_pages_are_stable(self):
+        expected = list(Movie.objects.order_by('year', 'pk').values_list('movie_name', flat=True))
+        pages = self.walk(reverse('movie_list') + '?ordering=year&page_size=3', 'next')
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+
+        last_page = self.client.get(reverse('movie_list') + '?ordering=year&page_size=3').json()['next']
+        last_page = self.client.get(last_page).json()['next']
+        pages = self.walk(last_page, 'previous')
+        self.assertEqual(sum(reversed(pages), []), expected)
+
+    def test_count_is_opt_in_and_page_size_is_capped(self):
+        data = self.client.get(reverse('movie_list') + '?page_size=20').json()
+        self.assertNotIn('count', data)
+        data = self.client.get(reverse('movie_list') + '?count=1&page_size=1000').json()
+        self.assertEqual(data['count'], 7)
+        self.assertEqual(len(data['results']), 7)
+
+    def test_page_numbers_stay_the_default(self):
+        for url in (reverse('movie_list'), reverse('movie_list') + '?page=2'):
+            data = self.client.get(url).json()
+            self.assertEqual(data['count'], 7)
+            self.assertEqual(len(data['results']), 1)
+        self.assertIn('cursor=', self.client.get(reverse('movie_list') + '?page_size=1').json()['next'])
+
+
+class FullTextSearchTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        seed_catalogue(movies=2, related=1)
+        self.movie = Movie.objects.get(movie_name='Movie 1')
+        self.movie.movie_name_ru = 'Форсаж'
+        self.movie.save()
+
+    def test_list_matches_every_translation(self):
+        for query in ('форс', 'movie 1'):
+            with self.subTest(query=query):
+                data = self.client.get(reverse('movie_list') + f'?search={query}').json()
+                self.assertEqual([movie['id'] for movie in data['results']], [self.movie.pk])
+
+    def test_ranked_search_covers_people_and_follows_deletes(self):
+        data = self.client.get(reverse('search') + '?q=actor').json()
+        self.assertEqual([actor['actor_name'] for actor in data['actors']], ['Actor 0'])
+        Actor.objects.all().delete()
+        self.assertEqual(self.client.get(reverse('search') + '?q=actor').json()['actors'], [])
+
+
+class CatalogueCacheTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.country = seed_catalogue(movies=2, related=2)
+        self.genre = Genre.objects.order_by('pk').first()
+
+    def test_repeated_requests_skip_the_database(self):
+        url = reverse('country_detail', args=[self.country.pk])
+        first = self.client.get(url).json()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json(), first)
+
+    def test_cache_is_per_language(self):
+        self.country.country_name_ru = 'Страна'
+        self.country.save()
+        self.client.get(reverse('country_list'))
+        with translation.override('ru'):
+            names = [country['country_name'] for country in self.client.get(reverse('country_list')).json()]
+        self.assertIn('Страна', names)
+
+    def test_related_changes_invalidate_entity_pages(self):
+        url = reverse('genre_detail', args=[self.genre.pk])
+        self.client.get(url)
+        # generations are replaced once the write commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.country.country_name = 'Renamed'
+            self.country.save()
+            self.assertIn('Country 0', [country['country_name'] for country in
+                                        self.client.get(url).json()['genre_movies'][0]['country']])
+        movies = self.client.get(url).json()['genre_movies']
+        self.assertIn('Renamed', [country['country_name'] for country in movies[0]['country']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            movie = Movie.objects.create(
+                movie_name='New', year=date(2020, 1, 1), types='720', movie_time=90, description='d',
+                movie_trailer='https://example.com', movie_image='movies_images/n.jpg', status_movie='simple',
+            )
+            movie.genre.add(self.genre)
+        self.assertIn('New', [movie['movie_name'] for movie in self.client.get(url).json()['genre_movies']])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.genre.genre_movies.remove(movie)
+        self.assertNotIn('New', [movie['movie_name'] for movie in self.client.get(url).json()['genre_movies']])
+        with self.captureOnCommitCallbacks(execute=True):
+            movie.genre.add(self.genre)
+            movie.genre.clear()
+        self.assertNotIn('New', [movie['movie_name'] for movie in self.client.get(url).json()['genre_movies']])
+
+
+class FilmographyTests(CatalogueTestCase):
+    def test_detail_embeds_a_bounded_preview_and_links_the_full_list(self):
+        from .views import FILMOGRAPHY_PREVIEW_SIZE
+        seed_catalogue(movies=FILMOGRAPHY_PREVIEW_SIZE + 2, related=1)
+        genre = Genre.objects.get()
+        data = self.client.get(reverse('genre_detail', args=[genre.pk])).json()
+        self.assertEqual(len(data['genre_movies']), FILMOGRAPHY_PREVIEW_SIZE)
+        self.assertEqual(data['genre_movies_count'], FILMOGRAPHY_PREVIEW_SIZE + 2)
+
+        page = self.client.get(data['genre_movies_url'] + '?page_size=100&ordering=-year').json()
+        self.assertEqual(len(page['results']), FILMOGRAPHY_PREVIEW_SIZE + 2)
+        self.assertEqual(page['results'][:FILMOGRAPHY_PREVIEW_SIZE], data['genre_movies'])
+        self.assertEqual(self.client.get(data['genre_movies_url'] + '?year__gt=2100-01-01').json()['results'], [])
+
+
+class RatingThreadTests(CatalogueTestCase):
+    def test_threads_load_in_constant_queries(self):
+        seed_catalogue(movies=1, related=3)
+        movie = Movie.objects.get()
+        user = UserProfile.objects.first()
+        for review in list(Rating.objects.filter(movie=movie)):
+            reply = Rating.objects.create(movie=movie, user=user, parent=review, stars=5, text='reply')
+            Rating.objects.create(movie=movie, user=user, parent=reply, stars=5, text='reply to reply')
+
+        url = reverse('movie_ratings', args=[movie.pk])
+        with self.assertNumQueries(3):
+            data = self.client.get(url + '?page_size=2').json()
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(len(data['results']), 2)
+        for review in data['results']:
+            [reply] = review['replies']
+            self.assertEqual(reply['parent'], review['id'])
+            self.assertEqual(reply['replies'][0]['parent'], reply['id'])
+            self.assertEqual(reply['replies'][0]['replies'], [])
+
+    def test_moving_a_reply_takes_its_replies_along(self):
+        seed_catalogue(movies=1, related=2)
+        movie = Movie.objects.get()
+        user = UserProfile.objects.first()
+        first, second = Rating.objects.filter(movie=movie).order_by('pk')
+        reply = Rating.objects.create(movie=movie, user=user, parent=first, stars=5, text='reply')
+        nested = Rating.objects.create(movie=movie, user=user, parent=reply, stars=5, text='reply to reply')
+
+        reply.parent = second
+        reply.save()
+        nested.refresh_from_db()
+        self.assertEqual(nested.root_id, second.pk)
+        data = self.client.get(reverse('movie_ratings', args=[movie.pk])).json()
+        threads = {review['id']: review['replies'] for review in data['results']}
+        self.assertEqual(threads[first.pk], [])
+        self.assertEqual(threads[second.pk][0]['replies'][0]['id'], nested.pk)
+
+        reply.parent = None
+        reply.save()
+        nested.refresh_from_db()
+        self.assertEqual(nested.root_id, reply.pk)
+
+
+class VideoStreamTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        os.makedirs(os.path.join(media_root.name, 'movies_videos'))
+        with open(os.path.join(media_root.name, 'movies_videos', 'v.mp4'), 'wb') as file:
+            file.write(bytes(range(256)) * 4)
+        seed_catalogue(movies=1, related=1)
+        self.video = MovieLanguages.objects.get()
+        self.url = reverse('movie_video_stream', args=[self.video.movie_id, self.video.pk])
+        self.client.force_authenticate(UserProfile.objects.create_user(username='pro', status='pro'))
+
+    def test_partial_content(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-4', HTTP_IF_RANGE=response['ETag'])
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(252, 256)))
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=2000-').status_code, 416)
+
+    def test_stale_if_range_sends_the_whole_file(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content)), 1024)
+
+    def test_pro_movies_need_a_pro_account(self):
+        Movie.objects.update(status_movie='pro')
+        self.client.force_authenticate(UserProfile.objects.create_user(username='simple'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_asgi_streams_from_an_async_iterator(self):
+        # a sync iterator would be read into memory whole by the ASGI handler
+        token = str(issue_tokens(UserProfile.objects.get(username='pro'))[1])
+
+        async def fetch(**headers):
+            response = await AsyncClient().get(self.url, headers={'Authorization': f'Bearer {token}', **headers})
+            self.assertTrue(response.is_async)
+            return response, b''.join([chunk async for chunk in response.streaming_content])
+
+        response, content = async_to_sync(fetch)()
+        self.assertEqual((response.status_code, response['Content-Length'], content),
+                         (200, '1024', bytes(range(256)) * 4))
+        response, content = async_to_sync(fetch)(Range='bytes=10-19')
+        self.assertEqual((response.status_code, response['Content-Range'], content),
+                         (206, 'bytes 10-19/1024', bytes(range(10, 20))))
+
+    def test_invalid_and_empty_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=19-10')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content)), 1024)
+
+        open(self.video.video.path, 'wb').close()
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-4')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */0'))
+
+    @override_settings(MEDIA_ACCEL_REDIRECT_URL='/protected-media/')
+    def test_nginx_serves_the_bytes(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/movies_videos/v.mp4')
+
+
+class ImageDerivativeTests(CatalogueTestCase):
+    @override_settings(IMAGE_DERIVATIVE_WORKERS=0)
+    def test_upload_renders_derivatives_the_serializers_link_to(self):
+        from PIL import Image
+
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        os.makedirs(os.path.join(media_root.name, 'movies_images'))
+        Image.new('RGB', (1000, 1500), 'red').save(os.path.join(media_root.name, 'movies_images', 'm.jpg'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            seed_catalogue(movies=1, related=1)
+        movie = self.client.get(reverse('movie_list')).json()['results'][0]
+        card = movie['movie_image_srcset']['card']['webp']
+        self.assertTrue(card.endswith('/media/derivatives/movies_images/m.card.webp'))
+        with Image.open(os.path.join(media_root.name, 'derivatives', 'movies_images', 'm.card.webp')) as image:
+            self.assertEqual(image.size, (480, 720))
+
+    def test_srcset_links_the_original_until_the_derivatives_exist(self):
+        from concurrent.futures import Future
+
+        from PIL import Image
+
+        from . import images
+
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.addCleanup(images._rendered.clear)
+        images._rendered.clear()
+        with mock.patch.object(images, 'submit') as submit, self.captureOnCommitCallbacks(execute=True):
+            seed_catalogue(movies=1, related=1)
+        submit.assert_any_call(media_root.name, 'movies_images/m.jpg')
+        self.client.force_authenticate(UserProfile.objects.create_user(username='pro', status='pro'))
+
+        def srcset():
+            # the list is rendered from values rows, the detail through the serializer field
+            movie = self.client.get(reverse('movie_list')).json()['results'][0]
+            detail = self.client.get(reverse('movie_detail', args=[movie['id']])).json()
+            self.assertEqual(detail['movie_image_srcset'], movie['movie_image_srcset'])
+            return movie['movie_image'], {url for formats in movie['movie_image_srcset'].values()
+                                          for url in formats.values()}
+
+        from django.core.files.storage import FileSystemStorage
+
+        with mock.patch.object(FileSystemStorage, 'exists', autospec=True, return_value=False) as exists:
+            original, urls = srcset()
+            srcset()
+        self.assertEqual(urls, {original})
+        # one look per image, the second round is answered from the cached miss
+        self.assertEqual(sorted(call.args[1] for call in exists.call_args_list),
+                         ['derivatives/moments/m.full.jpg', 'derivatives/movies_images/m.full.jpg'])
+
+        os.makedirs(os.path.join(media_root.name, 'movies_images'))
+        Image.new('RGB', (100, 150), 'red').save(os.path.join(media_root.name, 'movies_images', 'm.jpg'))
+        images.render_derivatives(media_root.name, 'movies_images/m.jpg')
+        future = Future()
+        future.add_done_callback(images.rendered('movies_images/m.jpg'))
+        future.set_result([])
+        original, urls = srcset()
+        self.assertEqual(len(urls), 6)
+        self.assertNotIn(original, urls)
+
+        future = Future()
+        future.add_done_callback(images.rendered('movies_images/m.jpg'))
+        with self.assertLogs('movie_app.images', 'ERROR') as logs:
+            future.set_exception(OSError('cannot identify image file'))
+        self.assertIn('movies_images/m.jpg', logs.output[0])
+
+
+class BenchmarkCommandTests(CatalogueTestCase):
+    def test_seeded_catalogue_benchmarks_every_read_route(self):
+        call_command('seed_catalogue', movies=5, actors=10, directors=3, users=4, stdout=StringIO())
+        self.assertEqual(Movie.objects.count(), 5)
+        self.assertTrue(Rating.objects.filter(parent__isnull=False).exists())
+
+        out = StringIO()
+        call_command('benchmark_api', iterations=1, warmup=0, route=['movie_list', 'genre_detail', 'search'],
+                     stdout=out, stderr=StringIO())
+        routes = {route['name']: route for route in json.loads(out.getvalue())['routes']}
+        self.assertEqual(set(routes), {'movie_list', 'genre_detail', 'search'})
+        self.assertEqual(routes['movie_list']['status'], 200)
+        self.assertGreater(routes['movie_list']['bytes'], 0)
+
+
+class ImportCatalogueTests(CatalogueTestCase):
+    def import_file(self, name, content, **options):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        path = os.path.join(directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        call_command('import_catalogue', path, stdout=StringIO(), stderr=StringIO(), **options)
+        return path
+
+    def test_reimport_updates_movies_and_replaces_links(self):
+        rows = [
+            {'external_id': 'ext-1', 'movie_name_en': 'Heat', 'movie_name_ru': 'Схватка', 'year': '1995',
+             'countries': ['Importland', {'en': 'Otherland', 'ru': 'Другая'}], 'genres': ['Crime']},
+            {'external_id': 'ext-2', 'movie_name_en': 'Ronin', 'year': '1998-09-25', 'genres': ['Crime']},
+            {'movie_name_en': 'No id'},
+        ]
+        content = '\n'.join(json.dumps(row, ensure_ascii=False) for row in rows)
+        self.import_file('movies.jsonl', content, batch_size=2)
+        self.import_file('movies.csv', 'external_id,movie_name_en,year,countries\next-1,Heat 2,1995,Otherland\n')
+
+        heat = Movie.objects.get(external_id='ext-1')
+        self.assertEqual(heat.movie_name_en, 'Heat 2')
+        self.assertEqual(list(heat.country.values_list('country_name_ru', flat=True)), ['Другая'])
+        self.assertEqual(Movie.objects.filter(external_id__startswith='ext-').count(), 2)
+        self.assertEqual(Genre.objects.filter(genre_name_en='Crime').count(), 1)
+
+    def test_malformed_lines_are_skipped(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        path = os.path.join(directory, 'movies.jsonl')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('{"external_id": "ext-1",\n[1]\n{"external_id": "ext-2", "movie_name_en": "Ronin", "year": 1998}\n')
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_catalogue', path, stdout=stdout, stderr=stderr)
+        self.assertEqual(list(Movie.objects.values_list('external_id', flat=True)), ['ext-2'])
+        self.assertIn('line 1: ', stderr.getvalue())
+        self.assertIn('line 2: not a JSON object', stderr.getvalue())
+        self.assertIn('Imported 1 rows, 2 skipped', stdout.getvalue())
+
+    def test_import_refreshes_facet_counts(self):
+        fastlist.name_maps()
+        self.assertEqual(self.client.get(reverse('movie_list'), {'facets': 'status_movie'}).json()['facets'],
+                         {'status_movie': []})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.import_file('movies.csv', 'external_id,movie_name_en,year,status_movie\next-1,Heat,1995,pro\n')
+        self.assertEqual(self.client.get(reverse('movie_list'), {'facets': 'status_movie'}).json()['facets'],
+                         {'status_movie': [{'value': 'pro', 'count': 1}]})
+
+
+class ExportTests(CatalogueTestCase):
+    def test_export_prefetches_relations_per_chunk(self):
+        seed_catalogue(movies=3)
+        # one cursor over movies, then one query per relation for each chunk of two movies
+        with self.assertNumQueries(1 + 4 * 2):
+            records = [json.loads(line) for line in export_lines(chunk_size=2)]
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0]['movie_name'], {'en': 'Movie 0', 'ru': None})
+        self.assertEqual(len(records[0]['actors']), 3)
+        self.assertEqual(records[0]['rating'], {'avg': 7.0, 'count': 3, 'histogram': [0] * 6 + [3, 0, 0, 0]})
+
+    def test_export_endpoint_streams_ndjson_to_staff(self):
+        seed_catalogue(movies=2)
+        url = reverse('movie_export')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.force_authenticate(UserProfile.objects.create_user(username='staff', is_staff=True))
+        response = self.client.get(url, {'year__gt': '2000-06-01'})
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['year'] for line in lines], ['2001-01-01'])
+
+    def test_export_streams_from_an_async_iterator_under_asgi(self):
+        seed_catalogue(movies=2)
+        token = str(issue_tokens(UserProfile.objects.create_user(username='staff', is_staff=True))[1])
+
+        async def fetch():
+            response = await AsyncClient().get(reverse('movie_export'), headers={'Authorization': f'Bearer {token}'})
+            self.assertTrue(response.is_async)
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        lines = async_to_sync(fetch)().decode().splitlines()
+        self.assertEqual([json.loads(line)['year'] for line in lines], ['2000-01-01', '2001-01-01'])
+
+
+class AsyncViewTests(CatalogueTestCase):
+    views = {
+        'movie_list': AsyncMovieListAPIView,
+        'movie_detail': AsyncMovieDetailAPIView,
+        'country_detail': AsyncCountryDetailAPIView,
+        'genre_detail': AsyncGenreDetailAPIView,
+        'director_detail': AsyncDirectorDetailAPIView,
+        'actor_detail': AsyncActorDetailAPIView,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalogue()
+        cls.user = UserProfile.objects.create_user(username='pro', password='password', status='pro')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.user)
+        self.urls = {name: QueryBudgetTests.url(self, name) for name in self.views}
+
+    def test_async_views_return_what_sync_views_do_within_the_same_budget(self):
+        for name, view_class in self.views.items():
+            with self.subTest(endpoint=name):
+                url = self.urls[name]
+                expected = self.client.get(url)
+                cache.clear()
+                favorites.favorite_ids(self.user)
+                fastlist.name_maps()
+                request = AsyncRequestFactory().get(url)
+                force_authenticate(request, self.user)
+                with self.assertNumQueries(QueryBudgetTests.budgets[name]):
+                    response = async_to_sync(view_class.as_view())(request, **resolve(url.split('?')[0]).kwargs)
+                if hasattr(response, 'render'):
+                    # cached entity pages come back rendered
+                    response.render()
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.content), expected.json())
+
+    def test_serializers_run_off_the_event_loop(self):
+        threads = []
+        serialize = AsyncAPIView.serialize
+
+        def record(view, instance):
+            try:
+                asyncio.get_running_loop()
+                threads.append('event loop')
+            except RuntimeError:
+                threads.append('worker')
+            return serialize(view, instance)
+
+        with mock.patch.object(AsyncAPIView, 'serialize', record):
+            for name in ('movie_detail', 'country_detail'):
+                request = AsyncRequestFactory().get(self.urls[name])
+                force_authenticate(request, self.user)
+                async_to_sync(self.views[name].as_view())(request, **resolve(self.urls[name]).kwargs)
+        self.assertEqual(threads, ['worker', 'worker'])
+
+    async def test_missing_detail_is_404(self):
+        request = AsyncRequestFactory().get('/en/movie/0/')
+        force_authenticate(request, self.user)
+        response = await AsyncMovieDetailAPIView.as_view()(request, pk=0)
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTests(CatalogueTestCase):
+    def route(self, request, write=False):
+        router = ReplicaRouter()
+        seen = []
+
+        def view(request):
+            seen.append(router.db_for_read(Movie))
+            if write:
+                router.db_for_write(Rating)
+                seen.append(router.db_for_read(Movie))
+            return HttpResponse()
+
+        response = ReplicaPinningMiddleware(view)(request)
+        return seen, response
+
+    def test_reads_go_to_replicas_until_the_client_writes(self):
+        factory = RequestFactory()
+        self.assertEqual(ReplicaRouter().db_for_read(Movie), 'default')
+        self.assertEqual(self.route(factory.get('/en/movie/'))[0], ['replica'])
+        self.assertEqual(self.route(factory.post('/en/rating/'))[0], ['default'])
+
+        seen, response = self.route(factory.get('/en/movie/', HTTP_AUTHORIZATION='Bearer one'), write=True)
+        self.assertEqual(seen, ['replica', 'default'])
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+        pinned = factory.get('/en/movie/')
+        pinned.COOKIES[PIN_COOKIE] = '1'
+        self.assertEqual(self.route(pinned)[0], ['default'])
+        self.assertEqual(self.route(factory.get('/en/movie/', HTTP_AUTHORIZATION='Bearer one'))[0], ['default'])
+        self.assertEqual(self.route(factory.get('/en/movie/', HTTP_AUTHORIZATION='Bearer two'))[0], ['replica'])
+
+    def test_cached_results_are_read_from_the_primary(self):
+        router = ReplicaRouter()
+        user = UserProfile.objects.create_user(username='fan', password='password')
+        seen = []
+
+        def load(*args):
+            seen.append(router.db_for_read(Movie))
+            return frozenset() if args else {'country': {}, 'genre': {}}
+
+        def view(request):
+            seen.append(router.db_for_read(Movie))
+            with mock.patch('movie_app.favorites.load_ids', side_effect=load), \
+                    mock.patch('movie_app.fastlist.load_names', side_effect=load):
+                favorites.favorite_ids(user)
+                fastlist.name_maps()
+            seen.append(router.db_for_read(Movie))
+            return HttpResponse()
+
+        ReplicaPinningMiddleware(view)(RequestFactory().get('/en/movie/'))
+        self.assertEqual(seen, ['replica', 'default', 'default', 'replica'])
+
+
+class TokenUserAuthenticationTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        sessions.clear()
+        seed_catalogue()
+        self.movie = Movie.objects.order_by('pk').first()
+        self.user = UserProfile.objects.create_user(username='pro', password='password', status='pro')
+        response = self.client.post(reverse('login'), {'username': 'pro', 'password': 'password'})
+        self.tokens = response.json()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.tokens["access"]}')
+        self.url = reverse('movie_detail', args=[self.movie.pk])
+        favorites.favorite_ids(self.user)
+
+    def test_permissions_read_the_status_claim_without_loading_the_user(self):
+        self.assertEqual(AccessToken(self.tokens['access'])['status'], 'pro')
+        budget = QueryBudgetTests.budgets['movie_detail']
+        # the session is checked once, then served from the in-process cache
+        with self.assertNumQueries(budget + 1):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        with self.assertNumQueries(budget):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+
+    def test_logout_and_status_changes_revoke_the_access_token(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.user.status = 'simple'
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+        self.user.status = 'pro'
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.client.post(reverse('logout'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_losing_staff_rights_revokes_the_access_token(self):
+        self.user.is_staff = True
+        self.user.save()
+        access = self.client.post(reverse('login'), {'username': 'pro', 'password': 'password'}).json()['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(self.client.get(reverse('movie_export')).status_code, 200)
+
+        UserProfile.objects.filter(pk=self.user.pk).update(is_staff=False)
+        sessions.clear()
+        self.assertEqual(self.client.get(reverse('movie_export')).status_code, 401)
+
+
+@override_settings(VIEWING_BUFFER_SIZE=100, VIEWING_FLUSH_INTERVAL=0)
+class ViewingHistoryTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        seed_catalogue()
+        self.movies = list(Movie.objects.order_by('pk'))
+        self.user = UserProfile.objects.create_user(username='viewer', password='password', status='pro')
+        self.client.force_authenticate(self.user)
+        self.addCleanup(viewing.buffer.flush)
+
+    def watch(self, movie, position):
+        response = self.client.post(reverse('movie_views', args=[movie.pk]), {'position': position})
+        self.assertEqual(response.status_code, 202)
+
+    def test_events_are_buffered_and_flushed_in_one_batch(self):
+        for position in (10, 20, 30):
+            self.watch(self.movies[0], position)
+        self.assertEqual(ViewingEvent.objects.count(), 0)
+        with self.assertNumQueries(3):  # savepoint, insert, release
+            self.assertEqual(viewing.buffer.flush(), 3)
+        self.assertEqual(ViewingEvent.objects.count(), 3)
+
+    def test_failed_batches_are_kept_and_the_flusher_survives(self):
+        self.watch(self.movies[0], 10)
+        with mock.patch('movie_app.viewing.write_events', side_effect=DatabaseError('gone')), \
+                self.assertLogs('movie_app.viewing', 'ERROR'):
+            self.assertEqual(viewing.buffer.flush_logged(), 0)
+        self.watch(self.movies[0], 20)
+        self.assertEqual(viewing.buffer.pending(), 2)
+        self.assertEqual(viewing.buffer.flush(), 2)
+        self.assertEqual(list(ViewingEvent.objects.order_by('pk').values_list('position', flat=True)), [10, 20])
+
+        with override_settings(VIEWING_FLUSH_INTERVAL=60):
+            buffer = viewing.EventBuffer()
+            buffer.flusher = mock.Mock(is_alive=mock.Mock(return_value=False))
+            with mock.patch('threading.Thread') as thread:
+                buffer.start_flusher()
+            thread.return_value.start.assert_called_once()
+
+    def test_compaction_counts_views_not_position_reports(self):
+        old = timezone.now() - timedelta(days=60)
+
+        def compact(*minutes):
+            ViewingEvent.objects.bulk_create([
+                ViewingEvent(user=self.user, movie=self.movies[0], position=minute * 60,
+                             created_at=old + timedelta(minutes=minute)) for minute in minutes])
+            call_command('compact_viewing_events', days=30, stdout=StringIO())
+            return ViewingSummary.objects.get(user=self.user, movie=self.movies[0]).views_count
+
+        self.assertEqual(compact(0, 1, 2, 300, 301), 2)
+        # the first reports continue the view the last run ended with
+        self.assertEqual(compact(302, 303, 900), 3)
+
+    def test_continue_watching_merges_events_and_compacted_summaries(self):
+        old = timezone.now() - timedelta(days=60)
+        ViewingEvent.objects.bulk_create([
+            ViewingEvent(user=self.user, movie=self.movies[0], position=600, created_at=old),
+            ViewingEvent(user=self.user, movie=self.movies[0], position=900, created_at=old + timedelta(minutes=1)),
+            ViewingEvent(user=self.user, movie=self.movies[1], position=100, created_at=old),
+        ])
+        call_command('compact_viewing_events', days=30, stdout=StringIO())
+        self.assertEqual(ViewingEvent.objects.count(), 0)
+        summary = ViewingSummary.objects.get(user=self.user, movie=self.movies[0])
+        self.assertEqual((summary.position, summary.views_count), (900, 1))
+
+        # the newest event wins over the summary, a finished movie leaves continue-watching
+        self.watch(self.movies[1], 120 * 60)
+        self.watch(self.movies[2], 300)
+        viewing.buffer.flush()
+        recent = self.client.get(reverse('recently_watched')).json()
+        self.assertEqual([item['movie']['id'] for item in recent], [m.pk for m in self.movies[2::-1]])
+        continuing = self.client.get(reverse('continue_watching')).json()
+        self.assertEqual([(item['movie']['id'], item['position']) for item in continuing],
+                         [(self.movies[2].pk, 300), (self.movies[0].pk, 900)])
+
+
+class SimilarMoviesTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        seed_catalogue(movies=4)
+        self.movies = list(Movie.objects.order_by('pk'))
+        # the last movie shares only countries, genres and fans with the others
+        self.movies[3].actor.clear()
+        self.movies[3].director.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(SIMILAR_MOVIES_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('build_similar_movies', stdout=StringIO())
+
+    def similar_ids(self, movie, **params):
+        response = self.client.get(reverse('movie_similar', args=[movie.pk]), params)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()]
+
+    def test_neighbours_are_ranked_by_shared_features(self):
+        first, second, third, fourth = self.movies
+        self.assertEqual(self.similar_ids(first), [second.pk, third.pk, fourth.pk])
+        self.assertEqual(self.similar_ids(first, limit=1), [second.pk])
+        with self.assertNumQueries(4):  # movie exists, neighbours, their countries, their genres
+            self.assertEqual(self.similar_ids(fourth, limit=2), [first.pk, second.pk])
+        self.assertEqual(self.client.get(reverse('movie_similar', args=[0])).status_code, 404)
+
+    @override_settings(SIMILAR_REFRESH_WORKERS=0)
+    def test_relation_edits_refresh_the_movie_incrementally(self):
+        first, second, third, fourth = self.movies
+        index = similar.get_index()
+        self.assertLess(index.lookup(fourth.pk, 1)[0][1], 0.99)
+        with self.captureOnCommitCallbacks(execute=True):
+            fourth.actor.set(Actor.objects.all())
+            fourth.director.set(Director.objects.all())
+        neighbours = similar.get_index().lookup(fourth.pk, 3)
+        self.assertEqual([movie_id for movie_id, score in neighbours], [first.pk, second.pk, third.pk])
+        self.assertAlmostEqual(neighbours[0][1], 1.0, places=5)
+
+    def test_relation_edits_are_rescored_off_the_request_thread(self):
+        movies = self.movies * 30
+        with mock.patch.object(similar, 'get_executor') as get_executor, \
+                mock.patch.object(similar.SimilarIndex, 'refresh') as refresh, \
+                self.assertLogs('movie_app.similar', 'WARNING') as logs, \
+                self.captureOnCommitCallbacks(execute=True):
+            similar.schedule_refresh(movie.pk for movie in movies)
+        refresh.assert_not_called()
+        get_executor().submit.assert_called_once_with(similar.refresh_in_background,
+                                                      [movie.pk for movie in movies[:similar.MAX_REFRESH]])
+        self.assertIn(f'{similar.MAX_REFRESH} of {len(movies)}', logs.output[0])
+
+    def test_missing_index_returns_no_neighbours(self):
+        with override_settings(SIMILAR_MOVIES_DIR=os.path.join(tempfile.gettempdir(), 'no-similar-index')):
+            self.assertEqual(self.similar_ids(self.movies[0]), [])
+
+
+class LeaderboardTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.country = seed_catalogue()
+        self.movies = list(Movie.objects.order_by('pk'))
+        self.user = UserProfile.objects.create_user(username='critic', password='password')
+
+    def board(self, board, **params):
+        response = self.client.get(reverse('leaderboard', args=[board]), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_top_rated_is_bayesian_and_served_by_rank_range(self):
+        # the seeded ratings are all 7s, one 10 lifts a movie less than it would a plain average
+        Rating.objects.create(movie=self.movies[2], user=self.user, stars=10, text='text')
+        Rating.objects.create(movie=self.movies[1], user=self.user, stars=9, text='text')
+        call_command('rebuild_rating_aggregates', stdout=StringIO())
+        call_command('refresh_leaderboards', stdout=StringIO())
+
+        with self.assertNumQueries(3):  # entries with movies, countries, genres
+            page = self.board('top-rated', page_size=2)
+        self.assertEqual([entry['movie']['id'] for entry in page['results']], [self.movies[2].pk, self.movies[1].pk])
+        self.assertEqual([entry['rank'] for entry in page['results']], [1, 2])
+        self.assertLess(page['results'][0]['score'], 7.75)
+        self.assertIn('page=2', page['next'])
+        page = self.board('top-rated', page_size=2, page=2, country=self.country.pk)
+        self.assertEqual([entry['movie']['id'] for entry in page['results']], [self.movies[0].pk])
+        self.assertIsNone(page['next'])
+        self.assertEqual(self.client.get(reverse('leaderboard', args=['worst'])).status_code, 404)
+
+        # nothing changed, nothing rewritten
+        self.assertEqual(leaderboards.refresh([LeaderboardEntry.TOP_RATED]), {LeaderboardEntry.TOP_RATED: 0})
+
+    def test_trending_is_maintained_incrementally(self):
+        now = timezone.now()
+        Rating.objects.update(created_date=now - timedelta(days=30))
+        ViewingEvent.objects.bulk_create(
+            [ViewingEvent(user=self.user, movie=self.movies[0], created_at=now - timedelta(days=6))] * 30 +
+            [ViewingEvent(user=self.user, movie=self.movies[1], created_at=now - timedelta(hours=2))] * 2
+        )
+        leaderboards.refresh([LeaderboardEntry.TRENDING], now=now)
+        trending = self.board('trending')['results']
+        self.assertEqual([entry['movie']['id'] for entry in trending], [self.movies[0].pk, self.movies[1].pk])
+
+        # two days on: the old plays left the window, a fresh review arrived
+        later = now + timedelta(days=2)
+        rating = Rating.objects.create(movie=self.movies[2], user=self.user, stars=5, text='text')
+        Rating.objects.filter(pk=rating.pk).update(created_date=later - timedelta(hours=1))
+        leaderboards.refresh([LeaderboardEntry.TRENDING], now=later)
+        trending = self.board('trending', genre=self.movies[2].genre.first().pk)['results']
+        self.assertEqual([entry['movie']['id'] for entry in trending], [self.movies[2].pk, self.movies[1].pk])
+
+        incremental = leaderboards.refresh_trends(now=later)
+        full = leaderboards.refresh_trends(now=later, full=True)
+        self.assertEqual(set(incremental), set(full))
+        for movie_id, score in full.items():
+            self.assertAlmostEqual(incremental[movie_id], score, places=6)
+
+    def test_trending_counts_late_plays_and_forgets_deleted_reviews(self):
+        now = timezone.now()
+        Rating.objects.update(created_date=now - timedelta(days=30))
+        review = Rating.objects.create(movie=self.movies[0], user=self.user, stars=5, text='text')
+        Rating.objects.filter(pk=review.pk).update(created_date=now - timedelta(hours=3))
+        leaderboards.refresh_trends(now=now)
+        # recorded before that refresh, written by an event buffer after it
+        ViewingEvent.objects.create(user=self.user, movie=self.movies[1], created_at=now - timedelta(seconds=30))
+        Rating.objects.get(pk=review.pk).delete()
+
+        later = now + timedelta(minutes=10)
+        incremental = leaderboards.refresh_trends(now=later)
+        self.assertEqual(set(incremental), {self.movies[1].pk})
+        full = leaderboards.refresh_trends(now=later, full=True)
+        self.assertAlmostEqual(incremental[self.movies[1].pk], full[self.movies[1].pk], places=6)
+
+
+class FavoriteMoviesTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.country = seed_catalogue()
+        self.movies = list(Movie.objects.order_by('pk'))
+        self.user = UserProfile.objects.create_user(username='fan', password='password', status='pro')
+        self.client.force_authenticate(self.user)
+
+    def update(self, method, movies):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(reverse('favorite_movies'), {'movies': movies}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['movies']
+
+    def flags(self, data):
+        return {movie['id']: movie['is_favorite'] for movie in data['results']}
+
+    def test_bulk_add_and_remove(self):
+        first, second, third = self.movies
+        self.assertEqual(self.update('post', [first.pk, second.pk, first.pk, 0 + 99999]), [first.pk, second.pk])
+        self.assertEqual(self.update('post', [second.pk]), [first.pk, second.pk])
+        self.assertEqual(FavoriteMovie.objects.count(), 2)
+        self.assertEqual(self.update('delete', [first.pk, third.pk]), [second.pk])
+        listed = self.client.get(reverse('favorite_movies')).json()
+        self.assertEqual(self.flags(listed), {second.pk: True})
+        response = self.client.post(reverse('favorite_movies'), {'movies': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_removal_does_not_load_each_cart(self):
+        self.update('post', [movie.pk for movie in self.movies])
+        self.assertEqual(favorites.favorite_ids(self.user), {movie.pk for movie in self.movies})
+        # savepoint, the rows the collector sends signals for, delete, release
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(4):
+            favorites.remove(self.user, [movie.pk for movie in self.movies])
+        self.assertEqual(favorites.favorite_ids(self.user), frozenset())
+
+    def test_movies_are_flagged_with_one_query_per_user(self):
+        first, second, third = self.movies
+        self.update('post', [second.pk])
+        fastlist.name_maps()
+        with self.assertNumQueries(QueryBudgetTests.budgets['movie_list'] + 1):
+            data = self.client.get(reverse('movie_list'), {'page_size': 20}).json()
+        self.assertEqual(self.flags(data), {first.pk: False, second.pk: True, third.pk: False})
+        with self.assertNumQueries(QueryBudgetTests.budgets['movie_detail']):
+            detail = self.client.get(reverse('movie_detail', args=[second.pk])).json()
+        self.assertTrue(detail['is_favorite'])
+
+        # the flag follows edits made through the old endpoints too
+        with self.captureOnCommitCallbacks(execute=True):
+            FavoriteMovie.objects.filter(movie=second).delete()
+        self.assertFalse(self.client.get(reverse('movie_detail', args=[second.pk])).json()['is_favorite'])
+
+    def test_flag_stays_out_of_shared_responses(self):
+        self.update('post', [self.movies[0].pk])
+        country = self.client.get(reverse('country_detail', args=[self.country.pk])).json()
+        self.assertNotIn('is_favorite', country['country_movies'][0])
+        self.client.force_authenticate(None)
+        self.assertNotIn('is_favorite', self.client.get(reverse('movie_list')).json()['results'][0])
+
+
+class FacetCountTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.country = seed_catalogue(movies=3, related=2)
+        self.movies = list(Movie.objects.order_by('pk'))
+        self.genre = Genre.objects.create(genre_name='Noir')
+        self.movies[0].genre.add(self.genre)
+        Movie.objects.filter(pk=self.movies[2].pk).update(status_movie='pro', year=date(2015, 1, 1))
+        fastlist.name_maps()
+
+    def facets(self, **params):
+        response = self.client.get(reverse('movie_list'), {'page_size': 20, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['facets']
+
+    def test_counts_follow_the_filters(self):
+        # genre, country, director, then status_movie and year together
+        with self.assertNumQueries(QueryBudgetTests.budgets['movie_list'] + 4):
+            counts = self.facets(facets='all')
+        self.assertEqual(counts['status_movie'], [{'value': 'simple', 'count': 2}, {'value': 'pro', 'count': 1}])
+        self.assertEqual(counts['year'], [{'from': 2000, 'to': 2009, 'count': 2}, {'from': 2010, 'to': 2019, 'count': 1}])
+        self.assertEqual(counts['genre'][0], {'id': counts['genre'][0]['id'], 'count': 3})
+        self.assertIn({'id': self.genre.pk, 'count': 1}, counts['genre'])
+        self.assertEqual(len(counts['country']), 2)
+
+        counts = self.facets(facets='genre,status_movie', year__gt='2010-01-01')
+        self.assertEqual(set(counts), {'genre', 'status_movie'})
+        self.assertEqual(counts['status_movie'], [{'value': 'pro', 'count': 1}])
+        self.assertNotIn({'id': self.genre.pk, 'count': 1}, counts['genre'])
+        self.assertNotIn('facets', self.client.get(reverse('movie_list')).json())
+
+    def test_counts_are_cached_until_movies_change(self):
+        self.facets(facets='genre')
+        with self.assertNumQueries(QueryBudgetTests.budgets['movie_list']):
+            counts = self.facets(facets='genre', page_size=1)
+        self.assertIn({'id': self.genre.pk, 'count': 1}, counts['genre'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movies[1].genre.add(self.genre)
+        self.assertIn({'id': self.genre.pk, 'count': 2}, self.facets(facets='genre')['genre'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.genre.delete()
+        self.assertEqual(len(self.facets(facets='genre')['genre']), 2)
+
+
+class ConditionalGetTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.country = seed_catalogue()
+        self.movie = Movie.objects.order_by('pk').first()
+        self.user = UserProfile.objects.create_user(username='pro', password='password', status='pro')
+        self.client.force_authenticate(self.user)
+        favorites.favorite_ids(self.user)
+
+    def revalidate(self, url, response, queries):
+        self.assertIn('ETag', response)
+        with self.assertNumQueries(queries):
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        return again
+
+    def test_movie_detail_answers_304_from_one_row(self):
+        url = reverse('movie_detail', args=[self.movie.pk])
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response, 1).status_code, 304)
+
+        # child rows, relations and the user's favorites all change the ETag
+        for change in (lambda: Moments.objects.create(movie=self.movie, movie_moments='moments/new.jpg'),
+                       lambda: Genre.objects.filter(genre_movies=self.movie).first().save(),
+                       lambda: self.movie.actor.remove(Actor.objects.first()),
+                       lambda: favorites.add(self.user, [self.movie.pk])):
+            etag = self.client.get(url)['ETag']
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_last_modified_only_when_it_covers_the_body(self):
+        url = reverse('movie_detail', args=[self.movie.pk])
+        # is_favorite is part of the body, the movie's updated_at does not follow it
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        since = http_date(time.time() + 60)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+        self.assertNotIn('Last-Modified', self.client.get(reverse('movie_list')))
+
+        with mock.patch('movie_app.favorites.favorite_ids', return_value=None):
+            response = self.client.get(url)
+            self.assertIn('Last-Modified', response)
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(response.status_code, 304)
+            self.assertNotIn('Last-Modified', self.client.get(reverse('movie_list')))
+
+    def test_permissions_run_before_304(self):
+        url = reverse('movie_detail', args=[self.movie.pk])
+        etag = self.client.get(url)['ETag']
+        Movie.objects.filter(pk=self.movie.pk).update(status_movie='pro')
+        self.client.force_authenticate(UserProfile.objects.create_user(username='basic', password='password',
+                                                                       status='simple'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 403)
+
+    def test_movie_list_revalidates_the_page_only(self):
+        url = reverse('movie_list')
+        response = self.client.get(url, {'page_size': 2})
+        self.assertEqual(self.revalidate(url + '?page_size=2', response, 1).status_code, 304)
+        self.country.country_name = 'Renamed'
+        self.country.save()
+        self.assertEqual(self.client.get(url, {'page_size': 2}, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_cached_entity_pages_revalidate_without_queries(self):
+        url = reverse('country_detail', args=[self.country.pk])
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response, 0).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movie.country.remove(self.country)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class SparseFieldsetTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.country = seed_catalogue()
+        self.movie = Movie.objects.order_by('pk').first()
+        self.user = UserProfile.objects.create_user(username='pro', password='password', status='pro')
+        self.client.force_authenticate(self.user)
+        favorites.favorite_ids(self.user)
+
+    def get(self, url, params, queries):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(context), queries)
+        return response.json(), ' '.join(query['sql'] for query in context)
+
+    def test_movie_list_reads_only_the_requested_columns(self):
+        data, sql = self.get(reverse('movie_list'), {'fields': 'id,movie_name', 'page_size': 20}, 1)
+        self.assertEqual(data['results'][0], {'id': Movie.objects.get(movie_name='Movie 2').pk, 'movie_name': 'Movie 2'})
+        self.assertNotIn('description', sql)
+
+        data, sql = self.get(reverse('movie_list'), {'fields': 'movie_name,genre', 'page_size': 20}, 2)
+        self.assertEqual(data['results'][0]['genre'], sorted(self.movie.genre.values_list('pk', flat=True)))
+        self.assertNotIn('genre_name', sql)
+        data, sql = self.get(reverse('movie_list'), {'fields': 'movie_name', 'expand': 'genre,country',
+                                                     'page_size': 20}, 3)
+        self.assertEqual(set(data['results'][0]), {'movie_name', 'genre', 'country'})
+        self.assertIn('genre_name', data['results'][0]['genre'][0])
+
+    def test_movie_detail_skips_unrequested_relations(self):
+        url = reverse('movie_detail', args=[self.movie.pk])
+        data, sql = self.get(url, {'fields': 'movie_name,get_avg_rating,movie_ratings'}, 2)
+        self.assertEqual(set(data), {'movie_name', 'get_avg_rating', 'movie_ratings'})
+        self.assertEqual(len(data['movie_ratings']), 3)
+        self.assertNotIn('description', sql)
+        data, sql = self.get(url, {'fields': 'is_favorite', 'expand': 'movie_ratings'}, 2)
+        self.assertEqual(data['movie_ratings'][0]['user'], {'first_name': 'User 2'})
+        self.assertFalse(data['is_favorite'])
+
+        request = AsyncRequestFactory().get(url, {'fields': 'movie_name,actor', 'expand': 'genre'})
+        force_authenticate(request, self.user)
+        with self.assertNumQueries(3):
+            response = async_to_sync(AsyncMovieDetailAPIView.as_view())(request, pk=self.movie.pk)
+        response.render()
+        self.assertEqual(json.loads(response.content), self.client.get(url, {'fields': 'movie_name,actor',
+                                                                              'expand': 'genre'}).json())
+
+    def test_entity_detail_drops_the_count_and_preview(self):
+        url = reverse('country_detail', args=[self.country.pk])
+        data, sql = self.get(url, {'fields': 'country_name'}, 1)
+        self.assertEqual(data, {'country_name': 'Country 0'})
+        self.assertNotIn('COUNT', sql)
+        data, sql = self.get(url, {'fields': 'country_movies,country_movies_count'}, 2)
+        self.assertEqual(data['country_movies_count'], 3)
+        self.assertEqual(len(data['country_movies']), 3)
+        self.assertIsInstance(data['country_movies'][0], int)
+
+
+class FastMovieListTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.country = seed_catalogue(movies=4)
+        self.movies = list(Movie.objects.order_by('pk'))
+        Movie.objects.filter(pk=self.movies[0].pk).update(movie_name_ru='Фильм', movie_image='')
+        Movie.objects.filter(pk=self.movies[1].pk).update(year=date(999, 5, 1))
+        self.movies[2].genre.add(Genre.objects.create(genre_name='A genre added later'))
+        self.user = UserProfile.objects.create_user(username='fan', password='password', status='pro')
+        with self.captureOnCommitCallbacks(execute=True):
+            favorites.add(self.user, [self.movies[3].pk])
+
+    def both(self, url, params=None):
+        fast = self.client.get(url, params)
+        with mock.patch.object(MovieListAPIView, 'fast_list', False):
+            slow = self.client.get(url, params)
+        self.assertEqual(fast.status_code, 200)
+        return fast.content, slow.content
+
+    def test_output_is_byte_identical_to_the_serializer(self):
+        for user in (None, self.user):
+            self.client.force_authenticate(user)
+            for language in ('en', 'ru'):
+                with translation.override(language):
+                    requests = [
+                        (reverse('movie_list'), None),
+                        (reverse('movie_list'), {'ordering': 'year', 'page_size': 2}),
+                        (reverse('movie_list'), {'page': 2, 'ordering': '-year'}),
+                        (reverse('country_movies', args=[self.country.pk]), {'count': 1}),
+                    ]
+                for url, params in requests:
+                    with self.subTest(user=user, url=url, params=params):
+                        fast, slow = self.both(url, params)
+                        self.assertEqual(fast, slow)
+        self.assertIn('Фильм'.encode(), fast)
+
+    def test_cursor_follows_the_rows(self):
+        response = self.client.get(reverse('movie_list'), {'page_size': 2})
+        names = [movie['movie_name'] for movie in response.json()['results']]
+        following = self.client.get(response.json()['next']).json()
+        self.assertEqual(names + [movie['movie_name'] for movie in following['results']],
+                         ['Movie 3', 'Movie 2', 'Movie 0', 'Movie 1'])
+
+
+class FastJSONTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.country = seed_catalogue()
+        self.movie = Movie.objects.order_by('pk').first()
+
+    def test_renderer_matches_drf_output(self):
+        data = OrderedDict([
+            ('when', datetime(2024, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.get_fixed_timezone(0))),
+            ('day', date(2024, 1, 2)), ('price', Decimal('1.50')), ('lazy', gettext_lazy('Movie')),
+            ('text', 'line\u2028separator ёж'), ('ids', frozenset([1])), (3, [1.5, None, True]),
+        ])
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(data, 'application/json; indent=2'),
+                         JSONRenderer().render(data, 'application/json; indent=2'))
+        self.client.force_authenticate(UserProfile.objects.create_user(username='pro', password='password',
+                                                                       status='pro'))
+        for url in (reverse('movie_list'), reverse('movie_detail', args=[self.movie.pk])):
+            response = self.client.get(url)
+            self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+    def test_parser(self):
+        user = UserProfile.objects.create_user(username='fan', password='password', status='pro')
+        self.client.force_authenticate(user)
+        response = self.client.post(reverse('favorite_movies'), '{"movies": [%d]}' % self.movie.pk,
+                                    content_type='application/json')
+        self.assertEqual(response.json()['movies'], [self.movie.pk])
+        response = self.client.post(reverse('favorite_movies'), '{"movies": [NaN]}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', response.json()['detail'])
+
+    def test_negotiated_compression(self):
+        url = reverse('movie_list')
+        identity = self.client.get(url).content
+        for accept, encoding, decompress in (('gzip, br', 'br', brotli.decompress),
+                                             ('br;q=0.5, gzip', 'gzip', gzip.decompress),
+                                             ('*', 'br', brotli.decompress)):
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING=accept)
+            self.assertEqual(response['Content-Encoding'], encoding)
+            self.assertIn('Accept-Encoding', response['Vary'])
+            self.assertTrue(response['ETag'].startswith('W/'))
+            self.assertEqual(decompress(response.content), identity)
+        self.assertFalse(self.client.get(url, HTTP_ACCEPT_ENCODING='br;q=0, gzip;q=0').has_header('Content-Encoding'))
+        response = self.client.post(reverse('login'), {'username': 'nobody', 'password': 'x' * 300},
+                                    HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_cached_pages_are_stored_compressed(self):
+        url = reverse('country_detail', args=[self.country.pk])
+        first = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        with mock.patch('movie_app.compression.compress', wraps=compression.compress) as compress:
+            with self.assertNumQueries(0):
+                again = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(again.content, first.content)
+            self.assertEqual(again['Content-Encoding'], 'gzip')
+            # another encoding is compressed once from the stored body
+            br = self.client.get(url, HTTP_ACCEPT_ENCODING='br')
+            self.client.get(url, HTTP_ACCEPT_ENCODING='br')
+            self.assertEqual(compress.call_count, 1)
+        identity = self.client.get(url)
+        self.assertFalse(identity.has_header('Content-Encoding'))
+        self.assertEqual(brotli.decompress(br.content), identity.content)
+        self.assertEqual(gzip.decompress(first.content), identity.content)
+        self.assertEqual(json.loads(identity.content)['country_name'], 'Country 0')
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT_ENCODING='gzip',
+                                         HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+
+class MetricsTests(CatalogueTestCase):
+    def setUp(self):
+        super().setUp()
+        seed_catalogue()
+        self.user = UserProfile.objects.create_user(username='pro', password='password', status='pro')
+        self.client.force_authenticate(self.user)
+        favorites.favorite_ids(self.user)
+        fastlist.name_maps()
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_request_metrics(self):
+        url = reverse('movie_list')
+        before = {
+            'count': self.sample('movie_app_request_seconds_count', view='movie_list', method='GET', status='200'),
+            'queries': self.sample('movie_app_request_queries_sum', view='movie_list'),
+            'bytes': self.sample('movie_app_response_bytes_sum', view='movie_list'),
+            'serializer': self.sample('movie_app_serializer_seconds_count', view='movie_list',
+                                      serializer='MovieListSerializer:fast'),
+        }
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(self.sample('movie_app_request_seconds_count', view='movie_list', method='GET',
+                                     status='200'), before['count'] + 1)
+        self.assertEqual(self.sample('movie_app_request_queries_sum', view='movie_list'),
+                         before['queries'] + len(queries))
+        # the body as sent, compressed
+        self.assertEqual(self.sample('movie_app_response_bytes_sum', view='movie_list'),
+                         before['bytes'] + len(response.content))
+        self.assertEqual(self.sample('movie_app_serializer_seconds_count', view='movie_list',
+                                     serializer='MovieListSerializer:fast'), before['serializer'] + 1)
+
+        count = self.sample('movie_app_serializer_seconds_count', view='movie_detail', serializer='MovieDetailSerializer')
+        self.client.get(reverse('movie_detail', args=[Movie.objects.order_by('pk').first().pk]))
+        # the nested serializers are part of the outer one
+        self.assertEqual(self.sample('movie_app_serializer_seconds_count', view='movie_detail',
+                                     serializer='MovieDetailSerializer'), count + 1)
+        count = self.sample('movie_app_request_seconds_count', view='unresolved', method='GET', status='404')
+        self.client.get('/en/nowhere/')
+        self.assertEqual(self.sample('movie_app_request_seconds_count', view='unresolved', method='GET',
+                                     status='404'), count + 1)
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_slow_query_log(self):
+        with self.assertLogs('movie_app.slow_queries', 'WARNING') as logs:
+            self.client.get(reverse('movie_list'))
+        records = [record for record in logs.records if record.serializer == 'MovieListSerializer:fast']
+        self.assertTrue(records)
+        self.assertTrue(all(record.view == 'movie_list' for record in logs.records))
+        self.assertIn('movie_app_movie_country', ' '.join(record.sql for record in records))
+        self.assertIn('view=movie_list serializer=MovieListSerializer:fast', records[0].getMessage())
+        self.assertGreaterEqual(self.sample('movie_app_slow_queries_total', view='movie_list',
+                                            serializer='MovieListSerializer:fast'), len(records))
+        # outside requests nothing is recorded
+        with self.assertNoLogs('movie_app.slow_queries'):
+            list(Movie.objects.all())
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_endpoint_requires_staff_or_token(self):
+        url = reverse('metrics')
+        self.assertEqual(url, '/metrics/')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'# TYPE movie_app_request_seconds histogram', response.content)
+        self.client.force_login(UserProfile.objects.create_user(username='staff', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_workers_are_aggregated(self):
+        # what two gunicorn workers leave in PROMETHEUS_MULTIPROC_DIR, read back by a third process
+        script = (
+            'import django; django.setup()\n'
+            'from movie_app import metrics\n'
+            "metrics.request_seconds.labels('movie_list', 'GET', '200').observe(0.25)\n"
+        )
+        with tempfile.TemporaryDirectory() as path:
+            env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': path, 'DJANGO_SETTINGS_MODULE': 'myproject.settings'}
+            for _ in range(2):
+                subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR, env=env, check=True)
+            self.client.force_login(UserProfile.objects.create_user(username='staff', is_staff=True))
+            with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': path}):
+                response = self.client.get(reverse('metrics'))
+        content = response.content.decode()
+        self.assertIn('movie_app_request_seconds_count{method="GET",status="200",view="movie_list"} 2.0', content)
+        self.assertIn('movie_app_request_seconds_sum{method="GET",status="200",view="movie_list"} 0.5', content)
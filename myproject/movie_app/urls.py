@@ -3,10 +3,20 @@ from .views import (
     UserProfileViewSet, CountryListAPIView, CountryDetailAPIView, DirectorListAPIView, DirectorDetailAPIView,
     ActorListAPIView, ActorDetailSerializer,
     GenreListAPIView,GenreDetailAPIView, MovieListAPIView, MovieDetailAPIView, MovieLanguagesViewSet,
-    MomentsViewSet, RatingViewSet, FavoriteViewSet, FavoriteMovieViewSet, HistoryViewSet, ActorDetailAPIView,RegisterView,LoginView,LogoutView
+    MomentsViewSet, RatingViewSet, FavoriteViewSet, FavoriteMovieViewSet, HistoryViewSet, ActorDetailAPIView,RegisterView,LoginView,LogoutView,
+    SearchAPIView, MovieRatingsAPIView, MovieVideoStreamAPIView, MovieExportAPIView, MovieViewEventAPIView,
+    RecentlyWatchedAPIView, ContinueWatchingAPIView, SimilarMoviesAPIView, LeaderboardAPIView, FavoriteMoviesAPIView, CountryMoviesAPIView, GenreMoviesAPIView, DirectorMoviesAPIView, ActorMoviesAPIView
 )
+from django.conf import settings
 from django.urls import path, include
 
+if settings.ASYNC_CATALOGUE_VIEWS:
+    from .async_views import (
+        AsyncMovieListAPIView as MovieListAPIView, AsyncMovieDetailAPIView as MovieDetailAPIView,
+        AsyncCountryDetailAPIView as CountryDetailAPIView, AsyncDirectorDetailAPIView as DirectorDetailAPIView,
+        AsyncActorDetailAPIView as ActorDetailAPIView, AsyncGenreDetailAPIView as GenreDetailAPIView
+    )
+
 router = routers.SimpleRouter()
 router.register(r'users', UserProfileViewSet)
 router.register(r'movie-languages', MovieLanguagesViewSet)
@@ -17,17 +27,31 @@ router.register(r'favorite-movies', FavoriteMovieViewSet)
 router.register(r'history', HistoryViewSet)
 
 urlpatterns = [
+    path('favorites/movies/', FavoriteMoviesAPIView.as_view(), name='favorite_movies'),
     path('', include(router.urls)),
     path('movie/', MovieListAPIView.as_view(), name='movie_list'),
+    path('movie/export/', MovieExportAPIView.as_view(), name='movie_export'),
     path('movie/<int:pk>/', MovieDetailAPIView.as_view(), name='movie_detail'),
+    path('movie/<int:pk>/ratings/', MovieRatingsAPIView.as_view(), name='movie_ratings'),
+    path('movie/<int:pk>/videos/<int:video_pk>/stream/', MovieVideoStreamAPIView.as_view(), name='movie_video_stream'),
+    path('movie/<int:pk>/views/', MovieViewEventAPIView.as_view(), name='movie_views'),
+    path('movie/<int:pk>/similar/', SimilarMoviesAPIView.as_view(), name='movie_similar'),
+    path('recently-watched/', RecentlyWatchedAPIView.as_view(), name='recently_watched'),
+    path('continue-watching/', ContinueWatchingAPIView.as_view(), name='continue_watching'),
+    path('leaderboards/<slug:board>/', LeaderboardAPIView.as_view(), name='leaderboard'),
     path('country/', CountryListAPIView.as_view(), name='country_list'),
     path('country/<int:pk>/', CountryDetailAPIView.as_view(), name='country_detail'),
+    path('country/<int:pk>/movies/', CountryMoviesAPIView.as_view(), name='country_movies'),
     path('director/', DirectorListAPIView.as_view(), name='director_list'),
     path('director/<int:pk>/', DirectorDetailAPIView.as_view(), name='director_detail'),
+    path('director/<int:pk>/movies/', DirectorMoviesAPIView.as_view(), name='director_movies'),
     path('actor/', ActorListAPIView.as_view(), name='actor_list'),
     path('actor/<int:pk>/', ActorDetailAPIView.as_view(), name='actor_detail'),
+    path('actor/<int:pk>/movies/', ActorMoviesAPIView.as_view(), name='actor_movies'),
     path('genre/', GenreListAPIView.as_view(), name='genre_list'),
     path('genre/<int:pk>/', GenreDetailAPIView.as_view(), name='genre_detail'),
+    path('genre/<int:pk>/movies/', GenreMoviesAPIView.as_view(), name='genre_movies'),
+    path('search/', SearchAPIView.as_view(), name='search'),
     path('register/', RegisterView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(), name='logout'),
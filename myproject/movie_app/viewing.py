@@ -0,0 +1,132 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+
+from .models import Movie, UserProfile, ViewingEvent, ViewingSummary
+
+# a movie counts as finished once this share of its running time has been watched
+FINISHED_SHARE = 0.95
+# newest uncompacted events read per request, older plays are covered by the summaries
+RECENT_EVENTS_SCAN = 500
+# while the database refuses writes failed batches wait for the next flush, up to this many
+# buffers' worth, then the oldest events are dropped
+MAX_PENDING_BUFFERS = 10
+
+logger = logging.getLogger(__name__)
+
+
+class EventBuffer:
+    """
+    Collects ViewingEvents in process and writes them with one bulk_create once
+    VIEWING_BUFFER_SIZE events are waiting or every VIEWING_FLUSH_INTERVAL seconds.
+    A crashed worker loses at most that much history, a clean exit flushes. A batch the
+    database rejects goes back into the buffer and is retried with the next flush.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = []
+        self.flusher = None
+
+    def add(self, user_id, movie_id, position):
+        event = ViewingEvent(user_id=user_id, movie_id=movie_id, position=position)
+        with self.lock:
+            self.events.append(event)
+            full = len(self.events) >= settings.VIEWING_BUFFER_SIZE
+        if full:
+            self.flush_logged()
+        self.start_flusher()
+
+    def start_flusher(self):
+        if (self.flusher is not None and self.flusher.is_alive()) or not settings.VIEWING_FLUSH_INTERVAL:
+            return
+        with self.lock:
+            if self.flusher is None or not self.flusher.is_alive():
+                self.flusher = threading.Thread(target=self.run_flusher, name='viewing-flush', daemon=True)
+                self.flusher.start()
+
+    def run_flusher(self):
+        while True:
+            time.sleep(settings.VIEWING_FLUSH_INTERVAL)
+            try:
+                self.flush_logged()
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        with self.lock:
+            events, self.events = self.events, []
+        if events:
+            try:
+                write_events(events)
+            except Exception:
+                self.requeue(events)
+                raise
+        return len(events)
+
+    def flush_logged(self):
+        try:
+            return self.flush()
+        except Exception:
+            logger.exception('Writing viewing events failed, they stay buffered')
+            return 0
+
+    def requeue(self, events):
+        with self.lock:
+            self.events = events + self.events
+            dropped = len(self.events) - settings.VIEWING_BUFFER_SIZE * MAX_PENDING_BUFFERS
+            if dropped > 0:
+                del self.events[:dropped]
+        if dropped > 0:
+            logger.error('Dropped %d buffered viewing events', dropped)
+
+    def pending(self):
+        with self.lock:
+            return len(self.events)
+
+
+def write_events(events):
+    try:
+        with transaction.atomic():
+            ViewingEvent.objects.bulk_create(events, batch_size=1000)
+    except IntegrityError:
+        # a user or movie was deleted while its events sat in the buffer, keep the rest
+        user_ids = set(UserProfile.objects.filter(pk__in={event.user_id for event in events})
+                       .values_list('pk', flat=True))
+        movie_ids = set(Movie.objects.filter(pk__in={event.movie_id for event in events})
+                        .values_list('pk', flat=True))
+        events = [event for event in events if int(event.user_id) in user_ids and event.movie_id in movie_ids]
+        ViewingEvent.objects.bulk_create(events, batch_size=1000)
+
+
+buffer = EventBuffer()
+atexit.register(buffer.flush)
+
+
+def recent_views(user_id, limit, unfinished=False):
+    """
+    [(movie_id, position, viewed_at)] newest first, merged from the events not compacted yet
+    and the summaries of older ones. Both reads are range scans of a (user, -time) index.
+    """
+    latest = {}
+    events = ViewingEvent.objects.filter(user_id=user_id).order_by('-created_at', '-pk')[:RECENT_EVENTS_SCAN]
+    for movie_id, position, viewed_at, movie_time in events.values_list(
+            'movie_id', 'position', 'created_at', 'movie__movie_time'):
+        latest.setdefault(movie_id, (position, viewed_at, movie_time))
+    summaries = ViewingSummary.objects.filter(user_id=user_id).order_by('-last_viewed_at')
+    if unfinished:
+        summaries = summaries.filter(position__gt=0,
+                                     position__lt=F('movie__movie_time') * 60 * FINISHED_SHARE)
+    for movie_id, position, viewed_at, movie_time in summaries[:limit + len(latest)].values_list(
+            'movie_id', 'position', 'last_viewed_at', 'movie__movie_time'):
+        if movie_id not in latest or latest[movie_id][1] < viewed_at:
+            latest[movie_id] = (position, viewed_at, movie_time)
+    views = sorted(latest.items(), key=lambda item: item[1][1], reverse=True)
+    if unfinished:
+        views = [(movie_id, view) for movie_id, view in views if 0 < view[0] < view[2] * 60 * FINISHED_SHARE]
+    return [(movie_id, position, viewed_at) for movie_id, (position, viewed_at, movie_time) in views[:limit]]
@@ -2,21 +2,40 @@ from rest_framework import viewsets, generics, permissions, status
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from .models import (
     Country, Director, Actor, Genre, Movie,
-    MovieLanguages, Moments, Rating, Favorite, FavoriteMovie, History
+    MovieLanguages, Moments, Rating, Favorite, FavoriteMovie, History, LeaderboardEntry
 )
 from .serializers import (
     UserProfile, CountrySerializer,CountryDetailSerializer,DirectorSerializer,DirectorDetailSerializer, ActorSerializer,ActorDetailSerializer,
     GenreSerializer,GenreDetailSerializer, MovieListSerializer, MovieDetailSerializer, MovieLanguagesSerializer,
-    MomentsSerializer, RatingSerializer, UserProfileSerializer,FavoriteSerializer,FavoriteMovieSerializer,HistorySerializer,UserProfileRegisterSerializer,LoginSerializer
+    MomentsSerializer, RatingSerializer, UserProfileSerializer,FavoriteSerializer,FavoriteMovieSerializer,HistorySerializer,UserProfileRegisterSerializer,LoginSerializer,
+    ActorSearchSerializer, DirectorSearchSerializer, RatingThreadSerializer, ViewingEventSerializer,
+    WatchedMovieSerializer, LeaderboardEntrySerializer, FavoriteMoviesUpdateSerializer
 )
-from .filters import MovieFilter
+from .filters import MovieFilter, FullTextSearchFilter
+from . import search
+from . import viewing
+from . import similar
+from . import leaderboards
+from . import favorites
+from . import facets
+from .cache import CachedResponseMixin, get_generations
+from .conditional import VersionedDetailMixin, VersionedListMixin
+from .fieldsets import SparseFieldsetMixin
+from .fastlist import FastMovieListMixin
+from .streaming import stream_file, streaming_content
+from .export import export_lines
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter, OrderingFilter
-from .pagination import MoviePagination
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from .pagination import MoviePagination, MovieCursorPagination, RatingPagination, LeaderboardPagination
 from .permissions import CheckStatus, RatingPermission
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.response import Response
+from django.db.models import Count, Prefetch
 
 
 
@@ -57,6 +76,21 @@ class LogoutView(generics.GenericAPIView):
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
+# primary key order, the order fastlist.serialize_movies() renders them in
+movie_list_queryset = Movie.objects.prefetch_related(
+    Prefetch('country', queryset=Country.objects.order_by('pk')),
+    Prefetch('genre', queryset=Genre.objects.order_by('pk')),
+)
+
+FILMOGRAPHY_PREVIEW_SIZE = 10
+
+
+def filmography_queryset(model, relation):
+    # entity pages embed only the newest movies, the rest is paged by the <entity>/<pk>/movies/ views
+    preview = movie_list_queryset.order_by('-year', '-pk')[:FILMOGRAPHY_PREVIEW_SIZE]
+    return model.objects.prefetch_related(Prefetch(relation, queryset=preview, to_attr='preview_movies'))
+
+
 class UserProfileViewSet(viewsets.ModelViewSet):
     queryset = UserProfile.objects.all()
     serializer_class = UserProfileSerializer
@@ -64,58 +98,308 @@ class UserProfileViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
             return UserProfile.objects.filter(id=self.request.user.id)
 
-class CountryListAPIView(generics.ListAPIView):
+class CountryListAPIView(CachedResponseMixin, generics.ListAPIView):
+    cache_scope = 'country'
     queryset = Country.objects.all()
     serializer_class = CountrySerializer
 
-class CountryDetailAPIView(generics.RetrieveAPIView):
-    queryset = Country.objects.all()
+class CountryDetailAPIView(CachedResponseMixin, SparseFieldsetMixin, generics.RetrieveAPIView):
+    cache_scope = 'country'
+    queryset = filmography_queryset(Country, 'country_movies')
+    field_annotations = {'movies_count': Count('country_movies')}
     serializer_class = CountryDetailSerializer
 
-class DirectorListAPIView(generics.ListAPIView):
+class DirectorListAPIView(CachedResponseMixin, generics.ListAPIView):
+    cache_scope = 'director'
     queryset = Director.objects.all()
     serializer_class = DirectorSerializer
 
 
-class DirectorDetailAPIView(generics.RetrieveAPIView):
-    queryset = Director.objects.all()
+class DirectorDetailAPIView(CachedResponseMixin, SparseFieldsetMixin, generics.RetrieveAPIView):
+    cache_scope = 'director'
+    queryset = filmography_queryset(Director, 'director_movies')
+    field_annotations = {'movies_count': Count('director_movies')}
     serializer_class = DirectorDetailSerializer
 
 
-class ActorListAPIView(generics.ListAPIView):
+class ActorListAPIView(CachedResponseMixin, generics.ListAPIView):
+    cache_scope = 'actor'
     queryset = Actor.objects.all()
     serializer_class = ActorSerializer
 
-class ActorDetailAPIView(generics.RetrieveAPIView):
-    queryset = Actor.objects.all()
+class ActorDetailAPIView(CachedResponseMixin, SparseFieldsetMixin, generics.RetrieveAPIView):
+    cache_scope = 'actor'
+    queryset = filmography_queryset(Actor, 'actor_movies')
+    field_annotations = {'movies_count': Count('actor_movies')}
     serializer_class = ActorDetailSerializer
 
 
-class GenreListAPIView(generics.ListAPIView):
+class GenreListAPIView(CachedResponseMixin, generics.ListAPIView):
+    cache_scope = 'genre'
     queryset = Genre.objects.all()
     serializer_class = GenreSerializer
 
 
-class GenreDetailAPIView(generics.RetrieveAPIView):
-    queryset = Genre.objects.all()
+class GenreDetailAPIView(CachedResponseMixin, SparseFieldsetMixin, generics.RetrieveAPIView):
+    cache_scope = 'genre'
+    queryset = filmography_queryset(Genre, 'genre_movies')
+    field_annotations = {'movies_count': Count('genre_movies')}
     serializer_class = GenreDetailSerializer
 
 
-class MovieListAPIView(generics.ListAPIView):
-    queryset = Movie.objects.all()
-    filter_backends = [DjangoFilterBackend,SearchFilter, OrderingFilter]
+class FavoriteIdsMixin:
+    """Loads the user's favorite movie ids once per request, serializers flag movies with is_favorite."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.favorite_ids = favorites.favorite_ids(request.user)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['favorite_ids'] = getattr(self, 'favorite_ids', None)
+        return context
+
+
+class MovieListAPIView(VersionedListMixin, FavoriteIdsMixin, SparseFieldsetMixin, FastMovieListMixin,
+                       generics.ListAPIView):
+    queryset = movie_list_queryset
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     filterset_class = MovieFilter
     serializer_class = MovieListSerializer
-    search_fields = ['movie_name']
     ordering_fields = ['year']
     pagination_class = MoviePagination
+    cursor_params = (MovieCursorPagination.cursor_query_param, MovieCursorPagination.page_size_query_param)
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
-class MovieDetailAPIView(generics.RetrieveAPIView):
-    queryset = Movie.objects.all()
-    queryset = Movie.objects.all()
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(self.get_page_queryset(queryset))
+        response = self.get_paginated_response(self.serialize_page(page))
+        self.add_facets(response, queryset)
+        return response
+
+    def add_facets(self, response, queryset):
+        # ?facets=genre,country or ?facets=all counts the options of the filtered list
+        names = facets.requested(self.request)
+        if names:
+            response.data['facets'] = facets.get_facet_counts(self.request, queryset, names)
+
+    def validator_fields(self):
+        # the cursor is built from the year
+        return [*super().validator_fields(), 'year']
+
+    def get_validator_extra(self):
+        extra = super().get_validator_extra()
+        if facets.requested(self.request):
+            extra += get_generations([facets.FACETS_SCOPE])[0]
+        return extra
+
+    @property
+    def paginator(self):
+        # page numbers stay the default for existing clients, ?cursor= or ?page_size= opt in to keyset pages
+        if not hasattr(self, '_paginator'):
+            request = getattr(self, 'request', None)
+            params = request.query_params if request is not None else {}
+            if 'page' not in params and any(param in params for param in self.cursor_params):
+                self._paginator = MovieCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+LATEST_RATINGS_SIZE = 5
+latest_ratings_queryset = Rating.objects.filter(parent__isnull=True).select_related('user').order_by('-created_date', '-pk')
+
+
+class MovieDetailAPIView(VersionedDetailMixin, FavoriteIdsMixin, SparseFieldsetMixin, generics.RetrieveAPIView):
+    # only the newest top-level reviews are embedded, threads are paged by MovieRatingsAPIView
+    queryset = Movie.objects.prefetch_related(
+        'country', 'director', 'actor', 'genre', 'movie_frames', 'movie_videos',
+        Prefetch(
+            'movie_ratings',
+            queryset=latest_ratings_queryset[:LATEST_RATINGS_SIZE],
+            to_attr='latest_ratings',
+        ),
+    )
     serializer_class = MovieDetailSerializer
     permission_classes = [CheckStatus]
+    field_columns = {'get_avg_rating': ['rating_avg'], 'get_count_people': ['rating_count']}
+
+    def validator_fields(self):
+        # CheckStatus reads it before a 304
+        return [*super().validator_fields(), 'status_movie']
+
+
+class MovieVideoStreamAPIView(generics.GenericAPIView):
+    queryset = MovieLanguages.objects.select_related('movie')
+    permission_classes = [CheckStatus]
+
+    def perform_content_negotiation(self, request, force=False):
+        # players send video Accept headers, the body is never rendered by DRF
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, pk, video_pk):
+        video = get_object_or_404(self.get_queryset(), pk=video_pk, movie_id=pk)
+        self.check_object_permissions(request, video.movie)
+        return stream_file(request, video.video)
+
+
+class MovieExportAPIView(generics.GenericAPIView):
+    # the whole catalogue as NDJSON for partners and indexers, accepts the MovieFilter params
+    queryset = Movie.objects.all()
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = MovieFilter
+    permission_classes = [permissions.IsAdminUser]
+
+    def perform_content_negotiation(self, request, force=False):
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request, *args, **kwargs):
+        lines = export_lines(self.filter_queryset(self.get_queryset()),
+                             media_url=request.build_absolute_uri(settings.MEDIA_URL))
+        response = StreamingHttpResponse(streaming_content(request, lines),
+                                         content_type='application/x-ndjson; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="movies.ndjson"'
+        return response
+
+
+class MovieViewEventAPIView(generics.GenericAPIView):
+    # players report the position every few seconds, the events are written in batches
+    queryset = Movie.objects.only('id', 'status_movie')
+    serializer_class = ViewingEventSerializer
+    permission_classes = [permissions.IsAuthenticated, CheckStatus]
+
+    def post(self, request, *args, **kwargs):
+        movie = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        viewing.buffer.add(request.user.pk, movie.pk, serializer.validated_data['position'])
+        return Response(status=status.HTTP_202_ACCEPTED)
+
+
+class RecentlyWatchedAPIView(FavoriteIdsMixin, generics.GenericAPIView):
+    serializer_class = WatchedMovieSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    unfinished = False
+    default_limit = 20
+    max_limit = 100
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(max(int(request.query_params.get('limit', self.default_limit)), 1), self.max_limit)
+        except ValueError:
+            limit = self.default_limit
+        views = viewing.recent_views(request.user.pk, limit, unfinished=self.unfinished)
+        movies = movie_list_queryset.in_bulk([movie_id for movie_id, position, viewed_at in views])
+        watched = [{'movie': movies[movie_id], 'position': position, 'viewed_at': viewed_at}
+                   for movie_id, position, viewed_at in views if movie_id in movies]
+        return Response(self.get_serializer(watched, many=True).data)
+
+
+class ContinueWatchingAPIView(RecentlyWatchedAPIView):
+    unfinished = True
+
+
+class SimilarMoviesAPIView(FavoriteIdsMixin, generics.GenericAPIView):
+    serializer_class = MovieListSerializer
+    default_limit = 10
+
+    def get(self, request, pk, *args, **kwargs):
+        get_object_or_404(Movie.objects.only('pk'), pk=pk)
+        try:
+            limit = min(max(int(request.query_params.get('limit', self.default_limit)), 1),
+                        settings.SIMILAR_MOVIES_K)
+        except ValueError:
+            limit = self.default_limit
+        neighbours = similar.similar_movies(pk, limit)
+        movies = movie_list_queryset.in_bulk([movie_id for movie_id, score in neighbours])
+        return Response(self.get_serializer([movies[movie_id] for movie_id, score in neighbours
+                                             if movie_id in movies], many=True).data)
+
+
+class LeaderboardAPIView(FavoriteIdsMixin, generics.ListAPIView):
+    """Precomputed by the refresh_leaderboards command, ?genre=<pk> or ?country=<pk> narrows the board."""
+    serializer_class = LeaderboardEntrySerializer
+    pagination_class = LeaderboardPagination
+
+    def get_queryset(self):
+        board = self.kwargs['board']
+        if board not in dict(LeaderboardEntry.BOARD_CHOICES):
+            raise NotFound('Нет такого рейтинга')
+        scope = leaderboards.get_scope()
+        for field in leaderboards.SCOPE_FIELDS:
+            pk = self.request.query_params.get(field)
+            if pk is not None:
+                if not pk.isdigit():
+                    raise NotFound()
+                scope = leaderboards.get_scope(field, int(pk))
+                break
+        return LeaderboardEntry.objects.filter(board=board, scope=scope).select_related('movie').prefetch_related(
+            'movie__country', 'movie__genre')
+
+
+class MovieRatingsAPIView(generics.ListAPIView):
+    serializer_class = RatingThreadSerializer
+    pagination_class = RatingPagination
+
+    def get_queryset(self):
+        return (Rating.objects.filter(movie_id=self.kwargs['pk'], parent__isnull=True)
+                .select_related('user').order_by('-created_date', '-pk'))
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        # every reply of every thread on the page in one query, assembled into a tree in memory
+        replies = {}
+        for reply in Rating.objects.filter(root__in=page).select_related('user').order_by('created_date', 'pk'):
+            replies.setdefault(reply.parent_id, []).append(reply)
+        context = self.get_serializer_context()
+        context['replies'] = replies
+        serializer = self.get_serializer_class()(page, many=True, context=context)
+        return self.get_paginated_response(serializer.data)
+
+
+class FilmographyAPIView(MovieListAPIView):
+    relation = None
+
+    def get_queryset(self):
+        return super().get_queryset().filter(**{self.relation: self.kwargs['pk']})
+
+
+class CountryMoviesAPIView(FilmographyAPIView):
+    relation = 'country'
+
+
+class GenreMoviesAPIView(FilmographyAPIView):
+    relation = 'genre'
+
+
+class DirectorMoviesAPIView(FilmographyAPIView):
+    relation = 'director'
+
+
+class ActorMoviesAPIView(FilmographyAPIView):
+    relation = 'actor'
+
+
+class SearchAPIView(generics.GenericAPIView):
+    results = {
+        'movie': ('movies', movie_list_queryset, MovieListSerializer),
+        'actor': ('actors', Actor.objects.all(), ActorSearchSerializer),
+        'director': ('directors', Director.objects.all(), DirectorSearchSerializer),
+    }
+    limit = 20
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '')
+        kinds = request.query_params.get('type', '').split(',')
+        data = {}
+        for kind, (key, queryset, serializer_class) in self.results.items():
+            if kinds != [''] and kind not in kinds:
+                continue
+            ranked = search.search(kind, query, limit=self.limit)
+            objects = queryset.in_bulk([object_id for object_id, rank in ranked])
+            found = [objects[object_id] for object_id, rank in ranked if object_id in objects]
+            data[key] = serializer_class(found, many=True, context=self.get_serializer_context()).data
+        return Response(data)
 
 
 class MovieLanguagesViewSet(viewsets.ModelViewSet):
@@ -133,6 +417,33 @@ class RatingViewSet(viewsets.ModelViewSet):
     serializer_class = RatingSerializer
     permissions_classes = [RatingPermission]
 
+class FavoriteMoviesAPIView(FavoriteIdsMixin, generics.ListAPIView):
+    """The user's favorite movies, POST adds and DELETE removes {"movies": [ids]} in one request."""
+    serializer_class = MovieListSerializer
+    pagination_class = MovieCursorPagination
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return movie_list_queryset.filter(pk__in=self.favorite_ids)
+
+    def get_ids(self, request):
+        serializer = FavoriteMoviesUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data['movies']
+
+    def respond(self, request):
+        # read past the cache, it is only dropped once the change commits
+        return Response({'movies': sorted(favorites.load_ids(request.user.pk))})
+
+    def post(self, request, *args, **kwargs):
+        favorites.add(request.user, self.get_ids(request))
+        return self.respond(request)
+
+    def delete(self, request, *args, **kwargs):
+        favorites.remove(request.user, self.get_ids(request))
+        return self.respond(request)
+
+
 class FavoriteViewSet(viewsets.ModelViewSet):
     queryset = Favorite.objects.all()
     serializer_class = FavoriteSerializer
@@ -46,7 +46,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'movie_app.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'movie_app.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -89,6 +91,47 @@ DATABASES = {
     }
 }
 
+if os.getenv('POSTGRES_HOST'):
+    DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('POSTGRES_DB', 'postgres'),
+        'USER': os.getenv('POSTGRES_USER', 'postgres'),
+        'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+        'HOST': os.getenv('POSTGRES_HOST'),
+        'PORT': os.getenv('POSTGRES_PORT', '5432'),
+    }
+
+# Read replicas: SQLITE_REPLICAS=db_replica.sqlite3 (refresh it with manage.py sync_sqlite_replica)
+# or POSTGRES_REPLICA_HOSTS=replica1,replica2. Safe requests read from them, writes and the
+# requests that follow a write within REPLICA_STICKY_SECONDS stay on the primary.
+DATABASE_REPLICAS = []
+for number, name in enumerate(filter(None, os.getenv('SQLITE_REPLICAS', '').split(',')), start=1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'NAME': BASE_DIR / name}
+    DATABASE_REPLICAS.append(f'replica{number}')
+for number, host in enumerate(filter(None, os.getenv('POSTGRES_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'HOST': host}
+    DATABASE_REPLICAS.append(f'replica{number}')
+for alias in DATABASE_REPLICAS:
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+if DATABASE_REPLICAS:
+    DATABASE_ROUTERS = ['movie_app.routers.ReplicaRouter']
+    MIDDLEWARE.insert(1, 'movie_app.routers.ReplicaPinningMiddleware')
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'movie-app'),
+    }
+}
+
+CATALOGUE_CACHE_TIMEOUT = 60 * 60
+
+# ASGI profile: serve the catalogue and detail routes with the views from movie_app/async_views.py,
+# and run their independent queries on separate connections at the same time
+ASYNC_CATALOGUE_VIEWS = os.getenv('ASYNC_CATALOGUE_VIEWS') == '1'
+ASYNC_PARALLEL_QUERIES = os.getenv('ASYNC_PARALLEL_QUERIES') == '1'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -118,7 +161,7 @@ LOCALE_PATHS = [
     BASE_DIR / 'locale/',
 ]
 
-TIME_ZONE = 'Asia/Bishkek '
+TIME_ZONE = 'Asia/Bishkek'
 
 USE_L10N = True
 
@@ -139,6 +182,50 @@ MODELTRANSLATION_DEFAULT_LANGUAGE = 'en'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
+# set behind nginx to hand video streaming to its internal /protected-media/ location via X-Accel-Redirect
+MEDIA_ACCEL_REDIRECT_URL = os.getenv('MEDIA_ACCEL_REDIRECT_URL')
+# viewing events are buffered per worker and written in batches, see movie_app/viewing.py
+VIEWING_BUFFER_SIZE = int(os.getenv('VIEWING_BUFFER_SIZE', 500))
+VIEWING_FLUSH_INTERVAL = float(os.getenv('VIEWING_FLUSH_INTERVAL', 2))
+# memory-mapped similar movies index written by build_similar_movies, see movie_app/similar.py
+SIMILAR_MOVIES_DIR = os.getenv('SIMILAR_MOVIES_DIR', os.path.join(BASE_DIR, 'var', 'similar'))
+SIMILAR_MOVIES_K = int(os.getenv('SIMILAR_MOVIES_K', 50))
+# threads rescoring movies after relation edits, 0 rescores them in the request thread
+SIMILAR_REFRESH_WORKERS = int(os.getenv('SIMILAR_REFRESH_WORKERS', 1))
+# leaderboards written by refresh_leaderboards, see movie_app/leaderboards.py
+LEADERBOARD_SIZE = int(os.getenv('LEADERBOARD_SIZE', 200))
+LEADERBOARD_PRIOR_VOTES = int(os.getenv('LEADERBOARD_PRIOR_VOTES', 10))
+LEADERBOARD_TRENDING_DAYS = int(os.getenv('LEADERBOARD_TRENDING_DAYS', 7))
+LEADERBOARD_HALF_LIFE_HOURS = float(os.getenv('LEADERBOARD_HALF_LIFE_HOURS', 48))
+# trending recounts this much of the latest activity on every refresh, longer than viewing events wait in a buffer
+LEADERBOARD_SETTLE_SECONDS = int(os.getenv('LEADERBOARD_SETTLE_SECONDS', 300))
+# processes resizing uploaded images, 0 renders them in the request thread
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv('IMAGE_DERIVATIVE_WORKERS', 2))
+# request metrics on /metrics/, see movie_app/metrics.py. Under gunicorn set PROMETHEUS_MULTIPROC_DIR
+# so the workers share them, gunicorn.conf.py empties it at startup. Scrapers send
+# Authorization: Bearer METRICS_TOKEN, staff sessions need no token.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# queries at least this slow go to the movie_app.slow_queries log with their view and serializer
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+SLOW_QUERY_LOG = os.getenv('SLOW_QUERY_LOG')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'slow_queries': {'format': '%(asctime)s %(process)d %(message)s'},
+    },
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.handlers.WatchedFileHandler', 'filename': SLOW_QUERY_LOG, 'formatter': 'slow_queries',
+        } if SLOW_QUERY_LOG else {
+            'class': 'logging.StreamHandler', 'formatter': 'slow_queries',
+        },
+    },
+    'loggers': {
+        'movie_app.slow_queries': {'handlers': ['slow_queries'], 'level': 'WARNING', 'propagate': False},
+    },
+}
 
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
@@ -152,11 +239,20 @@ AUTH_USER_MODEL = 'movie_app.UserProfile'
 
 
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'movie_app.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'movie_app.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter'],
         'DEFAULT_AUTHENTICATION_CLASSES': (
-            'rest_framework_simplejwt.authentication.JWTAuthentication',
+            'movie_app.authentication.TokenUserAuthentication',
         )
 
 }
@@ -179,6 +275,8 @@ SIMPLE_JWT = {
     "BLACKLIST_AFTER_ROTATION": False,
     "UPDATE_LAST_LOGIN": False,
 }
+# how long a worker trusts its cached view of a login session (logout, status, is_active)
+TOKEN_REVOCATION_CACHE_SECONDS = int(os.getenv('TOKEN_REVOCATION_CACHE_SECONDS', 30))
 
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -8,6 +8,7 @@ from rest_framework_swagger.views import get_swagger_view
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework import permissions
+from movie_app.metrics import metrics_view
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -17,7 +18,10 @@ schema_view = get_schema_view(
     permission_classes=(permissions.AllowAny,),
 )
 
-urlpatterns = i18n_patterns(
+urlpatterns = [
+    # outside the language prefix, scrapers do not follow the redirect to /en/
+    path('metrics/', metrics_view, name='metrics'),
+] + i18n_patterns(
     path('admin/', admin.site.urls),
     path('', include('movie_app.urls')),
     path('docs/', schema_view.with_ui('swagger', cache_timeout=0),name='schema-swagger-ui'),